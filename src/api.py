@@ -1,67 +1,192 @@
 #!/usr/bin/env python3
 import os
 import sys
-from typing import Optional
+from typing import List, Optional
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Response
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import asyncio
-from datetime import datetime
+import json
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-from store_selector import FlippStoreSelector
 from flyer_downloader import FlyerDownloader
 from gemini_recommender import GeminiRecommender
 from image_stitcher import ImageStitcher
 from discord_notifier import DiscordNotifier
+from job_manager import ALL_JOBS, JobManager
+from driver_pool import DriverPool
+from browser_lifecycle import BrowserLifecycle
+from selector_resolver import shared_resolver
+from flipp_session import FlippSessionStore
+from flyer_cache import FlyerSnapshotCache, flyer_week_end
+from async_downloader import close_shared_downloader
+from discord_sender import close_shared_sender
+from flyer_discovery import HttpFlyerDiscovery, SeleniumFlyerDiscovery
+from result_cache import ResultCache
+from item_index import SaleItemIndex
+from delivery_queue import DeliveryQueue
+from prewarm_scheduler import PrewarmScheduler
+from store_registry import DEFAULT_STORE, STORES, parse_stores, store_name, store_search_path, stores_from_env
 
 # Load env early
 load_dotenv()
 
-# Shared selector reference (initialized by lifespan)
-global_selector = None
+# Pool of warm browsers leased to jobs (initialized by lifespan)
+driver_pool = None
+
+# Flipp cookies/localStorage per postal code, restored by pooled browsers to skip postal entry
+flipp_sessions = FlippSessionStore(
+    directory=os.getenv('FLIPP_SESSION_DIR', os.path.join('data', 'flipp_sessions')),
+    max_age_seconds=float(os.getenv('FLIPP_SESSION_MAX_AGE_HOURS', '72')) * 3600,
+)
+
+# Flyer snapshots shared across jobs and postal codes
+flyer_cache = FlyerSnapshotCache(
+    cache_dir=os.getenv('FLYER_CACHE_DIR', os.path.join('data', 'flyer_cache')),
+    week_end_day=int(os.getenv('FLYER_WEEK_END_DAY', '2')),
+    match_fsa=os.getenv('FLYER_CACHE_MATCH_FSA', 'true').lower() == 'true',
+)
+
+# Gemini results keyed by flyer content + request parameters
+recommendation_cache = ResultCache(
+    path=os.getenv('RECOMMENDATION_CACHE_PATH', os.path.join('data', 'recommendation_cache.json')),
+    max_entries=int(os.getenv('RECOMMENDATION_CACHE_MAX_ENTRIES', '200')),
+    ttl_seconds=float(os.getenv('RECOMMENDATION_CACHE_TTL_HOURS', '168')) * 3600,
+)
+
+# Sale items extracted from each flyer page, kept apart so they never evict meal plans
+page_item_cache = ResultCache(
+    path=os.getenv('PAGE_ITEM_CACHE_PATH', os.path.join('data', 'page_item_cache.json')),
+    max_entries=int(os.getenv('PAGE_ITEM_CACHE_MAX_ENTRIES', '1000')),
+    ttl_seconds=float(os.getenv('RECOMMENDATION_CACHE_TTL_HOURS', '168')) * 3600,
+)
+
+# Sale items extracted from each flyer, for text-only follow-up plans and local queries
+sale_item_index = SaleItemIndex(
+    os.getenv('SALE_ITEM_INDEX_PATH', os.path.join('data', 'sale_items.db')),
+    retention_days=float(os.getenv('SALE_ITEM_RETENTION_DAYS', '28')),
+)
+
+# Persistent fan-out of finished plans to subscriber webhooks, retried independently of jobs
+delivery_queue = DeliveryQueue(
+    path=os.getenv('DELIVERY_QUEUE_PATH', os.path.join('data', 'deliveries.db')),
+    workers=int(os.getenv('DELIVERY_WORKERS', '4')),
+    max_attempts=int(os.getenv('DELIVERY_MAX_ATTEMPTS', '8')),
+)
+
+# Bounded worker pool running generation jobs concurrently
+job_manager = JobManager(
+    max_workers=int(os.getenv('MAX_CONCURRENT_JOBS', '2')),
+    max_retained_jobs=int(os.getenv('MAX_RETAINED_JOBS', '50')),
+)
+
+
+def next_flyer_rollover(now=None):
+    """Start of the next flyer week, right after the current one ends"""
+    return flyer_week_end(now, end_weekday=flyer_cache.week_end_day) + timedelta(seconds=1)
+
+
+def internal_job(job_id, data_dir, output_dir, message):
+    """Job-shaped state for flyer fetches that are not user jobs (pre-warming, one store of a multi-store job)"""
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    return {
+        "id": job_id,
+        "internal": True,
+        "status": "processing",
+        "stage": "starting",
+        "status_message": message,
+        "progress": None,
+        "metrics": {},
+        "data_dir": data_dir,
+        "output_dir": output_dir,
+    }
+
+
+def prewarm_flyer(postal_code, force=False, store=DEFAULT_STORE):
+    """Fetch and cache a store's flyer for a postal code outside any user job (for the pre-warm scheduler)"""
+    job_id = f"prewarm-{uuid.uuid4().hex[:12]}"
+    job = internal_job(job_id, os.path.join(job_manager.data_dir, "jobs", job_id),
+                       os.path.join(job_manager.output_dir, "jobs", job_id), "Pre-warming flyer...")
+    try:
+        snapshot = fetch_flyer_snapshot(job, postal_code, refresh=force, store=store)
+        if snapshot.get("partial"):
+            raise Exception("Some flyer pages failed to download; not caching a partial flyer")
+        return snapshot
+    finally:
+        # The cache keeps its own copy of the pages and stitched image
+        job_manager.events.discard(job_id)
+        for path in (job["data_dir"], job["output_dir"]):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# Refreshes flyers for busy postal codes right after each weekly rollover, before users ask
+prewarm_scheduler = PrewarmScheduler(
+    postal_codes=[code for code in os.getenv('PREWARM_POSTAL_CODES', '').split(',') if code.strip()],
+    refresh=prewarm_flyer,
+    lookup=flyer_cache.lookup,
+    next_rollover=next_flyer_rollover,
+    stores=stores_from_env(),
+    concurrency=int(os.getenv('PREWARM_CONCURRENCY', '1')),
+    jitter_seconds=float(os.getenv('PREWARM_JITTER_MINUTES', '30')) * 60,
+    max_retries=int(os.getenv('PREWARM_MAX_RETRIES', '5')),
+    retry_base_seconds=float(os.getenv('PREWARM_RETRY_MINUTES', '5')) * 60,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Lifespan handler to initialize and close a shared browser selector."""
-    global global_selector
+    """Lifespan handler to start and close the shared browser pool."""
+    global driver_pool
     try:
         headless_env = os.getenv('HEADLESS', 'true').lower() == 'true'
-        preload = os.getenv('PRELOAD_BROWSER', 'false').lower() == 'true'
-        print(f"Config: headless={headless_env}, preload_browser={preload}")
-
-        # Create selector object but avoid blocking startup by default.
-        # If PRELOAD_BROWSER=true, initialize the driver in a background thread.
-        global_selector = FlippStoreSelector(headless=headless_env)
+        preload = os.getenv('PRELOAD_BROWSER', 'true').lower() == 'true'
+        # Enough browsers for every concurrent job to fetch its configured stores side by side
+        default_pool_size = job_manager.max_workers * min(multi_store_concurrency(), len(stores_from_env()))
+        pool_size = int(os.getenv('DRIVER_POOL_SIZE', str(default_pool_size)))
+        print(f"Config: headless={headless_env}, preload_browser={preload}, "
+              f"max_concurrent_jobs={job_manager.max_workers}, driver_pool_size={pool_size}")
 
-        if preload:
-            async def _init_selector():
-                try:
-                    await asyncio.to_thread(global_selector.setup_driver)
-                    try:
-                        if getattr(global_selector, "driver", None):
-                            await asyncio.to_thread(global_selector.driver.get, "https://flipp.com/")
-                    except Exception as e:
-                        print(f"Warning: preload navigation failed: {e}")
-                except Exception as e:
-                    print(f"Warning: failed to setup driver in background: {e}")
-
-            # schedule background initialization without blocking startup
-            asyncio.create_task(_init_selector())
+        # Browsers are started in background threads so startup is never blocked.
+        # With PRELOAD_BROWSER=false they are created on first use and kept warm afterwards.
+        driver_pool = DriverPool(
+            size=pool_size,
+            headless=headless_env,
+            health_check_interval=float(os.getenv('DRIVER_HEALTH_CHECK_INTERVAL', '60')),
+            session_store=flipp_sessions,
+            lifecycle=BrowserLifecycle(
+                max_uses=int(os.getenv('BROWSER_MAX_USES', '50')),
+                max_rss_mb=float(os.getenv('BROWSER_MAX_RSS_MB', '1500')),
+                clear_http_cache=os.getenv('BROWSER_CLEAR_HTTP_CACHE', 'false').lower() == 'true',
+            ),
+        )
+        driver_pool.start(prewarm=preload)
+        delivery_queue.start()
+        prewarm_scheduler.start()
 
         yield
 
     finally:
+        prewarm_scheduler.stop()
+        job_manager.shutdown(wait=False)
+        delivery_queue.stop()
+        close_shared_downloader()
+        close_shared_sender()
         try:
-            if global_selector:
-                print("Closing shared browser...")
-                global_selector.close()
-                global_selector = None
+            if driver_pool:
+                print("Closing browser pool...")
+                driver_pool.close()
+                driver_pool = None
         except Exception as e:
-            print(f"Error closing shared browser: {e}")
+            print(f"Error closing browser pool: {e}")
 
 
 app = FastAPI(title="No Frills Cooking Recommendations", lifespan=lifespan)
@@ -83,21 +208,63 @@ class RecommendationRequest(BaseModel):
     num_meals: int = 7
     cuisine: str = "Chinese"
     special_notes: str = ""
+    # Store registry keys (e.g. ["nofrills", "freshco"]); FLYER_STORES when empty
+    stores: Optional[List[str]] = None
     headless: bool = True
     auto_send_discord: bool = True
 
 class DiscordRequest(BaseModel):
     webhook_url: str
+    job_id: Optional[str] = None
+
+class SubscriberRequest(BaseModel):
+    webhook_url: str
+    name: Optional[str] = None
+
+
+def job_status_view(job):
+    """Public status fields for a job"""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_message": job["status_message"],
+        "timestamp": job["timestamp"],
+        "error": job["error"],
+        "has_results": job["recommendations"] is not None,
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "queue_position": job_manager.queue_position(job["id"]) if job["status"] == "queued" else 0,
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "metrics": job["metrics"],
+    }
+
+
+def get_job_or_404(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+def recommendations_response(job):
+    if job is None or job["recommendations"] is None:
+        raise HTTPException(status_code=404, detail="No recommendations available yet")
+
+    return {
+        "job_id": job["id"],
+        "recommendations": job["recommendations"],
+        "flyer_image": job["flyer_image"],
+        "timestamp": job["timestamp"]
+    }
+
+
+def flyer_image_response(job):
+    if job and job["flyer_image"] and os.path.exists(job["flyer_image"]):
+        return FileResponse(job["flyer_image"], media_type="image/jpeg")
+    raise HTTPException(status_code=404, detail="Flyer image not found")
 
-# Global state to store latest results
-latest_results = {
-    "recommendations": None,
-    "flyer_image": None,
-    "timestamp": None,
-    "status": "idle",
-    "status_message": "Ready",
-    "error": None
-}
 
 @app.get("/")
 async def read_root():
@@ -122,169 +289,510 @@ async def get_default_config():
         "num_people": int(os.getenv('NUM_PEOPLE', '2')),
         "num_meals": int(os.getenv('NUM_MEALS', '7')),
         "cuisine": os.getenv('CUISINE', 'Chinese'),
+        "stores": stores_from_env(),
         "headless": os.getenv('HEADLESS', 'true').lower() == 'true',
         "discord_webhook_url": os.getenv('DISCORD_WEBHOOK_URL', '')
     }
 
 @app.get("/api/status")
 async def get_status():
-    """Get current processing status"""
-    return {
-        "status": latest_results["status"],
-        "status_message": latest_results["status_message"],
-        "timestamp": latest_results["timestamp"],
-        "error": latest_results["error"],
-        "has_results": latest_results["recommendations"] is not None
-    }
+    """Get the status of the most recent job (kept for older clients)"""
+    job = job_manager.latest()
+    if job is None:
+        return {
+            "job_id": None,
+            "status": "idle",
+            "status_message": "Ready",
+            "timestamp": None,
+            "error": None,
+            "has_results": job_manager.latest(status="completed") is not None
+        }
+    status = job_status_view(job)
+    status["has_results"] = job_manager.latest(status="completed") is not None
+    return status
 
 @app.get("/api/recommendations")
 async def get_recommendations():
-    """Get the latest recommendations"""
-    if latest_results["recommendations"] is None:
-        raise HTTPException(status_code=404, detail="No recommendations available yet")
-    
-    return {
-        "recommendations": latest_results["recommendations"],
-        "flyer_image": latest_results["flyer_image"],
-        "timestamp": latest_results["timestamp"]
-    }
+    """Get the latest completed recommendations"""
+    return recommendations_response(job_manager.latest(status="completed"))
 
 @app.get("/api/flyer-image")
 async def get_flyer_image():
-    """Serve the flyer image"""
-    if latest_results["flyer_image"] and os.path.exists(latest_results["flyer_image"]):
-        return FileResponse(latest_results["flyer_image"], media_type="image/jpeg")
-    raise HTTPException(status_code=404, detail="Flyer image not found")
+    """Serve the flyer image of the latest completed job"""
+    return flyer_image_response(job_manager.latest(status="completed"))
 
-def generate_recommendations_task(request: RecommendationRequest):
-    """Background task to generate recommendations"""
-    latest_results["status"] = "processing"
-    latest_results["status_message"] = "Initializing..."
-    latest_results["error"] = None
-    selector = None
-    
+@app.get("/api/jobs")
+async def list_jobs():
+    """Get worker pool usage and job counts"""
+    return job_manager.stats()
+
+@app.get("/api/driver-pool")
+async def get_driver_pool_stats():
+    """Get browser pool utilization and lease wait times"""
+    if driver_pool is None:
+        raise HTTPException(status_code=503, detail="Browser pool not started")
+    return driver_pool.stats()
+
+@app.get("/api/selectors")
+async def get_selector_stats():
+    """Get the learned selector for each Flipp form element with per-selector match times and timeouts"""
+    return shared_resolver().stats()
+
+@app.get("/api/driver-pool/browsers")
+async def get_driver_pool_browsers():
+    """Get memory, tab count, uses and age of each pooled browser"""
+    if driver_pool is None:
+        raise HTTPException(status_code=503, detail="Browser pool not started")
+    return await asyncio.to_thread(driver_pool.browser_stats)
+
+@app.get("/api/flyer-cache")
+async def get_flyer_cache_stats():
+    """Get flyer snapshot cache size and hit/miss counters"""
+    return flyer_cache.stats()
+
+@app.get("/api/stores")
+async def list_stores():
+    """Get the store registry and the stores compared by default"""
+    return {
+        "default": stores_from_env(),
+        "stores": [{"key": key, "name": info["name"], "search_path": store_search_path(key)}
+                   for key, info in STORES.items()],
+    }
+
+@app.get("/api/prewarm")
+async def get_prewarm_schedule():
+    """Get the flyer pre-warm schedule with each postal code and store's next run and last refresh"""
+    return prewarm_scheduler.schedule()
+
+@app.post("/api/prewarm")
+async def trigger_prewarm(postal_code: Optional[str] = None, store: Optional[str] = None):
+    """Refresh configured flyers now: all of them, or one postal code and/or store"""
+    try:
+        queued = prewarm_scheduler.trigger(postal_code, store=store)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if (postal_code or store) and not queued:
+        raise HTTPException(status_code=404, detail="Postal code or store not configured for pre-warming or already running")
+    return {"queued": queued}
+
+@app.get("/api/recommendation-cache")
+async def get_recommendation_cache_stats():
+    """Get Gemini result cache size and hit/miss counters"""
+    return {**recommendation_cache.stats(), "page_items": page_item_cache.stats()}
+
+@app.get("/api/items")
+async def search_items(postal_code: Optional[str] = None, flyer_id: Optional[str] = None,
+                       category: Optional[str] = None, max_price: Optional[float] = None,
+                       q: Optional[str] = None, store: Optional[str] = None, limit: int = 200):
+    """Query indexed sale items from current flyers, e.g. ?postal_code=M5V2T6&category=protein&max_price=5"""
+    try:
+        store = parse_stores(store)[0] if store else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    items = await asyncio.to_thread(
+        sale_item_index.search, postal_code=postal_code, flyer_id=flyer_id, category=category,
+        max_price=max_price, query=q, store=store, limit=min(max(1, limit), 1000),
+    )
+    return {"count": len(items), "items": items}
+
+@app.get("/api/item-index")
+async def get_item_index_stats():
+    """Get indexed flyer, postal code and item counts"""
+    return await asyncio.to_thread(sale_item_index.stats)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Get the processing status of a job"""
+    return job_status_view(get_job_or_404(job_id))
+
+def event_stream_response(channel, queue, backlog, event_ids=True):
+    """Server-Sent Events response replaying `backlog`, then forwarding the channel's live events"""
+
+    async def event_stream():
+        try:
+            pending = list(backlog)
+            while True:
+                if pending:
+                    event = pending.pop(0)
+                else:
+                    try:
+                        event = await asyncio.wait_for(queue.get(), timeout=15)
+                    except asyncio.TimeoutError:
+                        # Comment line keeps proxies from closing an idle stream
+                        yield ": keepalive\n\n"
+                        continue
+                event_id = f"id: {event['seq']}\n" if event_ids else ""
+                yield f"{event_id}event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if event["type"] == "end":
+                    break
+        finally:
+            job_manager.events.unsubscribe(channel, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/events")
+async def stream_all_job_events():
+    """Server-Sent Events with status changes of every job, starting with the jobs currently active"""
+    queue, _ = job_manager.events.subscribe(ALL_JOBS, asyncio.get_running_loop())
+    active = [dict(job_manager.status_event(job), type="status", seq=0, time=None)
+              for job in job_manager.active_jobs()]
+    return event_stream_response(ALL_JOBS, queue, active, event_ids=False)
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events for a job: stage and progress changes (`status`) and the meal plan text
+    as it is generated (`token`), then a final `end` event"""
+    get_job_or_404(job_id)
+    queue, backlog = job_manager.events.subscribe(job_id, asyncio.get_running_loop())
+    if last_event_id and last_event_id.isdigit():
+        # Browser reconnect: resume after the last event it received
+        backlog = [event for event in backlog if event["seq"] > int(last_event_id)]
+    return event_stream_response(job_id, queue, backlog)
+
+@app.get("/api/jobs/{job_id}/recommendations")
+async def get_job_recommendations(job_id: str):
+    """Get the recommendations produced by a job"""
+    return recommendations_response(get_job_or_404(job_id))
+
+@app.get("/api/jobs/{job_id}/flyer-image")
+async def get_job_flyer_image(job_id: str):
+    """Serve the stitched flyer image produced by a job"""
+    return flyer_image_response(get_job_or_404(job_id))
+
+def discover_flyer_image_urls(job, postal_code, store=DEFAULT_STORE):
+    """Find a store's flyer page URLs with the configured discovery backends, in order (FLYER_DISCOVERY).
+
+    Returns (urls, captured_pages): pages the browser already fetched are saved during discovery.
+    """
+    mode = os.getenv('FLYER_DISCOVERY', 'auto').lower()
+    backends = []
+    if mode in ('auto', 'http'):
+        backends.append(HttpFlyerDiscovery(
+            base_url=os.getenv('FLIPP_BASE_URL', 'https://flipp.com'),
+            timeout=float(os.getenv('FLYER_DISCOVERY_HTTP_TIMEOUT', '5')),
+            max_flyer_links=int(os.getenv('FLYER_DISCOVERY_MAX_LINKS', '2')),
+            store=store,
+        ))
+    if mode in ('auto', 'selenium'):
+        backends.append(SeleniumFlyerDiscovery(
+            driver_pool,
+            lease_timeout=float(os.getenv('DRIVER_LEASE_TIMEOUT', '300')),
+            output_dir=job["data_dir"],
+            on_status=lambda message: job_manager.update(job, "browser", message),
+            store=store,
+        ))
+
+    job_manager.update(job, "discovering", "Finding flyer pages...")
+    for backend in backends:
+        image_urls = backend.find_flyer_image_urls(postal_code)
+        if backend.name == "selenium":
+            job["metrics"]["browser_wait_seconds"] = round(backend.lease_wait_seconds, 3)
+            job["metrics"]["store_selection"] = backend.last_select_stats
+            job["metrics"]["page_readiness"] = backend.last_readiness
+        if image_urls:
+            job["metrics"]["flyer_discovery"] = backend.name
+            return image_urls, backend.captured_pages
+        print(f"[job {job['id']}] {backend.name} discovery found no flyer pages")
+    return [], {}
+
+def fetch_flyer_snapshot(job, postal_code, refresh=False, store=DEFAULT_STORE):
+    """Return the store's flyer snapshot serving a postal code, building and caching it on a miss (or with refresh)"""
+    snapshot = None if refresh else flyer_cache.lookup(postal_code, store)
+    if snapshot:
+        job["metrics"]["flyer_cache"] = "hit"
+        print(f"[job {job['id']}] Using cached flyer {snapshot['flyer_id']} for {postal_code}")
+        return snapshot
+
+    job["metrics"]["flyer_cache"] = "miss"
+
+    # Step 1: Find the flyer pages (over HTTP, or with a browser as fallback)
+    image_urls, captured_pages = discover_flyer_image_urls(job, postal_code, store)
+    if not image_urls:
+        raise Exception("No flyer images found")
+
+    # A neighbouring postal code may already have cached this exact flyer
+    snapshot = flyer_cache.get(flyer_cache.flyer_id_for_urls(image_urls))
+    if snapshot:
+        job["metrics"]["flyer_cache"] = "shared"
+        print(f"[job {job['id']}] Flyer {snapshot['flyer_id']} already cached; skipping download")
+        return flyer_cache.link(postal_code, snapshot["flyer_id"], store)
+
+    # Steps 2-3: Download flyer images, stitching each page in as soon as it lands
+    total = len(image_urls)
+    job_manager.update(job, "downloading", f"Downloading flyer pages (0/{total})...", done=0, total=total)
+    print(f"[job {job['id']}] Downloading and stitching flyer images...")
+    downloader = FlyerDownloader(None, output_dir=job["data_dir"])
+    stitcher = ImageStitcher(output_dir=job["output_dir"])
+
+    def on_placed(placed, total_pages):
+        # Placement runs during the download too; only report it once downloads are done
+        if job["stage"] == "stitching":
+            job_manager.update(job, "stitching", f"Stitching flyer pages ({placed}/{total_pages})...",
+                               done=placed, total=total_pages)
+
+    stream = stitcher.begin_stream(total, output_filename="complete_flyer.jpg", on_placed=on_placed)
+    finished = {"count": 0}
+
+    def on_page(page):
+        finished["count"] += 1
+        job_manager.update(job, "downloading", f"Downloading flyer pages ({finished['count']}/{total})...",
+                           done=finished["count"], total=total)
+        if page["path"]:
+            stream.add_page(page["index"], page["path"])
+
+    flyer_files = downloader.download_images(image_urls, on_page=on_page, captured_pages=captured_pages)
+    job_manager.update(job, "stitching", f"Stitching flyer pages ({stream.placed}/{len(flyer_files)})...",
+                       done=stream.placed, total=len(flyer_files))
+    stitched_image = stream.finish()
+    job["metrics"]["download"] = downloader.last_download_stats
+    job["metrics"]["stitch"] = stitcher.last_stats
+    if not flyer_files:
+        raise Exception("No flyer images downloaded")
+    if not stitched_image:
+        raise Exception("Failed to stitch images")
+    failed = (downloader.last_download_stats or {}).get("failed")
+    if failed:
+        # Caching it would serve the missing pages to every job until the week ends
+        print(f"[job {job['id']}] {failed} flyer page(s) failed to download; not caching this flyer")
+        job["metrics"]["flyer_cache"] = "partial"
+        return flyer_cache.uncached(image_urls, flyer_files, stitched_image, store=store)
+
+    return flyer_cache.store(postal_code, image_urls, flyer_files, stitched_image,
+                             page_digests=downloader.last_page_digests, store=store)
+
+def multi_store_concurrency():
+    return max(1, int(os.getenv('MULTI_STORE_CONCURRENCY', '4')))
+
+def store_fetch_workers(store_count):
+    """Stores one job fetches at the same time.
+
+    When discovery may need a browser, this is capped at the job's share of the driver pool, so
+    concurrent multi-store jobs queue for browsers in turn instead of starving each other.
+    """
+    workers = min(store_count, multi_store_concurrency())
+    if driver_pool is not None and os.getenv('FLYER_DISCOVERY', 'auto').lower() != 'http':
+        workers = min(workers, driver_pool.size // job_manager.max_workers)
+    return max(1, workers)
+
+def fetch_store_snapshots(job, postal_code, stores):
+    """Fetch several stores' flyer snapshots at the same time, each on its own worker (and pooled browser).
+
+    Wall time is close to the slowest store rather than the sum. Returns {store: snapshot} in
+    `stores` order for the stores that succeeded; per-store metrics go to job["metrics"]["stores"].
+    """
+    names = ", ".join(store_name(store) for store in stores)
+    job_manager.update(job, "fetching", f"Fetching flyers from {names}...", done=0, total=len(stores))
+    job["metrics"]["stores"] = {}
+    snapshots = {}
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def fetch(store):
+        store_job = internal_job(f"{job['id']}-{store}", os.path.join(job["data_dir"], store),
+                                 os.path.join(job["output_dir"], store), f"Fetching {store_name(store)} flyer...")
+        store_started = time.monotonic()
+        try:
+            snapshot, error = fetch_flyer_snapshot(store_job, postal_code, store=store), None
+        except Exception as e:
+            print(f"[job {job['id']}] {store_name(store)} flyer failed: {e}")
+            snapshot, error = None, str(e)
+        finally:
+            job_manager.events.discard(store_job["id"])
+        with lock:
+            job["metrics"]["stores"][store] = dict(store_job["metrics"], error=error,
+                                                   seconds=round(time.monotonic() - store_started, 3))
+            if snapshot:
+                snapshots[store] = snapshot
+            done = len(job["metrics"]["stores"])
+            job_manager.update(job, "fetching", f"Fetched flyers ({done}/{len(stores)} stores)...",
+                               done=done, total=len(stores))
+
+    workers = store_fetch_workers(len(stores))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="store-fetch") as executor:
+        list(executor.map(fetch, stores))
+
+    per_store = [metrics["seconds"] for metrics in job["metrics"]["stores"].values()]
+    job["metrics"]["flyer_fetch"] = {
+        "seconds": round(time.monotonic() - started, 3),
+        "slowest_store_seconds": max(per_store),
+        "sequential_seconds": round(sum(per_store), 3),
+    }
+    print(f"[job {job['id']}] Fetched {len(snapshots)}/{len(stores)} store flyers in "
+          f"{job['metrics']['flyer_fetch']['seconds']:.1f}s (sequential would be ~{sum(per_store):.1f}s)")
+    return {store: snapshots[store] for store in stores if store in snapshots}
+
+def combined_recommendations(job, request, recommender, stores, on_token):
+    """Plan meals from several stores' flyers in one analysis; returns (recommendations, combined flyer image)"""
+    snapshots = fetch_store_snapshots(job, request.postal_code, stores)
+    if not snapshots:
+        raise Exception("No store flyers could be fetched")
+
+    flyers = []
+    item_index_hits = {}
+    for store, snapshot in snapshots.items():
+        indexed_items = sale_item_index.items_for_flyer(snapshot["flyer_id"]) or None
+        item_index_hits[store] = "hit" if indexed_items else "miss"
+        if indexed_items:
+            sale_item_index.link_region(snapshot["flyer_id"], request.postal_code)
+        flyers.append({"store": store_name(store), "stitched_image": snapshot["stitched_image"],
+                       "page_files": snapshot["pages"], "items": indexed_items})
+    job["metrics"]["item_index"] = item_index_hits
+
+    # The stores' flyers side by side, for the UI and Discord
+    if len(snapshots) > 1:
+        stitcher = ImageStitcher(output_dir=job["output_dir"])
+        flyer_image = stitcher.stitch_images([flyer["stitched_image"] for flyer in flyers],
+                                             output_filename="combined_flyer.jpg")
+    else:
+        flyer_image = flyers[0]["stitched_image"]
+
+    job_manager.update(job, "analyzing", f"Comparing {len(flyers)} store flyers with Gemini AI...")
+    print(f"[job {job['id']}] Getting combined recommendations from Gemini AI...")
+    recommendations = recommender.get_combined_recommendations(
+        flyers,
+        num_people=request.num_people,
+        num_meals=request.num_meals,
+        cuisine_preference=request.cuisine,
+        special_notes=request.special_notes,
+        on_token=on_token,
+    )
+    for store, snapshot in snapshots.items():
+        items = recommender.last_store_items.get(store_name(store))
+        if items and not snapshot.get("partial"):
+            sale_item_index.index_flyer(snapshot["flyer_id"], items, snapshot["valid_to"],
+                                        postal_code=request.postal_code, model=recommender.model_name, store=store)
+    return recommendations, flyer_image or flyers[0]["stitched_image"]
+
+def generate_recommendations_task(job, request: RecommendationRequest):
+    """Worker task to generate recommendations for one job"""
     try:
         # Get Gemini API key
         gemini_api_key = os.getenv('GEMINI_API_KEY')
         if not gemini_api_key:
             raise Exception("GEMINI_API_KEY not found in .env file")
         
-        # Step 1: Use shared browser and set postal code
-        latest_results["status_message"] = "Setting up browser and postal code..."
-        print(f"Using shared browser for postal code: {request.postal_code}")
-        # Prefer the pre-initialized global selector; fall back to creating a temporary one
-        selector = global_selector
-        if not selector:
-            selector = FlippStoreSelector(headless=request.headless)
-            selector.setup_driver()
-
-        if not selector.select_store(postal_code=request.postal_code):
-            raise Exception("Failed to set postal code")
-        
-        # Step 2: Download flyer images
-        latest_results["status_message"] = "Downloading flyer images..."
-        print("Downloading flyer images...")
-        downloader = FlyerDownloader(selector.driver, output_dir="data")
-        flyer_files = downloader.download_flyers()
-        
-        if not flyer_files:
-            raise Exception("No flyer images downloaded")
-        
-        # Step 3: Stitch images together
-        latest_results["status_message"] = "Stitching flyer images together..."
-        print("Stitching flyer images...")
-        stitcher = ImageStitcher(output_dir="output")
-        stitched_image = stitcher.stitch_images(flyer_files, output_filename="complete_flyer.jpg")
-        
-        if not stitched_image:
-            raise Exception("Failed to stitch images")
-        
-        # Step 4: Get recommendations from Gemini
-        latest_results["status_message"] = "Analyzing flyer with Gemini AI..."
-        print("Getting recommendations from Gemini AI...")
-        recommender = GeminiRecommender(api_key=gemini_api_key)
-        recommendations = recommender.get_recommendations(
-            flyer_image_path=stitched_image,
-            num_people=request.num_people,
-            num_meals=request.num_meals,
-            cuisine_preference=request.cuisine,
-            special_notes=request.special_notes
+        stores = parse_stores(request.stores) or stores_from_env()
+        recommender = GeminiRecommender(
+            api_key=gemini_api_key,
+            cache=recommendation_cache,
+            page_cache=page_item_cache,
+            on_progress=lambda done, total: job_manager.update(
+                job, "analyzing", f"Reading flyer pages with Gemini AI ({done}/{total})...", done=done, total=total),
         )
+
+        def on_token(text):
+            if job["stage"] != "writing":
+                job_manager.update(job, "writing", "Writing meal plan...")
+            job_manager.events.publish(job["id"], "token", text=text)
+
+        if len(stores) > 1:
+            # Steps 1-4 for every store at once, then one plan across all of them
+            recommendations, stitched_image = combined_recommendations(job, request, recommender, stores, on_token)
+        else:
+            # Steps 1-3: Get the stitched flyer (from cache, or via browser + download + stitch)
+            snapshot = fetch_flyer_snapshot(job, request.postal_code, store=stores[0])
+            stitched_image = snapshot["stitched_image"]
+
+            # Step 4: Get recommendations from Gemini
+            job_manager.update(job, "analyzing", "Analyzing flyer with Gemini AI...")
+            print(f"[job {job['id']}] Getting recommendations from Gemini AI...")
+            indexed_items = sale_item_index.items_for_flyer(snapshot["flyer_id"]) or None
+            job["metrics"]["item_index"] = "hit" if indexed_items else "miss"
+            if indexed_items:
+                sale_item_index.link_region(snapshot["flyer_id"], request.postal_code)
+            recommendations = recommender.get_recommendations(
+                flyer_image_path=stitched_image,
+                num_people=request.num_people,
+                num_meals=request.num_meals,
+                cuisine_preference=request.cuisine,
+                special_notes=request.special_notes,
+                page_files=snapshot["pages"],
+                items=indexed_items,
+                on_token=on_token,
+                store_name=store_name(stores[0]),
+            )
+            if recommender.last_items and not snapshot.get("partial"):
+                sale_item_index.index_flyer(snapshot["flyer_id"], recommender.last_items, snapshot["valid_to"],
+                                            postal_code=request.postal_code, model=recommender.model_name,
+                                            store=stores[0])
+        job["metrics"]["recommendation_cache"] = "hit" if recommender.last_cache_hit else "miss"
+        if recommender.last_preprocess_stats:
+            job["metrics"]["upload_image"] = recommender.last_preprocess_stats
+        if recommender.last_map_stats:
+            job["metrics"]["page_analysis"] = recommender.last_map_stats
+        if recommender.last_generation_stats:
+            job["metrics"]["generation"] = recommender.last_generation_stats
         
         if not recommendations:
             raise Exception("Failed to get recommendations")
         
         # Save recommendations
-        latest_results["status_message"] = "Saving recommendations..."
-        recommender.save_recommendations(recommendations)
+        job_manager.update(job, "saving", "Saving recommendations...")
+        recommender.save_recommendations(
+            recommendations,
+            output_file=os.path.join(job["output_dir"], "recommendations.txt")
+        )
         
         # Update results
-        latest_results["recommendations"] = recommendations
-        latest_results["flyer_image"] = stitched_image
-        latest_results["timestamp"] = datetime.now().isoformat()
-        latest_results["status"] = "completed"
-        latest_results["status_message"] = "Complete!"
+        job["recommendations"] = recommendations
+        job["flyer_image"] = stitched_image
+        job["timestamp"] = datetime.now().isoformat()
+        job["status"] = "completed"
         
-        print("Recommendations generated successfully!")
+        print(f"[job {job['id']}] Recommendations generated successfully!")
         
-        # Auto-send to Discord if webhook is configured and auto_send is enabled
+        # Hand the plan to the delivery queue: subscribers always, DISCORD_WEBHOOK_URL if auto_send is enabled
         discord_webhook = os.getenv('DISCORD_WEBHOOK_URL')
-        if discord_webhook and request.auto_send_discord:
-            latest_results["status_message"] = "Sending to Discord..."
-            print(f"Auto-sending recommendations to Discord (webhook configured: {bool(discord_webhook)})...")
-            try:
-                notifier = DiscordNotifier(discord_webhook)
-                if notifier.send_recommendations(recommendations, stitched_image):
-                    print("✓ Successfully auto-sent to Discord")
-                    latest_results["status_message"] = "Complete! Sent to Discord."
-                else:
-                    print("✗ Failed to auto-send to Discord")
-            except Exception as e:
-                print(f"✗ Error auto-sending to Discord: {e}")
-        elif not discord_webhook and request.auto_send_discord:
+        if not discord_webhook and request.auto_send_discord:
             print("⚠️  Auto-send requested but DISCORD_WEBHOOK_URL not configured in .env")
+        extra_webhooks = [discord_webhook] if discord_webhook and request.auto_send_discord else []
+        deliveries = delivery_queue.enqueue(job["id"], recommendations, stitched_image, extra_webhooks)
+        job["metrics"]["deliveries"] = deliveries
+        if deliveries:
+            job_manager.update(job, "completed", f"Complete! Queued for {deliveries} Discord destination(s).")
+        else:
+            job_manager.update(job, "completed", "Complete!")
         
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"[job {job['id']}] Error: {e}")
         import traceback
         traceback.print_exc()
-        latest_results["status"] = "error"
-        latest_results["status_message"] = f"Error: {str(e)}"
-        latest_results["error"] = str(e)
-        
-    finally:
-        # Do not close the shared selector; only close if we created a temporary one
-        try:
-            if selector and selector is not global_selector:
-                selector.close()
-        except Exception:
-            pass
+        job["status"] = "error"
+        job["status_message"] = f"Error: {str(e)}"
+        job["error"] = str(e)
 
 @app.post("/api/generate")
-async def generate_recommendations(request: RecommendationRequest, background_tasks: BackgroundTasks):
-    """Generate cooking recommendations"""
-    if latest_results["status"] == "processing":
-        raise HTTPException(status_code=409, detail="Already processing a request")
-    
-    # Run generation in background
-    background_tasks.add_task(generate_recommendations_task, request)
+async def generate_recommendations(request: RecommendationRequest):
+    """Queue a recommendation job and return its ID"""
+    try:
+        request.stores = parse_stores(request.stores) or None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job = job_manager.submit(generate_recommendations_task, request)
     
     return {
         "message": "Recommendation generation started",
-        "status": "processing"
+        "job_id": job["id"],
+        "status": job["status"]
     }
 
 @app.post("/api/send-discord")
 async def send_to_discord(request: DiscordRequest):
     """Send recommendations to Discord"""
-    if latest_results["recommendations"] is None:
+    if request.job_id:
+        job = get_job_or_404(request.job_id)
+    else:
+        job = job_manager.latest(status="completed")
+
+    if job is None or job["recommendations"] is None:
         raise HTTPException(status_code=404, detail="No recommendations available to send")
     
     try:
         notifier = DiscordNotifier(request.webhook_url)
-        success = notifier.send_recommendations(
-            latest_results["recommendations"],
-            latest_results["flyer_image"]
+        success = await notifier.send_recommendations_async(
+            job["recommendations"],
+            job["flyer_image"]
         )
         
         if success:
@@ -292,9 +800,56 @@ async def send_to_discord(request: DiscordRequest):
         else:
             raise HTTPException(status_code=500, detail="Failed to send to Discord")
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error sending to Discord: {str(e)}")
 
+@app.post("/api/subscribers")
+async def add_subscriber(request: SubscriberRequest):
+    """Subscribe a Discord webhook to every generated meal plan"""
+    if not request.webhook_url.startswith(("https://", "http://")):
+        raise HTTPException(status_code=400, detail="webhook_url must be an http(s) URL")
+    return await asyncio.to_thread(delivery_queue.add_subscriber, request.webhook_url, request.name)
+
+@app.get("/api/subscribers")
+async def list_subscribers():
+    """List active subscriber webhooks (tokens masked)"""
+    subscribers = await asyncio.to_thread(delivery_queue.subscribers)
+    return {"count": len(subscribers), "subscribers": subscribers}
+
+@app.delete("/api/subscribers/{subscriber_id}")
+async def remove_subscriber(subscriber_id: int):
+    """Unsubscribe a webhook"""
+    if not await asyncio.to_thread(delivery_queue.remove_subscriber, subscriber_id):
+        raise HTTPException(status_code=404, detail="Subscriber not found")
+    return {"message": "Subscriber removed", "success": True}
+
+@app.get("/api/deliveries")
+async def get_delivery_stats():
+    """Get delivery queue counts by status"""
+    return await asyncio.to_thread(delivery_queue.stats)
+
+@app.get("/api/deliveries/dead")
+async def get_dead_letters(limit: int = 100):
+    """List deliveries that exhausted their retries or hit a permanent error"""
+    deliveries = await asyncio.to_thread(delivery_queue.dead_letters, min(max(1, limit), 1000))
+    return {"count": len(deliveries), "deliveries": deliveries}
+
+@app.post("/api/deliveries/retry")
+async def retry_dead_letters(delivery_id: Optional[int] = None):
+    """Re-queue one dead-lettered delivery (?delivery_id=...) or all of them"""
+    count = await asyncio.to_thread(delivery_queue.retry, delivery_id)
+    if delivery_id is not None and not count:
+        raise HTTPException(status_code=404, detail="Dead-lettered delivery not found")
+    return {"message": f"Re-queued {count} deliveries", "requeued": count}
+
+@app.get("/api/jobs/{job_id}/deliveries")
+async def get_job_deliveries(job_id: str):
+    """Per-destination delivery state of a job's meal plan (kept after the job itself is evicted)"""
+    deliveries = await asyncio.to_thread(delivery_queue.deliveries_for_job, job_id)
+    return {"count": len(deliveries), "deliveries": deliveries}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+
+import aiohttp
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Referer': 'https://flipp.com/'
+}
+
+# HTTP statuses worth retrying; anything else is a permanent failure
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class AsyncImageDownloader:
+    """Download flyer pages on a background event loop sharing one keep-alive connection pool"""
+
+    def __init__(self, max_connections=20, per_host_limit=8, max_retries=3, backoff_base=0.5,
+                 backoff_max=8.0, request_timeout=30, deadline=120, headers=None,
+                 chunk_size=64 * 1024, hash_algorithm=None):
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.request_timeout = request_timeout
+        self.deadline = deadline
+        self.headers = headers or DEFAULT_HEADERS
+        self.chunk_size = chunk_size
+        self.hash_algorithm = hash_algorithm
+        self.loop = None
+        self.session = None
+        self.lock = threading.Lock()
+
+    def _ensure_loop(self):
+        """Start the event loop thread and HTTP session on first use"""
+        with self.lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True, name="image-downloader").start()
+
+            async def create_session():
+                connector = aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    limit_per_host=self.per_host_limit,
+                    keepalive_timeout=30,
+                )
+                return aiohttp.ClientSession(
+                    connector=connector,
+                    headers=self.headers,
+                    timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                )
+
+            self.session = asyncio.run_coroutine_threadsafe(create_session(), loop).result()
+            self.loop = loop
+
+    def _backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, never shorter than a server-provided Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def _stream_to_file(self, response, path):
+        """Write the body to a temp file chunk by chunk, then atomically rename it into place.
+
+        Only one chunk is held in memory regardless of page size; the content hash
+        (if enabled) is computed on the same pass.
+        """
+        hasher = hashlib.new(self.hash_algorithm) if self.hash_algorithm else None
+        tmp_path = f"{path}.part"
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+                    if hasher:
+                        hasher.update(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return size, hasher.hexdigest() if hasher else None
+
+    async def _fetch(self, index, url, path):
+        """Download one page with retries; returns a per-page stats dict"""
+        started = time.monotonic()
+        result = {"index": index, "url": url, "path": None, "status": None, "bytes": 0,
+                  "seconds": None, "attempts": 0, "error": None, "digest": None}
+
+        for attempt in range(self.max_retries + 1):
+            result["attempts"] = attempt + 1
+            retry_after = None
+            try:
+                async with self.session.get(url) as response:
+                    result["status"] = response.status
+                    if response.status == 200:
+                        result["bytes"], result["digest"] = await self._stream_to_file(response, path)
+                        result["path"] = path
+                        result["error"] = None
+                        break
+                    result["error"] = f"HTTP {response.status}"
+                    if response.status not in RETRYABLE_STATUSES:
+                        break
+                    try:
+                        retry_after = float(response.headers.get('Retry-After', ''))
+                    except ValueError:
+                        retry_after = None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        result["seconds"] = time.monotonic() - started
+        return result
+
+    async def _download_all(self, items, on_page=None):
+        tasks = [asyncio.ensure_future(self._fetch(index, url, path)) for index, url, path in items]
+        results = []
+        pending = set(tasks)
+        deadline = time.monotonic() + self.deadline
+
+        # Collect pages as they finish so callers can report progress
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                results.append(result)
+                if on_page:
+                    on_page(result)
+
+        for task in pending:
+            task.cancel()
+        timed_out = {index for index, _, _ in items} - {r["index"] for r in results}
+        for index, url, _ in items:
+            if index in timed_out:
+                result = {"index": index, "url": url, "path": None, "status": None, "bytes": 0,
+                          "seconds": None, "attempts": None, "error": "flyer deadline exceeded", "digest": None}
+                results.append(result)
+                if on_page:
+                    on_page(result)
+        return sorted(results, key=lambda r: r["index"])
+
+    def download(self, items, on_page=None):
+        """Download (index, url, path) items, blocking until done or the flyer deadline passes.
+
+        Returns (results, summary): per-page stats in index order, and totals for the whole flyer.
+        `on_page` is called from the download loop thread as each page finishes.
+        """
+        self._ensure_loop()
+        started = time.monotonic()
+        future = asyncio.run_coroutine_threadsafe(self._download_all(items, on_page), self.loop)
+        results = future.result()
+
+        latencies = sorted(r["seconds"] for r in results if r["path"])
+        summary = {
+            "pages": len(items),
+            "downloaded": len(latencies),
+            "failed": len(items) - len(latencies),
+            "bytes": sum(r["bytes"] for r in results),
+            "retries": sum((r["attempts"] or 1) - 1 for r in results),
+            "wall_seconds": round(time.monotonic() - started, 3),
+            "page_seconds_p50": round(latencies[len(latencies) // 2], 3) if latencies else None,
+            "page_seconds_max": round(latencies[-1], 3) if latencies else None,
+        }
+        return results, summary
+
+    def close(self):
+        """Close the HTTP session and stop the event loop thread"""
+        with self.lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop = None
+            self.session = None
+
+
+_shared_downloader = None
+_shared_lock = threading.Lock()
+
+
+def shared_downloader():
+    """Process-wide downloader configured from environment variables"""
+    global _shared_downloader
+    with _shared_lock:
+        if _shared_downloader is None:
+            _shared_downloader = AsyncImageDownloader(
+                max_connections=int(os.getenv('DOWNLOAD_MAX_CONNECTIONS', '20')),
+                per_host_limit=int(os.getenv('DOWNLOAD_PER_HOST_LIMIT', '8')),
+                max_retries=int(os.getenv('DOWNLOAD_MAX_RETRIES', '3')),
+                request_timeout=float(os.getenv('DOWNLOAD_REQUEST_TIMEOUT', '30')),
+                deadline=float(os.getenv('DOWNLOAD_DEADLINE', '120')),
+                hash_algorithm=os.getenv('DOWNLOAD_HASH', 'sha256') or None,
+            )
+        return _shared_downloader
+
+
+def close_shared_downloader():
+    """Close the process-wide downloader if it was ever used"""
+    global _shared_downloader
+    with _shared_lock:
+        if _shared_downloader is not None:
+            _shared_downloader.close()
+            _shared_downloader = None
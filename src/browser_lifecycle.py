@@ -0,0 +1,72 @@
+import time
+
+from browser_memory import chromium_memory
+
+
+class BrowserLifecycle:
+    """Decide when a pooled browser is recycled, and reset the ones that are kept between jobs.
+
+    A browser is replaced after `max_uses` leases or once its processes exceed `max_rss_mb`;
+    otherwise its extra tabs are closed and cookies and site storage are cleared so the next
+    job starts clean.
+    """
+
+    def __init__(self, max_uses=50, max_rss_mb=1500, clear_http_cache=False):
+        self.max_uses = max_uses
+        self.max_rss_mb = max_rss_mb
+        self.clear_http_cache = clear_http_cache
+        self.recycled = {"uses": 0, "memory": 0}
+
+    def track(self, selector):
+        """Start tracking a newly launched browser"""
+        selector.created_at = time.monotonic()
+        selector.uses = 0
+        selector.last_inspection = None
+
+    def inspect(self, selector):
+        """Current memory and tab count of a browser"""
+        try:
+            tabs = len(selector.driver.window_handles)
+        except Exception:
+            tabs = None
+        selector.last_inspection = dict(
+            chromium_memory(selector.driver) or {},
+            tabs=tabs,
+            uses=getattr(selector, "uses", 0),
+            age_seconds=round(time.monotonic() - getattr(selector, "created_at", time.monotonic())),
+        )
+        return selector.last_inspection
+
+    def recycle_reason(self, selector):
+        """Why the browser should be replaced now, or None to keep it"""
+        stats = self.inspect(selector)
+        if self.max_uses and stats["uses"] >= self.max_uses:
+            reason = "uses"
+        elif self.max_rss_mb and stats.get("total_rss_mb", 0) > self.max_rss_mb:
+            reason = "memory"
+        else:
+            return None
+        self.recycled[reason] += 1
+        return reason
+
+    def reset(self, selector, park_url):
+        """Close extra tabs, clear cookies and storage, and park the browser on `park_url`"""
+        driver = selector.driver
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        driver.execute_cdp_cmd('Storage.clearDataForOrigin', {
+            'origin': park_url.rstrip('/'),
+            'storageTypes': 'local_storage,indexeddb,service_workers,cache_storage,websql',
+        })
+        if self.clear_http_cache:
+            driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+        driver.get(park_url)
+
+    def stats(self):
+        return {"max_uses": self.max_uses, "max_rss_mb": self.max_rss_mb,
+                "clear_http_cache": self.clear_http_cache, "recycled": dict(self.recycled)}
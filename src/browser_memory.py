@@ -0,0 +1,65 @@
+import os
+
+
+def _read(path):
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def _children_by_parent():
+    """Map of parent PID -> child PIDs for every process in /proc"""
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        stat = _read(f'/proc/{name}/stat')
+        # Fields after the parenthesised command name: state, ppid, ...
+        fields = stat.rsplit(')', 1)[-1].split()
+        if len(fields) >= 2:
+            children.setdefault(int(fields[1]), []).append(int(name))
+    return children
+
+
+def _rss_kb(pid):
+    for line in _read(f'/proc/{pid}/status').splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1])
+    return 0
+
+
+def chromium_processes(root_pid):
+    """Processes started under `root_pid` (chromedriver) with their Chromium process type and RSS"""
+    children = _children_by_parent()
+    processes = []
+    stack = list(children.get(root_pid, []))
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        cmdline = _read(f'/proc/{pid}/cmdline').split('\0')
+        process_type = next((arg.split('=', 1)[1] for arg in cmdline if arg.startswith('--type=')), "browser")
+        processes.append({"pid": pid, "type": process_type, "rss_kb": _rss_kb(pid)})
+    return processes
+
+
+def chromium_memory(driver):
+    """RSS of a Selenium-driven Chromium, split into browser and renderer processes (Linux /proc only).
+
+    RSS counts shared pages once per process, so the total overstates real usage but tracks growth well.
+    """
+    try:
+        root_pid = driver.service.process.pid
+    except AttributeError:
+        return None
+    processes = chromium_processes(root_pid)
+    renderers = [p for p in processes if p["type"] == "renderer"]
+    browser = [p for p in processes if p["type"] == "browser"]
+    return {
+        "processes": len(processes),
+        "renderers": len(renderers),
+        "browser_rss_mb": round(sum(p["rss_kb"] for p in browser) / 1024, 1),
+        "renderer_rss_mb": round(sum(p["rss_kb"] for p in renderers) / 1024, 1),
+        "total_rss_mb": round(sum(p["rss_kb"] for p in processes) / 1024, 1),
+    }
@@ -0,0 +1,325 @@
+import os
+import random
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from discord_notifier import DiscordNotifier
+
+# Responses meaning the webhook is gone or misconfigured; retrying cannot help
+PERMANENT_STATUSES = {400, 401, 403, 404}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscribers (
+    id INTEGER PRIMARY KEY,
+    webhook_url TEXT NOT NULL UNIQUE,
+    name TEXT,
+    active INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS plans (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT,
+    recommendations TEXT NOT NULL,
+    flyer_image TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY,
+    plan_id INTEGER NOT NULL REFERENCES plans(id),
+    webhook_url TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    messages_sent INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_due ON deliveries(status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_deliveries_plan ON deliveries(plan_id);
+"""
+
+
+def mask_webhook(url):
+    """Webhook URL with its secret token hidden, safe to show in API responses and logs"""
+    head, _, token = (url or "").rstrip('/').rpartition('/')
+    return f"{head}/{token[:4]}…" if head and token else url
+
+
+class DeliveryQueue:
+    """Persistent queue delivering meal plans to many Discord webhooks, decoupled from generation jobs.
+
+    Each (plan, webhook) pair is a delivery row with its own attempt count and next retry time.
+    Worker threads claim due deliveries; failures back off exponentially and deliveries that
+    exhaust their attempts (or hit a permanent error) are dead-lettered for inspection and retry.
+    """
+
+    def __init__(self, path="data/deliveries.db", workers=4, max_attempts=8, backoff_base=5.0, backoff_max=900.0):
+        self.path = path
+        self.workers = max(1, int(workers))
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Flyer images are copied here so retries still have them after the job's files are evicted
+        self.spool_dir = os.path.join(os.path.dirname(path), "delivery_spool")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.stopping = False
+        self.threads = []
+        # Built webhook messages per plan (embeds + encoded flyer), shared by all its destinations
+        self.plan_messages = OrderedDict()
+        self.plan_messages_lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        # Queues created before partial delivery tracking lack the progress column
+        columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(deliveries)")]
+        if "messages_sent" not in columns:
+            self.conn.execute("ALTER TABLE deliveries ADD COLUMN messages_sent INTEGER NOT NULL DEFAULT 0")
+        # Deliveries claimed when the process stopped never finished; send them again
+        self.conn.execute("UPDATE deliveries SET status = 'queued' WHERE status = 'sending'")
+        self.conn.commit()
+
+    # Subscribers
+
+    def add_subscriber(self, webhook_url, name=None):
+        """Register (or re-activate) a webhook that receives every generated plan"""
+        now = datetime.now().isoformat()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO subscribers (webhook_url, name, active, created_at) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(webhook_url) DO UPDATE SET active = 1, name = COALESCE(excluded.name, name)",
+                (webhook_url, name, now),
+            )
+            row = self.conn.execute("SELECT * FROM subscribers WHERE webhook_url = ?", (webhook_url,)).fetchone()
+        return self._subscriber_view(row)
+
+    def remove_subscriber(self, subscriber_id):
+        """Deactivate a subscriber; returns False if it does not exist"""
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "UPDATE subscribers SET active = 0 WHERE id = ?", (subscriber_id,)).rowcount > 0
+
+    def subscribers(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM subscribers WHERE active = 1 ORDER BY id").fetchall()
+        return [self._subscriber_view(row) for row in rows]
+
+    @staticmethod
+    def _subscriber_view(row):
+        return {"id": row["id"], "name": row["name"], "webhook": mask_webhook(row["webhook_url"]),
+                "created_at": row["created_at"]}
+
+    # Queueing
+
+    def enqueue(self, job_id, recommendations, flyer_image=None, extra_webhooks=()):
+        """Queue a plan for every active subscriber plus `extra_webhooks`; returns the number of deliveries"""
+        now = datetime.now().isoformat()
+        with self.wakeup, self.conn:
+            webhooks = [row[0] for row in self.conn.execute(
+                "SELECT webhook_url FROM subscribers WHERE active = 1 ORDER BY id")]
+            for url in extra_webhooks:
+                if url and url not in webhooks:
+                    webhooks.append(url)
+            if not webhooks:
+                return 0
+            plan_id = self.conn.execute(
+                "INSERT INTO plans (job_id, recommendations, created_at) VALUES (?, ?, ?)",
+                (job_id, recommendations, now),
+            ).lastrowid
+            if flyer_image and os.path.exists(flyer_image):
+                spooled = os.path.join(self.spool_dir, f"plan_{plan_id}.jpg")
+                shutil.copyfile(flyer_image, spooled)
+                self.conn.execute("UPDATE plans SET flyer_image = ? WHERE id = ?", (spooled, plan_id))
+            self.conn.executemany(
+                "INSERT INTO deliveries (plan_id, webhook_url, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                [(plan_id, url, time.time(), now, now) for url in webhooks],
+            )
+            self.wakeup.notify_all()
+        print(f"Queued plan from job {job_id} for {len(webhooks)} Discord destination(s)")
+        return len(webhooks)
+
+    def _claim(self):
+        """Mark the next due delivery as sending and return it, or return the seconds until one is due"""
+        now = time.time()
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT d.id, d.plan_id, d.webhook_url, d.attempts, d.messages_sent, p.recommendations, p.flyer_image "
+                "FROM deliveries d JOIN plans p ON p.id = d.plan_id "
+                "WHERE d.status = 'queued' AND d.next_attempt_at <= ? ORDER BY d.next_attempt_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row:
+                self.conn.execute("UPDATE deliveries SET status = 'sending', updated_at = ? WHERE id = ?",
+                                  (datetime.now().isoformat(), row["id"]))
+                return row, None
+            upcoming = self.conn.execute(
+                "SELECT MIN(next_attempt_at) FROM deliveries WHERE status = 'queued'").fetchone()[0]
+        return None, (max(0.0, upcoming - now) if upcoming is not None else None)
+
+    def _finish(self, delivery, ok, status=None, error=None, sent=0):
+        """Record the outcome of one attempt: delivered, retry later, or dead-letter.
+
+        `sent` messages went through on this attempt; the next attempt resumes after them.
+        """
+        attempts = delivery["attempts"] + 1
+        now = datetime.now().isoformat()
+        with self.wakeup, self.conn:
+            self.conn.execute("UPDATE deliveries SET messages_sent = ? WHERE id = ?",
+                              (delivery["messages_sent"] + sent, delivery["id"]))
+            if ok:
+                self.conn.execute(
+                    "UPDATE deliveries SET status = 'delivered', attempts = ?, last_error = NULL, updated_at = ? "
+                    "WHERE id = ?", (attempts, now, delivery["id"]))
+                self._release_spool(delivery)
+            elif attempts >= self.max_attempts or status in PERMANENT_STATUSES:
+                print(f"✗ Dead-lettering delivery {delivery['id']} to {mask_webhook(delivery['webhook_url'])} "
+                      f"after {attempts} attempt(s): {error}")
+                self.conn.execute(
+                    "UPDATE deliveries SET status = 'dead', attempts = ?, last_error = ?, updated_at = ? "
+                    "WHERE id = ?", (attempts, error, now, delivery["id"]))
+            else:
+                delay = random.uniform(0.5, 1.0) * min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+                self.conn.execute(
+                    "UPDATE deliveries SET status = 'queued', attempts = ?, last_error = ?, next_attempt_at = ?, "
+                    "updated_at = ? WHERE id = ?", (attempts, error, time.time() + delay, now, delivery["id"]))
+                self.wakeup.notify()
+
+    def _release_spool(self, delivery):
+        """Delete a plan's spooled flyer once every destination has received it"""
+        pending = self.conn.execute(
+            "SELECT COUNT(*) FROM deliveries WHERE plan_id = ? AND status != 'delivered'", (delivery["plan_id"],)
+        ).fetchone()[0]
+        if pending:
+            return
+        with self.plan_messages_lock:
+            self.plan_messages.pop(delivery["plan_id"], None)
+        if delivery["flyer_image"]:
+            try:
+                os.remove(delivery["flyer_image"])
+            except OSError:
+                pass
+
+    def _worker(self):
+        while True:
+            with self.wakeup:
+                if self.stopping:
+                    return
+                delivery, wait = self._claim()
+                if delivery is None:
+                    # Sleep until the next retry is due or new work is queued
+                    self.wakeup.wait(timeout=min(wait, 30.0) if wait is not None else 30.0)
+                    continue
+
+            try:
+                notifier = DiscordNotifier(delivery["webhook_url"])
+                messages = self._messages_for(delivery, notifier)
+                if delivery["messages_sent"]:
+                    print(f"Resuming delivery {delivery['id']} at message {delivery['messages_sent'] + 1}/{len(messages)}")
+                ok = notifier.send_messages(messages, start=delivery["messages_sent"])
+                self._finish(delivery, ok, notifier.last_status, notifier.last_error, sent=notifier.last_sent)
+            except Exception as e:
+                print(f"✗ Delivery {delivery['id']} crashed: {e}")
+                self._finish(delivery, False, error=str(e))
+
+    def _messages_for(self, delivery, notifier, max_plans=8):
+        """Webhook messages of a delivery's plan, built (and the flyer encoded) once per plan.
+
+        Building is deterministic, so after a restart the rebuilt list lines up with `messages_sent`.
+        """
+        plan_id = delivery["plan_id"]
+        with self.plan_messages_lock:
+            entry = self.plan_messages.get(plan_id)
+            if entry is None:
+                entry = self.plan_messages[plan_id] = {"lock": threading.Lock(), "messages": None}
+                while len(self.plan_messages) > max_plans:
+                    self.plan_messages.popitem(last=False)
+            self.plan_messages.move_to_end(plan_id)
+        # Destinations of the same plan wait for one build instead of each encoding the flyer
+        with entry["lock"]:
+            if entry["messages"] is None:
+                entry["messages"] = notifier.build_messages(delivery["recommendations"], delivery["flyer_image"])
+            return entry["messages"]
+
+    def start(self):
+        """Start the delivery worker threads"""
+        with self.lock:
+            self.stopping = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True, name=f"delivery-{i+1}")
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=5):
+        """Stop the workers; deliveries in flight are resumed on the next start"""
+        with self.wakeup:
+            self.stopping = True
+            self.wakeup.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+        self.threads = []
+
+    # Inspection and dead letters
+
+    def deliveries_for_job(self, job_id):
+        """Per-destination delivery state of the plans a job produced"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT d.* FROM deliveries d JOIN plans p ON p.id = d.plan_id WHERE p.job_id = ? ORDER BY d.id",
+                (job_id,),
+            ).fetchall()
+        return [self._delivery_view(row) for row in rows]
+
+    def dead_letters(self, limit=100):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM deliveries WHERE status = 'dead' ORDER BY updated_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._delivery_view(row) for row in rows]
+
+    def retry(self, delivery_id=None):
+        """Re-queue one dead-lettered delivery (or all of them) with a fresh attempt budget"""
+        clause, params = ("AND id = ?", (delivery_id,)) if delivery_id is not None else ("", ())
+        with self.wakeup, self.conn:
+            count = self.conn.execute(
+                f"UPDATE deliveries SET status = 'queued', attempts = 0, next_attempt_at = ?, updated_at = ? "
+                f"WHERE status = 'dead' {clause}",
+                (time.time(), datetime.now().isoformat()) + params,
+            ).rowcount
+            self.wakeup.notify_all()
+        return count
+
+    @staticmethod
+    def _delivery_view(row):
+        return {
+            "id": row["id"],
+            "plan_id": row["plan_id"],
+            "webhook": mask_webhook(row["webhook_url"]),
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "messages_sent": row["messages_sent"],
+            "last_error": row["last_error"],
+            "next_attempt_at": datetime.fromtimestamp(row["next_attempt_at"]).isoformat() if row["status"] == "queued" else None,
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def stats(self):
+        """Delivery counts by status, subscriber count and worker configuration"""
+        with self.lock:
+            counts = {row[0]: row[1] for row in self.conn.execute(
+                "SELECT status, COUNT(*) FROM deliveries GROUP BY status")}
+            subscribers = self.conn.execute("SELECT COUNT(*) FROM subscribers WHERE active = 1").fetchone()[0]
+        return {
+            "workers": self.workers,
+            "max_attempts": self.max_attempts,
+            "subscribers": subscribers,
+            "deliveries_by_status": counts,
+        }
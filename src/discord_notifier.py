@@ -1,80 +1,226 @@
-import requests
+import asyncio
 import os
-import time
+
+from discord_sender import shared_sender
+from image_preprocessor import ImagePreprocessor
+
+# Discord message limits
+EMBED_DESCRIPTION_LIMIT = 4096
+EMBEDS_PER_MESSAGE = 10
+MESSAGE_EMBED_CHARS = 6000
+EMBED_COLOR = 5814783
+
+
+def discord_length(text):
+    """Length as Discord counts it (UTF-16 code units, so emoji count double)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _split_long_line(line, limit):
+    """Split a line longer than `limit` at word boundaries (hard-cutting only single huge words)"""
+    pieces = []
+    current = ""
+    for word in line.split(" "):
+        candidate = f"{current} {word}" if current else word
+        if discord_length(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        while discord_length(word) > limit:
+            pieces.append(word[:limit // 2])
+            word = word[limit // 2:]
+        current = word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _is_heading(line):
+    stripped = line.strip()
+    return stripped.startswith("**") and stripped.endswith("**") or stripped.startswith("#")
+
+
+def pack_embeds(text, title, min_embed_chars=200):
+    """Split text into embeds and group them into as few messages as Discord's limits allow.
+
+    Text is split only between lines (long lines between words), each embed is filled up to
+    whatever room is left in its message, and a section heading is never left dangling at
+    the end of an embed. Returns a list of messages, each a list of embeds.
+    """
+    messages = []
+    embeds = []
+    used = 0
+    lines = []
+
+    def capacity():
+        title_chars = discord_length(title) if not messages and not embeds else 0
+        return min(EMBED_DESCRIPTION_LIMIT, MESSAGE_EMBED_CHARS - used - title_chars)
+
+    def close_message():
+        nonlocal embeds, used
+        if embeds:
+            messages.append(embeds)
+        embeds, used = [], 0
+
+    def close_embed(embed_lines):
+        nonlocal used
+        description = "\n".join(embed_lines).strip("\n")
+        if not description:
+            return
+        embed = {"description": description, "color": EMBED_COLOR}
+        if not messages and not embeds:
+            embed["title"] = title
+        embeds.append(embed)
+        used += discord_length(description) + discord_length(embed.get("title", ""))
+        if len(embeds) == EMBEDS_PER_MESSAGE or MESSAGE_EMBED_CHARS - used < min_embed_chars:
+            close_message()
+
+    for raw_line in text.strip().split("\n"):
+        pieces = [raw_line] if discord_length(raw_line) <= EMBED_DESCRIPTION_LIMIT else \
+            _split_long_line(raw_line, EMBED_DESCRIPTION_LIMIT)
+        while pieces:
+            line = pieces.pop(0)
+            if discord_length("\n".join(lines + [line])) <= capacity():
+                lines.append(line)
+                continue
+            # Move a trailing heading (and blank separators) over to the next embed with its section
+            carry = []
+            while len(lines) > 1 and (not lines[-1].strip() or _is_heading(lines[-1])):
+                carry.insert(0, lines.pop())
+            close_embed(lines)
+            while carry and not carry[0].strip():
+                carry.pop(0)
+            lines = carry + [line]
+            if discord_length("\n".join(lines)) > capacity():
+                # Not enough room left in this message for the next piece
+                close_message()
+            if discord_length("\n".join(lines)) > capacity():
+                # The carried heading plus a near-limit piece overflow even an empty embed: keep the
+                # heading with as much of the piece as fits and handle the rest as the next piece
+                room = capacity() - discord_length("\n".join(carry)) - 1
+                if room < min_embed_chars:
+                    close_embed(carry)
+                    lines = [line]
+                    if discord_length(line) > capacity():
+                        close_message()
+                    continue
+                line = line.strip(" ")
+                head = _split_long_line(line, room)[0]
+                lines = carry + [head]
+                pieces.insert(0, line[len(head):].lstrip(" "))
+    close_embed(lines)
+    close_message()
+    return messages
+
 
 class DiscordNotifier:
-    def __init__(self, webhook_url):
+    def __init__(self, webhook_url, sender=None, max_attachment_bytes=None):
         self.webhook_url = webhook_url
-        
+        self.sender = sender or shared_sender()
+        # Outcome of the most recent failed send, for callers that decide whether to retry
+        self.last_status = None
+        self.last_error = None
+        # Messages of the last send that went through, counted from its `start`
+        self.last_sent = 0
+        self.max_attachment_bytes = max_attachment_bytes or int(
+            float(os.getenv('DISCORD_MAX_ATTACHMENT_MB', '10')) * 1024 * 1024
+        )
+
+    def _flyer_attachment(self, flyer_image_path):
+        """Flyer image bytes, re-encoded smaller if the file exceeds the attachment cap"""
+        if os.path.getsize(flyer_image_path) <= self.max_attachment_bytes:
+            with open(flyer_image_path, 'rb') as f:
+                return f.read()
+        # Keep full resolution if lowering JPEG quality is enough
+        preprocessor = ImagePreprocessor(max_pixels=10 ** 10, max_bytes=self.max_attachment_bytes)
+        data, stats = preprocessor.prepare(flyer_image_path)
+        print(f"Re-encoded flyer for Discord: {stats['original_bytes']/1024/1024:.1f} MB -> "
+              f"{stats['output_bytes']/1024/1024:.1f} MB ({stats['output_size'][0]}x{stats['output_size'][1]})")
+        return data
+
+    def build_messages(self, recommendations_text, flyer_image_path=None):
+        """Webhook messages for a meal plan: embeds packed up to Discord's limits, with the
+        flyer image attached to the last message"""
+        messages = [{"json": {"embeds": embeds}}
+                    for embeds in pack_embeds(recommendations_text, "🍽️ Your Weekly No Frills Meal Plan")]
+
+        if flyer_image_path and os.path.exists(flyer_image_path):
+            attachment = ('no_frills_flyer.jpg', self._flyer_attachment(flyer_image_path), 'image/jpeg')
+            if messages:
+                messages[-1]["files"] = [attachment]
+                messages[-1]["json"]["content"] = "📄 Complete flyer attached for reference"
+            else:
+                messages.append({"json": {"content": "📄 Complete flyer for reference:"}, "files": [attachment]})
+
+        return messages
+
+    async def _deliver(self, messages):
+        """Send the messages; if only the final one fails while carrying the flyer, retry it without"""
+        results = await self.sender.send_async(self.webhook_url, messages)
+        last = messages[-1] if messages else None
+        if (last and last.get("files") and len(results) == len(messages)
+                and not results[-1]["ok"] and all(r["ok"] for r in results[:-1])):
+            print(f"✗ Failed to send flyer image ({results[-1]['error']}); resending the text without it")
+            text_only = {"json": {"embeds": last["json"].get("embeds", [])}}
+            if text_only["json"]["embeds"]:
+                results[-1:] = await self.sender.send_async(self.webhook_url, [text_only])
+            else:
+                # Nothing but the image was in that message; the meal plan itself went through
+                results[-1] = dict(results[-1], ok=True)
+        return results
+
+    def _report(self, results):
+        """Print the delivery outcome"""
+        self.last_sent = 0
+        for result in results:
+            if not result["ok"]:
+                print(f"✗ Failed to send message: {result['error']}")
+                self.last_status, self.last_error = result["status"], result["error"]
+                return False
+            self.last_sent += 1
+        print(f"✓ Successfully sent recommendations to Discord ({len(results)} message(s))")
+        return True
+
     def send_recommendations(self, recommendations_text, flyer_image_path=None):
         """Send cooking recommendations to Discord via webhook"""
         try:
             print(f"Sending recommendations to Discord...")
-            
-            # Use embeds for better formatting
-            # Discord limits: single embed = 4096 chars, total message embeds = 6000 chars
-            # If text is long, send multiple separate messages instead
-            max_embed_length = 3500  # Safe limit per embed
-            
-            if len(recommendations_text) > max_embed_length:
-                # Split into multiple messages (not multiple embeds in one message)
-                chunks = [recommendations_text[i:i+max_embed_length] for i in range(0, len(recommendations_text), max_embed_length)]
-                
-                for i, chunk in enumerate(chunks):
-                    payload = {
-                        "embeds": [{
-                            "title": f"🍽️ Your Weekly No Frills Meal Plan (Part {i+1}/{len(chunks)})",
-                            "description": chunk,
-                            "color": 5814783
-                        }]
-                    }
-                    response = requests.post(self.webhook_url, json=payload)
-                    
-                    if response.status_code not in [200, 204]:
-                        print(f"✗ Failed to send part {i+1}: HTTP {response.status_code}")
-                        print(f"Response: {response.text}")
-                        return False
-                    
-                    # Wait between messages to avoid rate limit
-                    if i < len(chunks) - 1:
-                        time.sleep(0.5)
-            else:
-                payload = {
-                    "embeds": [{
-                        "title": "🍽️ Your Weekly No Frills Meal Plan",
-                        "description": recommendations_text,
-                        "color": 5814783
-                    }]
-                }
-                response = requests.post(self.webhook_url, json=payload)
-                
-                if response.status_code not in [200, 204]:
-                    print(f"✗ Failed to send message: HTTP {response.status_code}")
-                    print(f"Response: {response.text}")
-                    return False
-            
-            # Send flyer image as attachment if available (with rate limit delay)
-            if flyer_image_path and os.path.exists(flyer_image_path):
-                time.sleep(1)  # Wait 1 second to avoid rate limit
-                
-                with open(flyer_image_path, 'rb') as f:
-                    files = {
-                        'file': ('no_frills_flyer.jpg', f, 'image/jpeg')
-                    }
-                    payload = {
-                        "content": "📄 Complete flyer for reference:"
-                    }
-                    response = requests.post(self.webhook_url, data=payload, files=files)
-                    
-                    if response.status_code not in [200, 204]:
-                        print(f"✗ Failed to send flyer image: HTTP {response.status_code}")
-                        # Don't return False here - recommendations were sent successfully
-            
-            print(f"✓ Successfully sent recommendations to Discord")
-            return True
-            
+            return self.send_messages(self.build_messages(recommendations_text, flyer_image_path))
+        except Exception as e:
+            print(f"✗ Error sending to Discord: {e}")
+            self.last_error = str(e)
+            import traceback
+            traceback.print_exc()
+            return False
+
+    def send_messages(self, messages, start=0):
+        """Send already built messages from index `start` on (to resume a partly delivered plan)"""
+        try:
+            if start >= len(messages):
+                self.last_sent = 0
+                return True
+            results = self.sender.run(self._deliver(messages[start:])).result()
+            return self._report(results)
+
+        except Exception as e:
+            print(f"✗ Error sending to Discord: {e}")
+            self.last_error = str(e)
+            import traceback
+            traceback.print_exc()
+            return False
+
+    async def send_recommendations_async(self, recommendations_text, flyer_image_path=None):
+        """Like send_recommendations, but awaitable from an event loop without tying up a thread"""
+        try:
+            print(f"Sending recommendations to Discord...")
+            messages = await asyncio.to_thread(self.build_messages, recommendations_text, flyer_image_path)
+            results = await asyncio.wrap_future(self.sender.run(self._deliver(messages)))
+            return self._report(results)
+
         except Exception as e:
             print(f"✗ Error sending to Discord: {e}")
+            self.last_error = str(e)
             import traceback
             traceback.print_exc()
             return False
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import aiohttp
+
+# Statuses worth retrying; 429 waits exactly as long as Discord asks
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateLimitBucket:
+    """Discord rate-limit state for one bucket, updated from X-RateLimit-* response headers"""
+
+    def __init__(self):
+        self.remaining = None
+        self.reset_at = 0.0
+        # Serializes sends to a webhook so messages arrive in order
+        self.lock = asyncio.Lock()
+
+    def delay(self):
+        """Seconds to wait before the next request may be sent"""
+        if self.remaining == 0:
+            return max(0.0, self.reset_at - time.monotonic())
+        return 0.0
+
+    def update(self, headers):
+        try:
+            if 'X-RateLimit-Remaining' in headers:
+                self.remaining = int(headers['X-RateLimit-Remaining'])
+            if 'X-RateLimit-Reset-After' in headers:
+                self.reset_at = time.monotonic() + float(headers['X-RateLimit-Reset-After'])
+        except ValueError:
+            pass
+
+
+class AsyncDiscordSender:
+    """Send webhook messages on a background event loop sharing one connection pool.
+
+    Waits are driven by Discord's rate-limit headers: a request is held back only when the
+    webhook's bucket is exhausted, and 429 responses are retried after `retry_after`.
+    """
+
+    def __init__(self, max_connections=20, max_retries=5, backoff_base=0.5, backoff_max=30.0, request_timeout=30):
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.request_timeout = request_timeout
+        self.loop = None
+        self.session = None
+        self.buckets = {}
+        self.global_reset_at = 0.0
+        self.lock = threading.Lock()
+        self.stats_counters = {"messages": 0, "requests": 0, "rate_limited": 0, "retries": 0,
+                               "failures": 0, "wait_seconds": 0.0}
+
+    def _ensure_loop(self):
+        """Start the event loop thread and HTTP session on first use"""
+        with self.lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True, name="discord-sender").start()
+
+            async def create_session():
+                return aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30),
+                    timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                )
+
+            self.session = asyncio.run_coroutine_threadsafe(create_session(), loop).result()
+            self.loop = loop
+
+    def _bucket(self, webhook_url):
+        # Each webhook has its own bucket on Discord's side
+        if webhook_url not in self.buckets:
+            self.buckets[webhook_url] = RateLimitBucket()
+        return self.buckets[webhook_url]
+
+    def _form(self, message):
+        """Multipart body for messages with attachments (Discord's payload_json convention)"""
+        form = aiohttp.FormData()
+        form.add_field('payload_json', json.dumps(message.get("json") or {}), content_type='application/json')
+        for index, (filename, data, content_type) in enumerate(message["files"]):
+            form.add_field(f'files[{index}]', data, filename=filename, content_type=content_type)
+        return form
+
+    async def _wait(self, seconds):
+        if seconds > 0:
+            self.stats_counters["wait_seconds"] += seconds
+            await asyncio.sleep(seconds)
+
+    async def _post(self, webhook_url, message):
+        """Send one message, honouring rate limits and retrying 429/5xx; returns (ok, status, error)"""
+        bucket = self._bucket(webhook_url)
+        status, error = None, None
+        for attempt in range(self.max_retries + 1):
+            await self._wait(max(bucket.delay(), self.global_reset_at - time.monotonic()))
+            self.stats_counters["requests"] += 1
+            try:
+                kwargs = {"data": self._form(message)} if message.get("files") else {"json": message["json"]}
+                async with self.session.post(webhook_url, **kwargs) as response:
+                    status = response.status
+                    bucket.update(response.headers)
+                    if status in (200, 204):
+                        return True, status, None
+                    body = await response.text()
+                    error = f"HTTP {status}: {body[:200]}"
+                    if status not in RETRYABLE_STATUSES:
+                        break
+
+                    retry_after = None
+                    if status == 429:
+                        self.stats_counters["rate_limited"] += 1
+                        try:
+                            data = json.loads(body)
+                            retry_after = float(data.get("retry_after"))
+                            if data.get("global") or response.headers.get('X-RateLimit-Global'):
+                                self.global_reset_at = time.monotonic() + retry_after
+                        except (ValueError, TypeError, AttributeError):
+                            retry_after = None
+                        if retry_after is None:
+                            try:
+                                retry_after = float(response.headers.get('Retry-After', ''))
+                            except ValueError:
+                                retry_after = None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+                retry_after = None
+
+            if attempt < self.max_retries:
+                self.stats_counters["retries"] += 1
+                if retry_after is None:
+                    # 5xx or connection error: full-jitter exponential backoff
+                    retry_after = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                await self._wait(retry_after)
+
+        self.stats_counters["failures"] += 1
+        return False, status, error
+
+    async def send_async(self, webhook_url, messages):
+        """Send messages to one webhook in order (runs on the sender loop); stops at the first failure"""
+        bucket = self._bucket(webhook_url)
+        results = []
+        async with bucket.lock:
+            for message in messages:
+                self.stats_counters["messages"] += 1
+                ok, status, error = await self._post(webhook_url, message)
+                results.append({"ok": ok, "status": status, "error": error})
+                if not ok:
+                    break
+        return results
+
+    def run(self, coroutine):
+        """Run a coroutine on the sender loop; returns a concurrent.futures.Future"""
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def submit(self, webhook_url, messages):
+        """Schedule a send and return a concurrent.futures.Future with its results.
+
+        Each message is {"json": payload} or, with attachments, {"json": payload,
+        "files": [(filename, bytes_or_file, content_type), ...]}.
+        """
+        return self.run(self.send_async(webhook_url, messages))
+
+    def send(self, webhook_url, messages):
+        """Send messages and block until they are delivered or have failed"""
+        return self.submit(webhook_url, messages).result()
+
+    def stats(self):
+        return dict(self.stats_counters, wait_seconds=round(self.stats_counters["wait_seconds"], 3),
+                    webhooks=len(self.buckets))
+
+    def close(self):
+        """Close the HTTP session and stop the event loop thread"""
+        with self.lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop = None
+            self.session = None
+
+
+_shared_sender = None
+_shared_lock = threading.Lock()
+
+
+def shared_sender():
+    """Process-wide Discord sender configured from environment variables"""
+    global _shared_sender
+    with _shared_lock:
+        if _shared_sender is None:
+            _shared_sender = AsyncDiscordSender(
+                max_connections=int(os.getenv('DISCORD_MAX_CONNECTIONS', '20')),
+                max_retries=int(os.getenv('DISCORD_MAX_RETRIES', '5')),
+            )
+        return _shared_sender
+
+
+def close_shared_sender():
+    """Close the process-wide sender if it was ever used"""
+    global _shared_sender
+    with _shared_lock:
+        if _shared_sender is not None:
+            _shared_sender.close()
+            _shared_sender = None
+
+
+def fake_webhook_check(messages=12, limit=5, window=2.0, port=8799):
+    """Send messages to a local fake webhook that enforces Discord-style rate limits and print the timing"""
+    from aiohttp import web
+
+    state = {"remaining": limit, "reset_at": time.monotonic() + window, "received": 0, "rejected": 0}
+
+    async def webhook(request):
+        await request.read()
+        now = time.monotonic()
+        if now >= state["reset_at"]:
+            state["remaining"], state["reset_at"] = limit, now + window
+        reset_after = f"{state['reset_at'] - now:.3f}"
+        headers = {'X-RateLimit-Limit': str(limit), 'X-RateLimit-Bucket': 'fake'}
+        if state["remaining"] == 0:
+            state["rejected"] += 1
+            headers.update({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': reset_after})
+            return web.json_response({"message": "You are being rate limited.", "retry_after": float(reset_after),
+                                      "global": False}, status=429, headers=headers)
+        state["remaining"] -= 1
+        state["received"] += 1
+        headers.update({'X-RateLimit-Remaining': str(state["remaining"]), 'X-RateLimit-Reset-After': reset_after})
+        return web.Response(status=204, headers=headers)
+
+    async def serve():
+        app = web.Application()
+        app.router.add_post('/webhook', webhook)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        return runner
+
+    sender = AsyncDiscordSender()
+    sender._ensure_loop()
+    runner = asyncio.run_coroutine_threadsafe(serve(), sender.loop).result()
+    try:
+        started = time.monotonic()
+        results = sender.send(f"http://127.0.0.1:{port}/webhook",
+                              [{"json": {"content": f"message {i+1}"}} for i in range(messages)])
+        elapsed = time.monotonic() - started
+        minimum = (messages - 1) // limit * window
+        print(f"Delivered {sum(r['ok'] for r in results)}/{messages} messages in {elapsed:.2f}s "
+              f"(rate limit allows at best {minimum:.2f}s); server rejected {state['rejected']} with 429")
+        print(sender.stats())
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), sender.loop).result()
+        sender.close()
+
+
+if __name__ == "__main__":
+    fake_webhook_check()
@@ -0,0 +1,318 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from browser_memory import chromium_memory
+from store_selector import FlippStoreSelector
+
+
+class DriverPool:
+    """Keep pre-warmed Chromium selectors parked on Flipp and lease them to jobs"""
+
+    def __init__(self, size=2, headless=True, warm_url="https://flipp.com/", health_check_interval=60, session_store=None,
+                 lifecycle=None):
+        self.size = max(1, int(size))
+        self.headless = headless
+        self.session_store = session_store
+        # Optional BrowserLifecycle: recycles worn browsers and resets kept ones between leases
+        self.lifecycle = lifecycle
+        self.warm_url = warm_url
+        self.health_check_interval = health_check_interval
+
+        self.cond = threading.Condition()
+        self.idle = deque()
+        self.in_use = set()
+        self.creating = 0
+        self.resetting = 0
+        # Idle browsers taken out by the health checker; still part of the pool
+        self.checking = 0
+        self.waiters = deque()
+        self.closed = False
+
+        # Statistics
+        self.wait_times = deque(maxlen=500)
+        self.total_leases = 0
+        self.timeouts = 0
+        self.replaced = 0
+        self.recycled = 0
+        self.creation_failures = 0
+        self.started_at = time.monotonic()
+        self.busy_seconds = 0.0
+        self.last_change = self.started_at
+        self._health_thread = None
+
+    def _create_selector(self):
+        """Launch a new browser and park it on the warm URL"""
+        selector = FlippStoreSelector(headless=self.headless, session_store=self.session_store)
+        selector.setup_driver()
+        if self.lifecycle:
+            self.lifecycle.track(selector)
+        try:
+            selector.driver.get(self.warm_url)
+        except Exception as e:
+            print(f"Warning: failed to park new browser on {self.warm_url}: {e}")
+        return selector
+
+    def _is_healthy(self, selector):
+        """Check that the browser is still alive and responding"""
+        try:
+            return bool(selector.driver) and selector.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _discard(self, selector):
+        try:
+            selector.close()
+        except Exception:
+            pass
+
+    def _total(self):
+        return len(self.idle) + len(self.in_use) + self.creating + self.resetting + self.checking
+
+    def _account_busy_time(self):
+        """Integrate busy driver-seconds up to now (call with the lock held)"""
+        now = time.monotonic()
+        self.busy_seconds += len(self.in_use) * (now - self.last_change)
+        self.last_change = now
+
+    def _add_warm_driver(self):
+        """Fill one reserved slot with a fresh browser (slot must already be counted in `creating`)"""
+        try:
+            selector = self._create_selector()
+        except Exception as e:
+            print(f"Warning: failed to start pooled browser: {e}")
+            with self.cond:
+                self.creating -= 1
+                self.creation_failures += 1
+                self.cond.notify_all()
+            return
+
+        with self.cond:
+            self.creating -= 1
+            if self.closed:
+                self._discard(selector)
+            else:
+                self.idle.append(selector)
+            self.cond.notify_all()
+
+    def _spawn_warm_driver(self):
+        """Reserve a slot and start a browser for it in the background (call with the lock held)"""
+        self.creating += 1
+        threading.Thread(target=self._add_warm_driver, daemon=True, name="driver-pool-warm").start()
+
+    def start(self, prewarm=True):
+        """Optionally warm all drivers in the background and start the health checker"""
+        with self.cond:
+            if prewarm:
+                while self._total() < self.size:
+                    self._spawn_warm_driver()
+
+        if self.health_check_interval and self._health_thread is None:
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True, name="driver-pool-health")
+            self._health_thread.start()
+
+    def _health_loop(self):
+        """Periodically replace idle browsers that have crashed"""
+        while True:
+            time.sleep(self.health_check_interval)
+            with self.cond:
+                if self.closed:
+                    return
+                candidates = list(self.idle)
+                self.idle.clear()
+                self.checking += len(candidates)
+
+            for selector in candidates:
+                healthy = self._is_healthy(selector)
+                with self.cond:
+                    self.checking -= 1
+                    if healthy and not self.closed:
+                        self.idle.append(selector)
+                        self.cond.notify_all()
+                        continue
+                if not healthy:
+                    print("Pooled browser failed health check; replacing it")
+                self._discard(selector)
+                with self.cond:
+                    if not self.closed:
+                        self.replaced += 1
+                        self._spawn_warm_driver()
+
+    def acquire(self, timeout=None):
+        """Check out a healthy selector, waiting in FIFO order if none is free"""
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        ticket = object()
+
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("Driver pool is closed")
+            self.waiters.append(ticket)
+            try:
+                while True:
+                    # Only the longest-waiting caller may take a driver
+                    if self.waiters[0] is ticket:
+                        if self.idle:
+                            selector = self.idle.popleft()
+                            break
+                        if self._total() < self.size:
+                            self.creating += 1
+                            selector = None
+                            break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.timeouts += 1
+                        raise TimeoutError(f"No browser available after {timeout}s")
+                    self.cond.wait(remaining)
+            finally:
+                self.waiters.remove(ticket)
+                self.cond.notify_all()
+
+        if selector is not None and not self._is_healthy(selector):
+            print("Pooled browser is unresponsive; replacing it")
+            self._discard(selector)
+            with self.cond:
+                self.replaced += 1
+                self.creating += 1
+            selector = None
+
+        created = selector is None
+        if created:
+            try:
+                selector = self._create_selector()
+            except Exception:
+                with self.cond:
+                    self.creating -= 1
+                    self.creation_failures += 1
+                    self.cond.notify_all()
+                raise
+
+        wait = time.monotonic() - start
+        with self.cond:
+            if created:
+                self.creating -= 1
+            self._account_busy_time()
+            self.in_use.add(selector)
+            self.total_leases += 1
+            self.wait_times.append(wait)
+        selector.lease_wait_seconds = wait
+        return selector
+
+    def _recycle_or_reset(self, selector):
+        """Between leases: replace a worn-out browser, or clear it for the next job (runs in the background)"""
+        reason = self.lifecycle.recycle_reason(selector)
+        if reason is None:
+            try:
+                self.lifecycle.reset(selector, self.warm_url)
+            except Exception as e:
+                print(f"Warning: failed to reset pooled browser: {e}")
+                reason = "reset failed"
+        if reason:
+            inspection = selector.last_inspection or {}
+            print(f"Recycling pooled browser ({reason}; {inspection.get('uses')} uses, "
+                  f"{inspection.get('total_rss_mb')} MB RSS, {inspection.get('tabs')} tabs)")
+            self._discard(selector)
+
+        with self.cond:
+            self.resetting -= 1
+            if self.closed:
+                if not reason:
+                    self._discard(selector)
+            elif reason:
+                self.recycled += 1
+                self._spawn_warm_driver()
+            else:
+                self.idle.append(selector)
+            self.cond.notify_all()
+
+    def release(self, selector):
+        """Return a leased selector; crashed browsers are replaced in the background"""
+        healthy = self._is_healthy(selector)
+        with self.cond:
+            self._account_busy_time()
+            self.in_use.discard(selector)
+            if self.closed:
+                self._discard(selector)
+            elif healthy and self.lifecycle:
+                selector.uses += 1
+                self.resetting += 1
+                threading.Thread(target=self._recycle_or_reset, args=(selector,), daemon=True,
+                                 name="driver-pool-reset").start()
+            elif healthy:
+                self.idle.append(selector)
+            else:
+                print("Returned browser is unresponsive; replacing it")
+                self._discard(selector)
+                self.replaced += 1
+                self._spawn_warm_driver()
+            self.cond.notify_all()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """Context manager wrapper around acquire()/release()"""
+        selector = self.acquire(timeout=timeout)
+        try:
+            yield selector
+        finally:
+            self.release(selector)
+
+    def stats(self):
+        """Lease wait times and utilization for sizing the pool"""
+        with self.cond:
+            self._account_busy_time()
+            waits = sorted(self.wait_times)
+            uptime = max(time.monotonic() - self.started_at, 1e-9)
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": len(self.in_use),
+                "starting": self.creating,
+                "resetting": self.resetting,
+                "checking": self.checking,
+                "waiting": len(self.waiters),
+                "utilization": len(self.in_use) / self.size,
+                "average_utilization": self.busy_seconds / (uptime * self.size),
+                "total_leases": self.total_leases,
+                "lease_timeouts": self.timeouts,
+                "replaced_drivers": self.replaced,
+                "recycled_drivers": self.recycled,
+                "creation_failures": self.creation_failures,
+                "lease_wait_seconds": {
+                    "avg": sum(waits) / len(waits) if waits else 0.0,
+                    "p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+                    "max": waits[-1] if waits else 0.0,
+                },
+                "flipp_sessions": self.session_store.stats() if self.session_store else None,
+                "lifecycle": self.lifecycle.stats() if self.lifecycle else None,
+            }
+
+    def browser_stats(self):
+        """Per-browser uses, age and current process memory (tab counts as of the last release)"""
+        with self.cond:
+            selectors = [("idle", s) for s in self.idle] + [("in_use", s) for s in self.in_use]
+        browsers = []
+        for state, selector in selectors:
+            last = getattr(selector, "last_inspection", None) or {}
+            created_at = getattr(selector, "created_at", None)
+            browsers.append(dict(
+                chromium_memory(selector.driver) or {},
+                state=state,
+                uses=getattr(selector, "uses", None),
+                age_seconds=round(time.monotonic() - created_at) if created_at else None,
+                tabs=last.get("tabs"),
+            ))
+        return {
+            "browsers": browsers,
+            "total_rss_mb": round(sum(b.get("total_rss_mb", 0) for b in browsers), 1),
+        }
+
+    def close(self):
+        """Quit idle browsers; leased ones are quit when they are returned"""
+        with self.cond:
+            self.closed = True
+            idle = list(self.idle)
+            self.idle.clear()
+            self.cond.notify_all()
+        for selector in idle:
+            self._discard(selector)
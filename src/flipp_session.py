@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+from flyer_cache import normalize_postal_code
+
+# CDP cookie fields accepted back by Network.setCookies
+COOKIE_FIELDS = ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite", "expires")
+
+
+class FlippSessionStore:
+    """Flipp cookies and localStorage saved per postal code, so a browser can skip consent and postal entry.
+
+    Also keeps select_store timings for the cold path (full postal entry), the warm path
+    (restored session) and misses (restored session showed the wrong location).
+    """
+
+    def __init__(self, directory="data/flipp_sessions", max_age_seconds=3 * 24 * 3600):
+        self.directory = directory
+        self.max_age_seconds = max_age_seconds
+        self.lock = threading.Lock()
+        self.timings = {"cold": deque(maxlen=200), "warm": deque(maxlen=200), "miss": deque(maxlen=200)}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, postal_code):
+        return os.path.join(self.directory, f"{normalize_postal_code(postal_code)}.json")
+
+    def load(self, postal_code):
+        """Saved session for a postal code, or None when missing, unreadable or too old"""
+        path = self._path(postal_code)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Warning: Flipp session {path} unreadable: {e}")
+            return None
+        if time.time() - session.get("saved_at", 0) > self.max_age_seconds:
+            self.discard(postal_code)
+            return None
+        return session
+
+    def save(self, postal_code, cookies, local_storage):
+        """Persist a browser's Flipp state for a postal code (atomically)"""
+        session = {
+            "postal_code": normalize_postal_code(postal_code),
+            "saved_at": time.time(),
+            "cookies": [{k: c[k] for k in COOKIE_FIELDS if k in c} for c in cookies],
+            "local_storage": local_storage or {},
+        }
+        path = self._path(postal_code)
+        # A temp file of its own per writer: browsers can save the same postal code at the same time
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.directory, suffix=".tmp",
+                                         delete=False) as f:
+            tmp_path = f.name
+            try:
+                json.dump(session, f)
+            except Exception:
+                f.close()
+                os.remove(tmp_path)
+                raise
+        os.replace(tmp_path, path)
+
+    def discard(self, postal_code):
+        try:
+            os.remove(self._path(postal_code))
+        except OSError:
+            pass
+
+    def record(self, path, seconds):
+        """Record how long a select_store run took on the `cold`, `warm` or `miss` path"""
+        with self.lock:
+            self.timings[path].append(seconds)
+
+    def stats(self):
+        """Saved sessions and select_store timings per path"""
+        with self.lock:
+            timings = {path: sorted(values) for path, values in self.timings.items()}
+        sessions = len([name for name in os.listdir(self.directory) if name.endswith('.json')])
+
+        def summary(values):
+            return {
+                "count": len(values),
+                "median_seconds": round(values[len(values) // 2], 3) if values else None,
+                "max_seconds": round(values[-1], 3) if values else None,
+            }
+
+        return {"saved_sessions": sessions, "select_store": {path: summary(v) for path, v in timings.items()}}
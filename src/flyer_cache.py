@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from store_registry import DEFAULT_STORE
+
+
+def flyer_week_end(now=None, end_weekday=2):
+    """End of the current flyer week (default: Wednesday 23:59:59, No Frills flyers run Thursday to Wednesday)"""
+    now = now or datetime.now()
+    days_ahead = (end_weekday - now.weekday()) % 7
+    end_day = now + timedelta(days=days_ahead)
+    return end_day.replace(hour=23, minute=59, second=59, microsecond=0)
+
+
+def normalize_postal_code(postal_code):
+    """Canonical form of a postal code: uppercase without spaces"""
+    return "".join((postal_code or "").split()).upper()
+
+
+def region_key(region, store=DEFAULT_STORE):
+    """Index key of a postal code or FSA for a store (the default store keeps plain keys, as before stores existed)"""
+    return region if store == DEFAULT_STORE else f"{store}:{region}"
+
+
+class FlyerSnapshotCache:
+    """Persistent flyer snapshots (pages + stitched image) shared by every postal code served by the same flyer"""
+
+    def __init__(self, cache_dir="data/flyer_cache", week_end_day=2, match_fsa=True):
+        self.cache_dir = cache_dir
+        self.week_end_day = week_end_day
+        self.match_fsa = match_fsa
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Expired snapshots are purged on the first lookup after each weekly rollover
+        self.next_purge_at = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+        self.purge_expired()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if all(key in index for key in ("snapshots", "postal_codes", "fsa")):
+                return index
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: flyer cache index unreadable, starting empty: {e}")
+        return {"snapshots": {}, "postal_codes": {}, "fsa": {}}
+
+    def _save_index(self):
+        """Write the index atomically (call with the lock held)"""
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def flyer_id_for_urls(image_urls):
+        """Stable flyer identity derived from its page image URLs (query strings ignored)"""
+        paths = sorted({urlsplit(url)._replace(query="", fragment="").geturl() for url in image_urls})
+        return hashlib.sha1("\n".join(paths).encode("utf-8")).hexdigest()[:16]
+
+    def _is_valid(self, snapshot, now=None):
+        now = now or datetime.now()
+        if datetime.fromisoformat(snapshot["valid_to"]) < now:
+            return False
+        return os.path.exists(snapshot["stitched_image"]) and all(os.path.exists(p) for p in snapshot["pages"])
+
+    def lookup(self, postal_code, store=DEFAULT_STORE):
+        """Return the store's snapshot serving this postal code (exact match first, then FSA prefix), or None"""
+        if datetime.now() > self.next_purge_at:
+            self.purge_expired()
+        postal_code = normalize_postal_code(postal_code)
+        with self.lock:
+            flyer_id = self.index["postal_codes"].get(region_key(postal_code, store))
+            if not flyer_id and self.match_fsa:
+                flyer_id = self.index["fsa"].get(region_key(postal_code[:3], store))
+            snapshot = self.index["snapshots"].get(flyer_id) if flyer_id else None
+            if snapshot and self._is_valid(snapshot):
+                self.hits += 1
+                return dict(snapshot)
+            self.misses += 1
+            return None
+
+    def get(self, flyer_id):
+        """Return a still-valid snapshot by flyer identity, or None"""
+        with self.lock:
+            snapshot = self.index["snapshots"].get(flyer_id)
+            if snapshot and self._is_valid(snapshot):
+                return dict(snapshot)
+            return None
+
+    def link(self, postal_code, flyer_id, store=DEFAULT_STORE):
+        """Point a postal code (and its FSA) at an existing snapshot of the store's flyer"""
+        postal_code = normalize_postal_code(postal_code)
+        with self.lock:
+            snapshot = self.index["snapshots"].get(flyer_id)
+            if not snapshot:
+                return None
+            self.index["postal_codes"][region_key(postal_code, store)] = flyer_id
+            self.index["fsa"][region_key(postal_code[:3], store)] = flyer_id
+            if postal_code not in snapshot["postal_codes"]:
+                snapshot["postal_codes"].append(postal_code)
+            self._save_index()
+            return dict(snapshot)
+
+    def store(self, postal_code, image_urls, page_files, stitched_image, valid_to=None, page_digests=None,
+              store=DEFAULT_STORE):
+        """Copy a freshly built flyer of a store into the cache and index it under the postal code.
+
+        `page_digests` maps page paths to content hashes computed while downloading.
+        """
+        flyer_id = self.flyer_id_for_urls(image_urls)
+        if self.get(flyer_id):
+            # Another job cached the same flyer meanwhile; never replace files readers may be using
+            return self.link(postal_code, flyer_id, store)
+
+        valid_to = valid_to or flyer_week_end(end_weekday=self.week_end_day)
+        snapshot_dir = os.path.join(self.cache_dir, flyer_id)
+        # Copy into a private temporary directory first so readers never see a partial snapshot
+        tmp_dir = tempfile.mkdtemp(prefix=f".{flyer_id}-", dir=self.cache_dir)
+        for page in page_files:
+            shutil.copy2(page, os.path.join(tmp_dir, os.path.basename(page)))
+        shutil.copy2(stitched_image, os.path.join(tmp_dir, "complete_flyer.jpg"))
+
+        with self.lock:
+            existing = self.index["snapshots"].get(flyer_id)
+            if existing and self._is_valid(existing):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            else:
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+                os.replace(tmp_dir, snapshot_dir)
+                self.index["snapshots"][flyer_id] = {
+                    "flyer_id": flyer_id,
+                    "store": store,
+                    "pages": [os.path.join(snapshot_dir, os.path.basename(p)) for p in page_files],
+                    "stitched_image": os.path.join(snapshot_dir, "complete_flyer.jpg"),
+                    "page_digests": [(page_digests or {}).get(p) for p in page_files],
+                    "image_urls": list(image_urls),
+                    "created_at": datetime.now().isoformat(),
+                    "valid_to": valid_to.isoformat(),
+                    "postal_codes": [],
+                }
+                self._save_index()
+
+        return self.link(postal_code, flyer_id, store)
+
+    def uncached(self, image_urls, page_files, stitched_image, store=DEFAULT_STORE):
+        """Snapshot-shaped view of a flyer built by one job that must not be cached (e.g. pages failed)"""
+        return {
+            "flyer_id": self.flyer_id_for_urls(image_urls),
+            "store": store,
+            "pages": list(page_files),
+            "stitched_image": stitched_image,
+            "image_urls": list(image_urls),
+            "created_at": datetime.now().isoformat(),
+            "valid_to": flyer_week_end(end_weekday=self.week_end_day).isoformat(),
+            "postal_codes": [],
+            "partial": True,
+        }
+
+    def purge_expired(self):
+        """Remove snapshots whose flyer week has ended, along with index entries pointing at them"""
+        with self.lock:
+            self.next_purge_at = flyer_week_end(end_weekday=self.week_end_day)
+            expired = [flyer_id for flyer_id, snapshot in self.index["snapshots"].items()
+                       if not self._is_valid(snapshot)]
+            for flyer_id in expired:
+                del self.index["snapshots"][flyer_id]
+                shutil.rmtree(os.path.join(self.cache_dir, flyer_id), ignore_errors=True)
+            for key in ("postal_codes", "fsa"):
+                self.index[key] = {code: flyer_id for code, flyer_id in self.index[key].items()
+                                   if flyer_id in self.index["snapshots"]}
+            if expired:
+                print(f"Purged {len(expired)} expired flyer snapshot(s)")
+            self._save_index()
+            return len(expired)
+
+    def stats(self):
+        """Snapshot counts and hit/miss counters"""
+        with self.lock:
+            return {
+                "snapshots": len(self.index["snapshots"]),
+                "postal_codes": len(self.index["postal_codes"]),
+                "fsa_prefixes": len(self.index["fsa"]),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
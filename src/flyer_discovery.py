@@ -0,0 +1,262 @@
+import json
+import os
+import re
+import threading
+import time
+from html import unescape
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+
+from flyer_downloader import FlyerDownloader
+from store_registry import DEFAULT_STORE, store_search_path
+
+# Matches extra_large page images in HTML attributes, inline scripts and (escaped) JSON
+EXTRA_LARGE_URL_PATTERN = re.compile(
+    r'(?:https?:)?(?:\\?/){2}[^\s"\'<>()]*?extra_large[^\s"\'<>()]*?\.jpe?g(?:\?[^\s"\'<>()]*)?',
+    re.IGNORECASE,
+)
+
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/json;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-CA,en;q=0.9',
+}
+
+
+def is_flyer_page_url(url):
+    """True for extra_large*.jpg flyer page images (same filter as the Selenium path)"""
+    path = url.lower().split('?', 1)[0]
+    return 'extra_large' in path and (path.endswith('.jpg') or path.endswith('.jpeg'))
+
+
+def absolute_url(url, base_url):
+    """Resolve a (possibly protocol-relative) URL against the page it was found on"""
+    if url.startswith('//'):
+        return 'https:' + url
+    return urljoin(base_url, url)
+
+
+def extract_flyer_image_urls(text, base_url=""):
+    """Find extra_large page image URLs anywhere in an HTML or JSON document, in document order"""
+    urls = []
+    for match in EXTRA_LARGE_URL_PATTERN.finditer(unescape(text)):
+        url = absolute_url(match.group(0).replace('\\/', '/'), base_url)
+        if is_flyer_page_url(url) and url not in urls:
+            urls.append(url)
+    return urls
+
+
+class _FlyerPageParser(HTMLParser):
+    """Collect image sources, flyer links and JSON script bodies from a Flipp page"""
+
+    def __init__(self):
+        super().__init__()
+        self.image_urls = []
+        self.flyer_links = []
+        self.json_blobs = []
+        self._in_json_script = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'img' or tag == 'source':
+            for name in ('src', 'data-src', 'data-original'):
+                if attrs.get(name):
+                    self.image_urls.append(attrs[name])
+            for name in ('srcset', 'data-srcset'):
+                for candidate in (attrs.get(name) or '').split(','):
+                    if candidate.strip():
+                        self.image_urls.append(candidate.strip().split()[0])
+        elif tag == 'a':
+            href = attrs.get('href') or ''
+            if '/flyer' in href.lower() and href not in self.flyer_links:
+                self.flyer_links.append(href)
+        elif tag == 'script':
+            script_type = (attrs.get('type') or '').lower()
+            self._in_json_script = 'json' in script_type
+
+    def handle_endtag(self, tag):
+        if tag == 'script':
+            self._in_json_script = False
+
+    def handle_data(self, data):
+        if self._in_json_script and data.strip():
+            self.json_blobs.append(data)
+
+
+def _walk_json_strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _walk_json_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _walk_json_strings(item)
+
+
+class HttpFlyerDiscovery:
+    """Find flyer page image URLs with plain HTTP requests and HTML/JSON parsing (no browser)"""
+
+    name = "http"
+
+    def __init__(self, base_url="https://flipp.com", search_path=None, timeout=5, max_flyer_links=2, session=None,
+                 store=DEFAULT_STORE):
+        self.base_url = base_url.rstrip('/')
+        self.search_path = search_path or store_search_path(store)
+        self.timeout = timeout
+        self.max_flyer_links = max_flyer_links
+        self.session = session or requests.Session()
+        self.session.headers.update(BROWSER_HEADERS)
+        # No browser, so nothing is captured; pages are always downloaded
+        self.captured_pages = {}
+
+    def _fetch(self, url, postal_code):
+        response = self.session.get(url, params={'postal_code': postal_code}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def _urls_from_document(self, text, page_url):
+        """Extract page image URLs from the raw text, image tags and JSON script blocks"""
+        parser = _FlyerPageParser()
+        try:
+            parser.feed(text)
+        except Exception as e:
+            print(f"Warning: HTML parse error on {page_url}: {e}")
+
+        # Absolute URLs in tags, inline scripts and JSON responses, in document order
+        urls = extract_flyer_image_urls(text, page_url)
+
+        # Relative image sources and srcset candidates
+        for src in parser.image_urls:
+            url = absolute_url(src, page_url)
+            if is_flyer_page_url(url) and url not in urls:
+                urls.append(url)
+
+        # Embedded JSON whose strings need decoding first
+        for blob in parser.json_blobs:
+            try:
+                strings = _walk_json_strings(json.loads(blob))
+            except ValueError:
+                strings = [blob]
+            for value in strings:
+                for url in extract_flyer_image_urls(value, page_url):
+                    if url not in urls:
+                        urls.append(url)
+
+        return urls, parser.flyer_links
+
+    def find_flyer_image_urls(self, postal_code):
+        """Fetch the store search page (following flyer links if needed) and return page image URLs"""
+        search_url = self.base_url + self.search_path
+        try:
+            print(f"Discovering flyer pages over HTTP: {search_url}")
+            urls, flyer_links = self._urls_from_document(self._fetch(search_url, postal_code), search_url)
+
+            # The search page may only link to the flyer viewer; look there next
+            for link in flyer_links[:self.max_flyer_links]:
+                if urls:
+                    break
+                flyer_url = urljoin(search_url, link)
+                print(f"Following flyer link: {flyer_url}")
+                try:
+                    urls, _ = self._urls_from_document(self._fetch(flyer_url, postal_code), flyer_url)
+                except requests.RequestException as e:
+                    print(f"Warning: failed to fetch {flyer_url}: {e}")
+
+            print(f"Found {len(urls)} extra_large*.jpg image URLs over HTTP")
+            return urls
+
+        except Exception as e:
+            print(f"HTTP flyer discovery failed: {e}")
+            return []
+
+
+class SeleniumFlyerDiscovery:
+    """Find flyer page image URLs by driving a pooled Chromium browser"""
+
+    name = "selenium"
+
+    def __init__(self, driver_pool, lease_timeout=300, output_dir="data", on_status=None, store=DEFAULT_STORE):
+        self.driver_pool = driver_pool
+        self.store = store
+        self.lease_timeout = lease_timeout
+        self.output_dir = output_dir
+        self.on_status = on_status or (lambda message: None)
+        self.lease_wait_seconds = None
+        self.last_select_stats = None
+        self.last_readiness = None
+        self.captured_pages = {}
+
+    def find_flyer_image_urls(self, postal_code):
+        """Lease a browser, set the postal code and collect page image URLs from the rendered page"""
+        self.on_status("Waiting for a browser...")
+        selector = self.driver_pool.acquire(timeout=self.lease_timeout)
+        try:
+            self.lease_wait_seconds = selector.lease_wait_seconds
+            self.on_status("Setting up browser and postal code...")
+            print(f"Setting postal code: {postal_code} (waited {selector.lease_wait_seconds:.2f}s for a browser)")
+            if not selector.select_store(postal_code=postal_code, store=self.store):
+                raise Exception("Failed to set postal code")
+            self.last_select_stats = selector.last_select_stats
+
+            self.on_status("Finding flyer pages...")
+            downloader = FlyerDownloader(selector.driver, output_dir=self.output_dir, store=self.store)
+            urls = downloader.find_flyer_image_urls()
+            self.last_readiness = downloader.last_readiness
+            # Read while the browser is still leased; its buffer is gone once the next job navigates
+            self.captured_pages = downloader.captured_pages
+            return urls
+        finally:
+            self.driver_pool.release(selector)
+
+
+def fixture_check(fixture_path=None, port=8798):
+    """Serve a saved flyer page from a local HTTP server behind a search page that links to it, and
+    check that HTTP discovery follows the link and finds every extra_large page URL in page order"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    fixture_path = fixture_path or os.path.join(os.path.dirname(__file__), '..', 'data', 'flyer_page_fixture.html')
+    with open(fixture_path, 'rb') as f:
+        flyer_page = f.read()
+    search_path = store_search_path(DEFAULT_STORE)
+    search_page = b'<html><body><a href="/flyers/no-frills-weekly-flyer?flyer_run_id=987654">Weekly Flyer</a></body></html>'
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            path = self.path.split('?', 1)[0]
+            body = search_page if path == search_path else flyer_page if path.startswith('/flyers/') else None
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        started = time.monotonic()
+        urls = HttpFlyerDiscovery(base_url=f"http://127.0.0.1:{port}").find_flyer_image_urls("M5V3L9")
+        elapsed = time.monotonic() - started
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    pages = [int(re.search(r'/(\d+)/extra_large', url).group(1)) for url in urls]
+    print(f"Found pages {pages} in {elapsed:.2f}s with {len(requested)} requests")
+    assert pages == [1, 2, 3, 4, 5, 6], pages
+    assert all(url.startswith('https://f.wishabi.net/page_items/987654/') for url in urls), urls
+    print("✓ HTTP discovery found every page of the fixture flyer")
+
+
+if __name__ == "__main__":
+    fixture_check()
@@ -1,57 +1,69 @@
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-import requests
-import time
+import base64
+import hashlib
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from async_downloader import shared_downloader
+from page_readiness import NetworkMonitor, PageReadiness
+from store_registry import DEFAULT_STORE, store_name, store_search_url
 
 class FlyerDownloader:
-    def __init__(self, driver, output_dir="data"):
+    def __init__(self, driver, output_dir="data", image_downloader=None, expected_pages=None, readiness_deadline=None,
+                 store=DEFAULT_STORE):
         self.driver = driver
         self.output_dir = output_dir
+        self.store_name = store_name(store)
+        self.search_url = store_search_url(store)
+        self.image_downloader = image_downloader
+        # Page count of the flyer, if known, lets readiness stop as soon as that many images are present
+        self.expected_pages = expected_pages
+        self.readiness_deadline = readiness_deadline or float(os.getenv('PAGE_READY_DEADLINE', '15'))
+        self.last_readiness = None
+        # "browser" saves the page images Chromium already fetched; "http" always downloads them again
+        self.image_source = os.getenv('FLYER_IMAGE_SOURCE', 'browser').lower()
+        self.captured_pages = {}
+        self.last_download_stats = None
+        self.last_page_stats = []
+        self.last_page_digests = {}
         os.makedirs(output_dir, exist_ok=True)
         
     def download_flyers(self):
-        """Navigate to Flipp No Frills page and save all JPG images"""
+        """Navigate to the store's Flipp page and save all JPG images"""
+        image_urls = self.find_flyer_image_urls()
+        return self.download_images(image_urls)
+
+    def find_flyer_image_urls(self):
+        """Navigate to the store's Flipp page and collect the extra_large*.jpg page URLs"""
         try:
-            print("Navigating to No Frills flyers on Flipp...")
-            flyer_url = "https://flipp.com/search/No%20Frills"
-            self.driver.get(flyer_url)
+            # Watch network events from here on, so requests of the page we came from are ignored
+            already_open = self.driver.current_url.split('?', 1)[0] == self.search_url
+            monitor = NetworkMonitor(self.driver, keep_buffered=already_open)
+            if already_open:
+                # A restored Flipp session already opened the flyers
+                print(f"Already on {self.store_name} flyers on Flipp")
+            else:
+                print(f"Navigating to {self.store_name} flyers on Flipp...")
+                self.driver.get(self.search_url)
             
-            # Wait for page to load and images to appear
+            # Wait until requests settle, the DOM stops changing and flyer images are present
             print("Waiting for flyer images to load...")
+            readiness = PageReadiness(self.driver, monitor)
             try:
-                # Wait for document to be ready
-                WebDriverWait(self.driver, 15).until(
-                    lambda d: d.execute_script("return document.readyState") == "complete"
-                )
-                
-                # Scroll down to trigger lazy-loading of images
-                print("Scrolling to load images...")
+                # Scroll down to trigger lazy-loading of images, then wait for what that started
                 self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                time.sleep(1)
+                first = readiness.wait(deadline=self.readiness_deadline, expected_images=self.expected_pages)
                 self.driver.execute_script("window.scrollTo(0, 0);")
-                time.sleep(1)
-                
-                # Wait for images to start loading (check if any extra_large images exist)
-                WebDriverWait(self.driver, 10).until(
-                    lambda d: d.execute_script("""
-                        var imgs = document.getElementsByTagName('img');
-                        var count = 0;
-                        for(var i = 0; i < imgs.length; i++) {
-                            if(imgs[i].src && imgs[i].src.includes('extra_large')) count++;
-                        }
-                        return count;
-                    """) > 0
-                )
-                # Brief wait for remaining images to populate
-                time.sleep(2)
-                print("Page loaded!")
+                # Only waits for anything scrolling back up triggered
+                second = readiness.wait(deadline=max(1.0, self.readiness_deadline - first["seconds"]),
+                                        expected_images=self.expected_pages)
+                self.last_readiness = dict(second, seconds=round(first["seconds"] + second["seconds"], 3))
+                if self.last_readiness["ready"]:
+                    print(f"Page loaded in {self.last_readiness['seconds']:.2f}s "
+                          f"({self.last_readiness['images']} flyer images, {self.last_readiness['reason']})")
+                else:
+                    print(f"Page not settled after {self.last_readiness['seconds']:.2f}s "
+                          f"({self.last_readiness['images']} flyer images); continuing with what is there")
             except Exception as e:
-                print(f"Timeout waiting for images: {e}")
-                # Continue anyway - give it a bit more time
-                time.sleep(5)
+                print(f"Error waiting for images: {e}")
             
             print(f"Current URL: {self.driver.current_url}")
             
@@ -83,6 +95,10 @@ class FlyerDownloader:
                 // Remove duplicates
                 return [...new Set(imageUrls)];
             """)
+            # Responses seen on the network, including images the page has since unloaded
+            for url in monitor.responses:
+                if 'extra_large' in url and url not in all_resources:
+                    all_resources.append(url)
             
             print(f"Found {len(all_resources)} extra_large*.jpg image URLs")
             
@@ -107,70 +123,127 @@ class FlyerDownloader:
                 if 'extra_large' in img_url.lower() and (img_url.lower().endswith('.jpg') or img_url.lower().endswith('.jpeg')):
                     filtered_urls.append(img_url)
             
-            print(f"Downloading {len(filtered_urls)} images (20 concurrent downloads)...")
+            if not filtered_urls:
+                print("WARNING: No flyer image URLs found!")
+                self.save_debug_page(all_resources)
+            elif self.image_source == "browser":
+                self.captured_pages = self.capture_page_bodies(filtered_urls, monitor)
             
-            # Function to download a single image
-            def download_image(args):
-                idx, img_url = args
-                try:
-                    # Add headers to mimic a browser
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                        'Referer': 'https://flipp.com/'
-                    }
-                    
-                    response = requests.get(img_url, timeout=30, headers=headers)
-                    if response.status_code == 200:
-                        file_size = len(response.content)
-                        
-                        # If we found an extra_large image, download it no matter the size
-                        filename = os.path.join(self.output_dir, f"flyer_page_{idx+1:02d}.jpg")
-                        with open(filename, 'wb') as f:
-                            f.write(response.content)
-                        print(f"✓ Saved: {filename} ({file_size/1024:.1f} KB)")
-                        return filename
-                    else:
-                        print(f"✗ Failed: HTTP {response.status_code} for image {idx+1}")
-                        return None
-                        
-                except Exception as e:
-                    print(f"✗ Error downloading image {idx+1}: {e}")
-                    return None
-            
-            # Download images concurrently (20 at a time)
-            downloaded_files = []
-            with ThreadPoolExecutor(max_workers=20) as executor:
-                # Submit all download tasks
-                future_to_url = {executor.submit(download_image, (i, url)): url for i, url in enumerate(filtered_urls)}
-                
-                # Collect results as they complete
-                for future in as_completed(future_to_url):
-                    result = future.result()
-                    if result:
-                        downloaded_files.append(result)
+            return filtered_urls
+            
+        except Exception as e:
+            print(f"Error finding flyer images: {e}")
+            import traceback
+            traceback.print_exc()
+            return []
+
+    def capture_page_bodies(self, image_urls, monitor):
+        """Save page images straight from the browser's network buffer as flyer_page_XX.jpg.
+
+        Returns {url: page result} for the pages captured; pages whose bodies the browser no
+        longer holds are left for download_images to fetch over HTTP.
+        """
+        started = time.monotonic()
+        monitor.poll()
+        hash_algorithm = (self.image_downloader or shared_downloader()).hash_algorithm
+        captured = {}
+        for i, url in enumerate(image_urls):
+            response = monitor.responses.get(url)
+            if not response or response["status"] != 200 or not response["finished"]:
+                continue
+            page_started = time.monotonic()
+            try:
+                body = self.driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': response["request_id"]})
+            except Exception:
+                # Evicted from the buffer (or never kept)
+                continue
+            if not body.get('base64Encoded'):
+                continue
+            data = base64.b64decode(body['body'])
+            path = os.path.join(self.output_dir, f"flyer_page_{i+1:02d}.jpg")
+            with open(path + ".part", 'wb') as f:
+                f.write(data)
+            os.replace(path + ".part", path)
+            captured[url] = {
+                "index": i, "url": url, "path": path, "status": 200, "bytes": len(data),
+                "seconds": time.monotonic() - page_started, "attempts": 0, "error": None,
+                "digest": hashlib.new(hash_algorithm, data).hexdigest() if hash_algorithm else None,
+                "source": "browser",
+            }
+        print(f"Captured {len(captured)}/{len(image_urls)} flyer pages from the browser "
+              f"({sum(p['bytes'] for p in captured.values())/1024/1024:.1f} MB in {time.monotonic() - started:.2f}s)")
+        return captured
+
+    def download_images(self, image_urls, on_page=None, captured_pages=None):
+        """Download the given flyer page URLs as flyer_page_XX.jpg, in page order.
+
+        Pages in `captured_pages` (default: those captured by find_flyer_image_urls) are already
+        on disk and are not downloaded again.
+        """
+        try:
+            downloader = self.image_downloader or shared_downloader()
+            captured_pages = self.captured_pages if captured_pages is None else captured_pages
+            captured = [dict(captured_pages[url], index=i) for i, url in enumerate(image_urls)
+                        if url in captured_pages and os.path.exists(captured_pages[url]["path"])]
+            captured_urls = {page["url"] for page in captured}
+            remaining = len(image_urls) - len(captured)
+            if captured:
+                print(f"Using {len(captured)} flyer pages captured from the browser; "
+                      f"downloading the other {remaining}")
+            if remaining:
+                print(f"Downloading {remaining} images ({downloader.max_connections} pooled connections, "
+                      f"{downloader.per_host_limit} per host)...")
+            
+            def report_page(result):
+                result["source"] = "http"
+                page = result["index"] + 1
+                if result["path"]:
+                    print(f"✓ Saved: {result['path']} ({result['bytes']/1024:.1f} KB in {result['seconds']:.2f}s, "
+                          f"{result['attempts']} attempt(s))")
+                else:
+                    print(f"✗ Failed image {page}: {result['error']}")
+                if on_page:
+                    on_page(result)
             
-            # Sort downloaded files by name to maintain order
-            downloaded_files = sorted(downloaded_files)
+            for page in captured:
+                if on_page:
+                    on_page(page)
+            items = [
+                (i, url, os.path.join(self.output_dir, f"flyer_page_{i+1:02d}.jpg"))
+                for i, url in enumerate(image_urls) if url not in captured_urls
+            ]
+            if items:
+                results, summary = downloader.download(items, on_page=report_page)
+            else:
+                results, summary = [], {"bytes": 0, "wall_seconds": 0.0, "retries": 0,
+                                        "page_seconds_p50": None, "page_seconds_max": None}
+            results = sorted(captured + results, key=lambda r: r["index"])
+            summary = dict(
+                summary,
+                pages=len(image_urls),
+                downloaded=sum(1 for r in results if r["path"]),
+                failed=sum(1 for r in results if not r["path"]),
+                captured=len(captured),
+                bytes_over_http=summary["bytes"],
+                bytes=summary["bytes"] + sum(page["bytes"] for page in captured),
+            )
+            self.last_download_stats = summary
+            self.last_page_stats = results
+            
+            # Results are in page order
+            downloaded_files = [r["path"] for r in results if r["path"]]
+            self.last_page_digests = {r["path"]: r["digest"] for r in results if r["path"] and r["digest"]}
             
             print(f"\n{'='*60}")
-            print(f"Successfully downloaded {len(downloaded_files)} flyer images")
+            print(f"Successfully downloaded {len(downloaded_files)} flyer images "
+                  f"({summary['bytes']/1024/1024:.1f} MB, {summary['bytes_over_http']/1024/1024:.1f} MB over HTTP "
+                  f"in {summary['wall_seconds']:.2f}s, {summary['retries']} retries)")
             print(f"{'='*60}\n")
             
             # If we still have no images, save debug info
-            if not downloaded_files:
+            if image_urls and not downloaded_files:
                 print("WARNING: No images downloaded!")
-                print("\nSaving page HTML for debugging...")
-                debug_file = os.path.join(self.output_dir, "page_debug.html")
-                with open(debug_file, 'w', encoding='utf-8') as f:
-                    f.write(self.driver.page_source)
-                print(f"Page source saved to: {debug_file}")
-                
-                # Print all image URLs found
-                print(f"\nAll image URLs found ({len(all_resources)}):")
-                for url in all_resources[:20]:
-                    print(f"  - {url}")
-                if len(all_resources) > 20:
-                    print(f"  ... and {len(all_resources)-20} more")
+                self.save_debug_page(image_urls)
             
             return downloaded_files
             
@@ -179,3 +252,23 @@ class FlyerDownloader:
             import traceback
             traceback.print_exc()
             return []
+
+    def save_debug_page(self, image_urls):
+        """Save the current page HTML and list the image URLs found, for debugging"""
+        try:
+            if not self.driver:
+                raise Exception("no browser page to save")
+            print("\nSaving page HTML for debugging...")
+            debug_file = os.path.join(self.output_dir, "page_debug.html")
+            with open(debug_file, 'w', encoding='utf-8') as f:
+                f.write(self.driver.page_source)
+            print(f"Page source saved to: {debug_file}")
+        except Exception as e:
+            print(f"Failed to save page HTML: {e}")
+        
+        # Print all image URLs found
+        print(f"\nAll image URLs found ({len(image_urls)}):")
+        for url in image_urls[:20]:
+            print(f"  - {url}")
+        if len(image_urls) > 20:
+            print(f"  ... and {len(image_urls)-20} more")
@@ -1,28 +1,109 @@
 import google.generativeai as genai
-from PIL import Image
+import json
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from result_cache import ResultCache, file_digest, normalize_text
+from image_preprocessor import ImagePreprocessor
+
+PAGE_EXTRACTION_PROMPT = """
+List every item advertised as ON SALE on these grocery flyer pages. Respond with ONLY a JSON array, no other text.
+Each element must be an object with these keys:
+- "name": product name as printed, including brand and size if shown
+- "price": sale price as printed (e.g. "$3.99", "2 for $5", "$1.49/lb"), or "" if not visible
+- "unit": what the price is per (e.g. "lb", "kg", "each", "pkg"), or "" if not shown
+- "category": one of produce, meat, seafood, dairy, bakery, pantry, frozen, snacks, beverages, household, other
+- "page": 1-based position of the image the item appears on, among the images in this request
+Return [] if the pages have no grocery items.
+"""
+
+
+def parse_sale_items(text):
+    """Parse the JSON item list from a page extraction response (tolerates code fences and stray text).
+
+    Returns None when the response holds no parseable JSON array (e.g. it was cut off), so a
+    garbled page is told apart from one that really has no items.
+    """
+    match = re.search(r'\[.*\]', text or "", re.DOTALL)
+    if not match:
+        return None
+    try:
+        items = json.loads(match.group(0))
+    except ValueError:
+        return None
+    if not isinstance(items, list):
+        return None
+    parsed = []
+    for item in items:
+        if isinstance(item, dict) and str(item.get("name") or "").strip():
+            parsed.append({
+                "name": str(item["name"]).strip(),
+                "price": str(item.get("price") or "").strip(),
+                "unit": str(item.get("unit") or "").strip().lower(),
+                "category": str(item.get("category") or "other").strip().lower(),
+                "page": item.get("page") if isinstance(item.get("page"), int) else 1,
+            })
+    return parsed
+
 
 class GeminiRecommender:
-    def __init__(self, api_key):
+    def __init__(self, api_key, model_name='gemini-2.5-flash', cache=None, analysis_mode=None, page_concurrency=None, pages_per_call=None, on_progress=None, page_cache=None):
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self.cache = cache
+        # Per-page extractions are far more numerous than meal plans, so they get their own cache
+        self.page_cache = page_cache
+        self.preprocessor = ImagePreprocessor.for_model(model_name)
+        # "grid" sends the stitched flyer in one call; "map_reduce" extracts items page by page
+        # in parallel and plans meals from the merged list; "auto" uses map_reduce for multi-page flyers
+        self.analysis_mode = (analysis_mode or os.getenv('GEMINI_ANALYSIS_MODE', 'auto')).lower()
+        self.page_concurrency = int(page_concurrency or os.getenv('GEMINI_PAGE_CONCURRENCY', '4'))
+        self.pages_per_call = max(1, int(pages_per_call or os.getenv('GEMINI_PAGES_PER_CALL', '1')))
+        self.last_cache_hit = False
+        self.last_preprocess_stats = None
+        self.last_map_stats = None
+        self.last_items = None
+        self.last_store_items = {}
+        # Positions (in the last extraction) of flyers with a failed, unreadable or empty page call
+        self.last_incomplete = set()
+        self.last_generation_stats = None
+        # Called with (pages analyzed, total pages) as per-page extraction calls finish
+        self.on_progress = on_progress or (lambda done, total: None)
+
+    def recommendation_cache_key(self, flyer_image_path, num_people, num_meals, cuisine_preference, special_notes, mode="grid"):
+        """Cache key from the flyer content hash and normalized request parameters"""
+        return ResultCache.make_key(
+            "recommendations",
+            mode,
+            self.model_name,
+            self.preprocessor.max_pixels,
+            file_digest(flyer_image_path),
+            int(num_people),
+            int(num_meals),
+            normalize_text(cuisine_preference),
+            normalize_text(special_notes),
+        )
         
-    def get_recommendations(self, flyer_image_path, num_people=2, num_meals=7, cuisine_preference="Chinese", special_notes=""):
-        """Get cooking and shopping recommendations from Gemini based on the flyer image"""
-        try:
-            print("Analyzing flyer with Gemini AI...")
-            
-            # Open the image
-            img = Image.open(flyer_image_path)
-            
-            # Build special notes requirement if provided
-            special_notes_requirement = ""
-            if special_notes and special_notes.strip():
-                special_notes_requirement = f"- IMPORTANT: {special_notes.strip()}"
-            
-            # Create the prompt
-            prompt = f"""
-Analyze this No Frills flyer and create an EASY meal plan. Output ONLY the Shopping List and Meal Plan sections. No introductions, conclusions, or extra commentary.
+    def _prepare_image(self, image_path):
+        """Downscale and re-encode an image to the model's upload budget"""
+        image_bytes, stats = self.preprocessor.prepare(image_path)
+        print(f"Prepared {os.path.basename(image_path)} for upload: {stats['original_size'][0]}x{stats['original_size'][1]} "
+              f"({stats['original_bytes']/1024:.0f} KB) -> {stats['output_size'][0]}x{stats['output_size'][1]} "
+              f"({stats['output_bytes']/1024:.0f} KB) in {stats['seconds']:.2f}s")
+        return {'mime_type': 'image/jpeg', 'data': image_bytes}, stats
+
+    def _meal_plan_prompt(self, source, num_people, num_meals, cuisine_preference, special_notes):
+        """Meal plan instructions shared by the single-image and item-list modes"""
+        # Build special notes requirement if provided
+        special_notes_requirement = ""
+        if special_notes and special_notes.strip():
+            special_notes_requirement = f"- IMPORTANT: {special_notes.strip()}"
+        
+        return f"""
+{source} and create an EASY meal plan. Output ONLY the Shopping List and Meal Plan sections. No introductions, conclusions, or extra commentary.
 
 Requirements:
 - Number of people: {num_people}
@@ -49,12 +130,213 @@ Suggest {num_meals} {cuisine_preference} meals. For EACH meal, create {num_peopl
 
 Be specific and practical. While prioritizing sale items from the flyer, you may suggest other ingredients if they fit within a reasonable budget.
 """
+
+    def _generate(self, contents, on_token=None):
+        """Run the meal plan call; with `on_token`, stream it and pass each text chunk as it arrives"""
+        started = time.monotonic()
+        if not on_token:
+            text = self.model.generate_content(contents).text
+            self.last_generation_stats = {"streamed": False, "total_seconds": round(time.monotonic() - started, 3)}
+            return text
+
+        chunks = []
+        first_token_seconds = None
+        for chunk in self.model.generate_content(contents, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks carrying only finish/safety metadata have no text
+                continue
+            if not text:
+                continue
+            if first_token_seconds is None:
+                first_token_seconds = time.monotonic() - started
+                print(f"First tokens after {first_token_seconds:.2f}s")
+            chunks.append(text)
+            on_token(text)
+        self.last_generation_stats = {
+            "streamed": True,
+            "time_to_first_token": round(first_token_seconds, 3) if first_token_seconds is not None else None,
+            "total_seconds": round(time.monotonic() - started, 3),
+        }
+        return "".join(chunks)
+
+    def _extract_page_group(self, page_files):
+        """Sale items on a group of pages, from the cache or one extraction call; None on failure.
+
+        Returns (items, cache hit, key to store the items under once the whole extraction is done,
+        preprocessing stats of the pages uploaded).
+        """
+        try:
+            cache_key = None
+            if self.page_cache is not None:
+                cache_key = ResultCache.make_key(
+                    "page_items",
+                    self.model_name,
+                    self.preprocessor.max_pixels,
+                    [file_digest(path) for path in page_files],
+                )
+                cached = self.page_cache.get(cache_key)
+                if cached is not None:
+                    return cached, True, None, []
+
+            parts = [PAGE_EXTRACTION_PROMPT]
+            preprocess_stats = []
+            for path in page_files:
+                img, stats = self._prepare_image(path)
+                parts.append(img)
+                preprocess_stats.append(stats)
+            response = self.model.generate_content(parts)
+            items = parse_sale_items(response.text)
+            if items is None:
+                print(f"Unreadable sale item list for {', '.join(os.path.basename(p) for p in page_files)}; "
+                      f"counting the call as failed")
+                return None, False, None, preprocess_stats
+            return items, False, cache_key if items else None, preprocess_stats
+
+        except Exception as e:
+            print(f"Error extracting sale items from {', '.join(os.path.basename(p) for p in page_files)}: {e}")
+            return None, False, None, []
+
+    def extract_sale_items(self, page_files):
+        """Extract sale items from flyer pages with concurrent per-page (or per-group) calls"""
+        return self.extract_flyers_sale_items([page_files])[0]
+
+    def extract_flyers_sale_items(self, flyers_pages):
+        """Extract sale items from the pages of several flyers, sharing one pool of concurrent calls.
+
+        Returns one item list per flyer (None for a flyer whose every call failed); items are
+        de-duplicated within a flyer only, since the same product at two stores is a comparison.
+        """
+        started = time.monotonic()
+        # (flyer position, first page number in that flyer, pages) for every call
+        groups = []
+        for flyer_index, page_files in enumerate(flyers_pages):
+            for i in range(0, len(page_files), self.pages_per_call):
+                groups.append((flyer_index, i, page_files[i:i + self.pages_per_call]))
+        total_pages = sum(len(page_files) for page_files in flyers_pages)
+        workers = max(1, min(self.page_concurrency, len(groups)))
+        print(f"Extracting sale items from {total_pages} pages in {len(groups)} calls ({workers} at a time)...")
+
+        progress = {"done": 0}
+        progress_lock = threading.Lock()
+
+        def extract(group):
+            result = self._extract_page_group(group[2])
+            with progress_lock:
+                progress["done"] += len(group[2])
+                self.on_progress(progress["done"], total_pages)
+            return result
+
+        self.on_progress(0, total_pages)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gemini-page") as executor:
+            results = list(executor.map(extract, groups))
+        if self.page_cache is not None:
+            # One write of the cache file for the whole extraction, not one per page
+            self.page_cache.put_many([(key, group_items) for group_items, _, key, _ in results if key])
+
+        items = [[] for _ in flyers_pages]
+        seen = [set() for _ in flyers_pages]
+        calls = [0 for _ in flyers_pages]
+        failed_calls = [0 for _ in flyers_pages]
+        empty_calls = [0 for _ in flyers_pages]
+        for (flyer_index, group_start, group), (group_items, _, _, _) in zip(groups, results):
+            calls[flyer_index] += 1
+            if group_items is None:
+                failed_calls[flyer_index] += 1
+            elif not group_items:
+                empty_calls[flyer_index] += 1
+            for item in group_items or []:
+                key = (item["name"].casefold(), item["price"])
+                if key not in seen[flyer_index]:
+                    seen[flyer_index].add(key)
+                    # Page within the group -> page number within the flyer
+                    page = min(max(1, item.get("page") or 1), len(group))
+                    items[flyer_index].append(dict(item, page=group_start + page))
+
+        failed = sum(failed_calls)
+        # Per-page upload preprocessing, as the grid path records for its single image
+        self.last_preprocess_stats = [stats for result in results for stats in result[3]] or None
+        # A page group without a single item is more likely a misread than a flyer page with nothing on sale
+        self.last_incomplete = {i for i in range(len(flyers_pages)) if failed_calls[i] or empty_calls[i]}
+        self.last_map_stats = {
+            "pages": total_pages,
+            "calls": len(groups),
+            "cached_calls": sum(1 for result in results if result[1]),
+            "failed_calls": failed,
+            "empty_calls": sum(empty_calls),
+            "items": sum(len(flyer_items) for flyer_items in items),
+            "upload_original_bytes": sum(stats["original_bytes"] for stats in self.last_preprocess_stats or []),
+            "upload_bytes": sum(stats["output_bytes"] for stats in self.last_preprocess_stats or []),
+            "preprocess_seconds": round(sum(stats["seconds"] for stats in self.last_preprocess_stats or []), 3),
+            "map_seconds": round(time.monotonic() - started, 3),
+        }
+        print(f"Extracted {self.last_map_stats['items']} sale items ({self.last_map_stats['cached_calls']} cached, "
+              f"{failed} failed) in {self.last_map_stats['map_seconds']:.2f}s")
+        return [flyer_items if failed_calls[i] < calls[i] else None for i, flyer_items in enumerate(items)]
+
+    def get_recommendations(self, flyer_image_path, num_people=2, num_meals=7, cuisine_preference="Chinese", special_notes="", page_files=None, items=None, on_token=None, store_name="No Frills"):
+        """Get cooking and shopping recommendations from Gemini based on the flyer image.
+
+        With page_files and map-reduce analysis, items are extracted from each page in parallel
+        and the meal plan is written from the merged item list in one text-only call. Passing
+        already-indexed `items` skips the extraction step entirely. `on_token` receives the
+        meal plan text in chunks as Gemini generates it.
+        """
+        self.last_cache_hit = False
+        self.last_items = None
+        mode = self.analysis_mode
+        if mode == "auto":
+            mode = "map_reduce" if items or (page_files and len(page_files) > 1) else "grid"
+        if mode == "map_reduce" and not page_files and not items:
+            mode = "grid"
+
+        try:
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self.recommendation_cache_key(
+                    flyer_image_path, num_people, num_meals, cuisine_preference, special_notes, mode=mode
+                )
+                cached = self.cache.get(cache_key)
+                if cached:
+                    print("Using cached recommendations for this flyer and request")
+                    self.last_cache_hit = True
+                    if on_token:
+                        on_token(cached)
+                    return cached
+
+            print("Analyzing flyer with Gemini AI...")
             
-            # Generate content
-            response = self.model.generate_content([prompt, img])
+            if mode == "map_reduce" and not items:
+                items = self.extract_sale_items(page_files)
+                # Only a complete extraction may stand in for the flyer's items in the index
+                self.last_items = items if not self.last_incomplete else None
+            elif mode == "map_reduce":
+                print(f"Planning from {len(items)} indexed sale items (no image upload)")
+                self.last_map_stats = {"items": len(items), "indexed": True}
+            if mode == "map_reduce" and items:
+                # Reduce: plan meals from the merged item list, no image needed
+                reduce_started = time.monotonic()
+                item_lines = "\n".join(self._item_line(item) for item in items)
+                prompt = self._meal_plan_prompt(
+                    f"Review the sale items listed below from this week's {store_name} flyer",
+                    num_people, num_meals, cuisine_preference, special_notes,
+                ) + f"\nSale items in this flyer:\n{item_lines}\n"
+                text = self._generate(prompt, on_token)
+                self.last_map_stats["reduce_seconds"] = round(time.monotonic() - reduce_started, 3)
+            else:
+                if mode == "map_reduce":
+                    print("Per-page extraction found no sale items; analyzing the stitched flyer instead")
+                img, self.last_preprocess_stats = self._prepare_image(flyer_image_path)
+                prompt = self._meal_plan_prompt(
+                    f"Analyze this {store_name} flyer", num_people, num_meals, cuisine_preference, special_notes
+                )
+                text = self._generate([prompt, img], on_token)
             
             print("Recommendations generated successfully!")
-            return response.text
+            if cache_key and text:
+                self.cache.put(cache_key, text)
+            return text
             
         except Exception as e:
             print(f"Error getting recommendations from Gemini: {e}")
@@ -62,6 +344,105 @@ Be specific and practical. While prioritizing sale items from the flyer, you may
             traceback.print_exc()
             return None
             
+    def get_combined_recommendations(self, flyers, num_people=2, num_meals=7, cuisine_preference="Chinese", special_notes="", on_token=None):
+        """One meal plan from several stores' flyers, buying each item where it is cheapest.
+
+        `flyers` is a list of dicts with "store" (display name), "stitched_image", "page_files" and,
+        when already indexed, "items". Missing item lists are extracted from the pages of every
+        store in one concurrent pass; the plan is then written from the merged, store-tagged list.
+        If no store's items could be read, the stitched flyers are sent as images instead.
+        `last_store_items` maps store names to freshly and completely extracted items, for indexing.
+        """
+        self.last_cache_hit = False
+        self.last_items = None
+        self.last_store_items = {}
+        try:
+            cache_key = None
+            if self.cache is not None:
+                cache_key = ResultCache.make_key(
+                    "recommendations",
+                    "combined",
+                    self.model_name,
+                    self.preprocessor.max_pixels,
+                    sorted((flyer["store"], file_digest(flyer["stitched_image"])) for flyer in flyers),
+                    int(num_people),
+                    int(num_meals),
+                    normalize_text(cuisine_preference),
+                    normalize_text(special_notes),
+                )
+                cached = self.cache.get(cache_key)
+                if cached:
+                    print("Using cached recommendations for these flyers and request")
+                    self.last_cache_hit = True
+                    if on_token:
+                        on_token(cached)
+                    return cached
+
+            store_names = [flyer["store"] for flyer in flyers]
+            print(f"Analyzing flyers of {', '.join(store_names)} with Gemini AI...")
+            pending = [flyer for flyer in flyers if not flyer.get("items") and flyer.get("page_files")]
+            extracted = self.extract_flyers_sale_items([flyer["page_files"] for flyer in pending]) if pending else []
+            extracted_items = {flyer["store"]: items for flyer, items in zip(pending, extracted) if items}
+            # Only stores whose every page was read may stand in for the flyer's items in the index
+            self.last_store_items = {flyer["store"]: extracted_items[flyer["store"]]
+                                     for i, flyer in enumerate(pending)
+                                     if flyer["store"] in extracted_items and i not in self.last_incomplete}
+            if not pending:
+                self.last_map_stats = {"items": sum(len(flyer["items"]) for flyer in flyers), "indexed": True}
+
+            sections = []
+            for flyer in flyers:
+                items = flyer.get("items") or extracted_items.get(flyer["store"])
+                if items:
+                    sections.append(f"{flyer['store']}:\n" + "\n".join(self._item_line(item) for item in items))
+                else:
+                    print(f"No sale items read from the {flyer['store']} flyer; leaving it out")
+
+            comparison = (
+                "\nThe flyers are from different stores. Where the same or an equivalent item is on sale at more "
+                "than one store, pick the cheapest, and in the Shopping List group items under a heading per "
+                "store so each store is visited once.\n"
+            )
+            source_stores = ", ".join(store_names)
+            if sections:
+                reduce_started = time.monotonic()
+                prompt = self._meal_plan_prompt(
+                    f"Review the sale items listed below from this week's flyers of {source_stores}",
+                    num_people, num_meals, cuisine_preference, special_notes,
+                ) + comparison + "\nSale items by store:\n" + "\n\n".join(sections) + "\n"
+                text = self._generate(prompt, on_token)
+                if self.last_map_stats:
+                    self.last_map_stats["reduce_seconds"] = round(time.monotonic() - reduce_started, 3)
+            else:
+                print("Per-page extraction failed for every store; analyzing the stitched flyers instead")
+                contents = [self._meal_plan_prompt(
+                    f"Analyze these flyers of {source_stores}", num_people, num_meals, cuisine_preference, special_notes,
+                ) + comparison]
+                self.last_preprocess_stats = []
+                for flyer in flyers:
+                    img, stats = self._prepare_image(flyer["stitched_image"])
+                    self.last_preprocess_stats.append(stats)
+                    contents.extend([f"{flyer['store']} flyer:", img])
+                text = self._generate(contents, on_token)
+
+            print("Recommendations generated successfully!")
+            if cache_key and text:
+                self.cache.put(cache_key, text)
+            return text
+
+        except Exception as e:
+            print(f"Error getting combined recommendations from Gemini: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+
+    @staticmethod
+    def _item_line(item):
+        """One sale item as a prompt line: - name (price) per unit [category]"""
+        return (f"- {item['name']}" + (f" ({item['price']})" if item['price'] else "")
+                + (f" per {item['unit']}" if item.get('unit') and item['unit'] not in item['price'] else "")
+                + f" [{item['category']}]")
+
     def save_recommendations(self, recommendations, output_file="output/recommendations.txt"):
         """Save recommendations to a text file"""
         try:
@@ -72,3 +453,53 @@ Be specific and practical. While prioritizing sale items from the flyer, you may
         except Exception as e:
             print(f"Error saving recommendations: {e}")
             return None
+
+
+def incomplete_extraction_check():
+    """Run a map-reduce plan against a stub model where one page returns malformed JSON and check
+    that the partial item list is not offered for indexing (so later plans re-extract the flyer)"""
+    import io
+    import shutil
+    import tempfile
+    from PIL import Image
+    from item_index import SaleItemIndex
+
+    class Response:
+        def __init__(self, text):
+            self.text = text
+
+    class StubModel:
+        def generate_content(self, parts, stream=False):
+            if parts[0] == PAGE_EXTRACTION_PROMPT:
+                if Image.open(io.BytesIO(parts[1]['data'])).width == 400:
+                    return Response('[{"name": "Chicken thighs", "price": "$2.')
+                return Response('[{"name": "Eggs", "price": "$3.49", "category": "dairy", "page": 1}]')
+            return iter([Response("Meal plan")]) if stream else Response("Meal plan")
+
+    directory = tempfile.mkdtemp()
+    try:
+        pages = []
+        for i, size in enumerate((300, 400, 500)):
+            path = os.path.join(directory, f"page_{i + 1}.jpg")
+            Image.new('RGB', (size, size), 'white').save(path)
+            pages.append(path)
+        recommender = GeminiRecommender(api_key="stub")
+        recommender.model = StubModel()
+        index = SaleItemIndex(os.path.join(directory, "sale_items.db"))
+
+        text = recommender.get_recommendations(pages[0], page_files=pages, on_token=lambda chunk: None)
+        # Same gate as generate_recommendations_task
+        if recommender.last_items:
+            index.index_flyer("stub-flyer", recommender.last_items, "2099-01-01T00:00:00")
+        stats = recommender.last_map_stats
+        print(f"Plan: {text!r}; {stats['failed_calls']} failed of {stats['calls']} calls; "
+              f"indexed flyers: {index.stats()['flyers']}")
+        assert text and stats["failed_calls"] == 1, stats
+        assert recommender.last_items is None and index.stats()["flyers"] == 0
+        print("✓ A flyer with an unreadable page was not indexed")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    incomplete_extraction_check()
@@ -0,0 +1,91 @@
+import io
+import os
+import time
+
+from PIL import Image
+
+# Upload budgets per model. Gemini tiles and downsamples large images itself,
+# so pixels beyond these budgets only cost upload bytes and encode time.
+MODEL_PROFILES = {
+    'gemini-2.5-flash': {'max_pixels': 12_000_000, 'max_bytes': 7 * 1024 * 1024},
+    'gemini-2.5-flash-lite': {'max_pixels': 8_000_000, 'max_bytes': 5 * 1024 * 1024},
+    'gemini-2.5-pro': {'max_pixels': 16_000_000, 'max_bytes': 10 * 1024 * 1024},
+}
+DEFAULT_PROFILE = {'max_pixels': 12_000_000, 'max_bytes': 7 * 1024 * 1024}
+
+
+class ImagePreprocessor:
+    """Resize and re-encode a flyer image to a model's pixel and byte budget before upload"""
+
+    def __init__(self, max_pixels, max_bytes, quality=90, min_quality=60):
+        self.max_pixels = int(max_pixels)
+        self.max_bytes = int(max_bytes)
+        self.quality = quality
+        self.min_quality = min_quality
+
+    @classmethod
+    def for_model(cls, model_name):
+        """Preprocessor using the model's profile, overridable with GEMINI_MAX_PIXELS / GEMINI_MAX_UPLOAD_MB"""
+        profile = MODEL_PROFILES.get(model_name, DEFAULT_PROFILE)
+        max_pixels = int(os.getenv('GEMINI_MAX_PIXELS', profile['max_pixels']))
+        max_upload_mb = os.getenv('GEMINI_MAX_UPLOAD_MB')
+        max_bytes = int(float(max_upload_mb) * 1024 * 1024) if max_upload_mb else profile['max_bytes']
+        return cls(max_pixels=max_pixels, max_bytes=max_bytes)
+
+    def _load_scaled(self, path, target_size):
+        """Decode at reduced scale where possible (JPEG draft mode), then resize exactly"""
+        img = Image.open(path)
+        with img:
+            if img.format == 'JPEG':
+                # Lets libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full resolution
+                img.draft('RGB', target_size)
+            img = img.convert('RGB')
+        if img.size != target_size:
+            img = img.resize(target_size, Image.LANCZOS)
+        return img
+
+    def _encode(self, img):
+        """JPEG-encode, lowering quality and then dimensions until the byte budget is met"""
+        quality = self.quality
+        while True:
+            buffer = io.BytesIO()
+            img.save(buffer, 'JPEG', quality=quality, optimize=True)
+            if buffer.tell() <= self.max_bytes:
+                return buffer.getvalue(), img, quality
+            if quality > self.min_quality:
+                quality = max(self.min_quality, quality - 10)
+            else:
+                img = img.resize((max(1, int(img.width * 0.85)), max(1, int(img.height * 0.85))), Image.LANCZOS)
+
+    def prepare(self, path):
+        """Return (jpeg_bytes, stats) for uploading the image at `path`"""
+        started = time.monotonic()
+        original_bytes = os.path.getsize(path)
+        with Image.open(path) as probe:
+            original_size = probe.size
+            original_format = probe.format
+
+        width, height = original_size
+        scale = min(1.0, (self.max_pixels / float(width * height)) ** 0.5)
+        target_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+        if scale >= 1.0 and original_format == 'JPEG' and original_bytes <= self.max_bytes:
+            # Already within budget; upload the file untouched
+            with open(path, 'rb') as f:
+                data = f.read()
+            output_size, quality = original_size, None
+        else:
+            img = self._load_scaled(path, target_size)
+            data, img, quality = self._encode(img)
+            output_size = img.size
+            img.close()
+
+        stats = {
+            "original_size": list(original_size),
+            "original_bytes": original_bytes,
+            "output_size": list(output_size),
+            "output_bytes": len(data),
+            "quality": quality,
+            "seconds": round(time.monotonic() - started, 3),
+        }
+        return data, stats
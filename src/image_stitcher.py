@@ -1,11 +1,48 @@
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import math
+import mmap
 import os
+import tempfile
+import threading
+import time
+
+
+class _PageDroppingWriter:
+    """File wrapper that releases already-encoded canvas pages from memory after each encoder write.
+
+    Pillow's encoder writes its output in small blocks when the target has no fileno(),
+    so dropping the mapped pages after each block keeps resident memory flat. The canvas
+    is a shared file mapping, so dropped pages are simply re-read if the encoder needs them again.
+    """
+
+    def __init__(self, fp, canvas_map):
+        self.fp = fp
+        self.canvas_map = canvas_map
+
+    def write(self, data):
+        self.fp.write(data)
+        _drop_mapped_pages(self.canvas_map)
+
+    def flush(self):
+        self.fp.flush()
+
+
+def _drop_mapped_pages(canvas_map):
+    if hasattr(canvas_map, "madvise"):
+        canvas_map.madvise(mmap.MADV_DONTNEED)
+
 
 class ImageStitcher:
-    def __init__(self, output_dir="output"):
+    def __init__(self, output_dir="output", mode=None, max_memory_mb=None):
         self.output_dir = output_dir
+        # "memory" holds every page and the canvas in RAM, "strip" composes one grid row at a time,
+        # "auto" picks "memory" only when it fits under the memory ceiling
+        self.mode = (mode or os.getenv('STITCH_MODE', 'auto')).lower()
+        self.max_memory_mb = float(max_memory_mb or os.getenv('STITCH_MAX_MEMORY_MB', '512'))
+        self.last_stats = None
         os.makedirs(output_dir, exist_ok=True)
-    
+
     def clean_output_dir(self):
         """Delete all files in the output directory"""
         if os.path.exists(self.output_dir):
@@ -17,78 +54,368 @@ class ImageStitcher:
                         print(f"Deleted: {file_path}")
                 except Exception as e:
                     print(f"Error deleting {file_path}: {e}")
-        
+
+    @staticmethod
+    def grid_size(num_images):
+        """Rows and columns for a somewhat square grid"""
+        cols = math.ceil(math.sqrt(num_images))
+        rows = math.ceil(num_images / cols)
+        return rows, cols
+
+    @staticmethod
+    def read_sizes(image_files):
+        """Image dimensions from file headers, without decoding pixel data"""
+        sizes = []
+        for path in image_files:
+            with Image.open(path) as img:
+                sizes.append(img.size)
+        return sizes
+
+    def plan(self, sizes):
+        """Choose the stitching mode and cell scale that keep memory under the ceiling"""
+        rows, cols = self.grid_size(len(sizes))
+        max_width = max(w for w, _ in sizes)
+        max_height = max(h for _, h in sizes)
+        ceiling = self.max_memory_mb * 1024 * 1024
+
+        # Pillow stores RGB pixels in 4 bytes
+        all_pages = sum(w * h for w, h in sizes) * 4
+        canvas = max_width * cols * max_height * rows * 4
+        widest_row = max(sum(w * h for w, h in sizes[r * cols:(r + 1) * cols]) for r in range(rows)) * 4
+        canvas_strip = max_width * cols * max_height * 4
+
+        mode = self.mode
+        if mode == "auto":
+            mode = "memory" if all_pages + canvas <= ceiling else "strip"
+
+        # Strip mode keeps one row of decoded pages (and its canvas strip) resident;
+        # shrink cells if even that is too much
+        resident = all_pages + canvas if mode == "memory" else widest_row + canvas_strip
+        scale = min(1.0, math.sqrt(ceiling / resident)) if resident else 1.0
+        return {
+            "mode": mode,
+            "rows": rows,
+            "cols": cols,
+            "cell_width": max(1, int(max_width * scale)),
+            "cell_height": max(1, int(max_height * scale)),
+            "scale": scale,
+            "estimated_resident_mb": round(resident * scale * scale / 1024 / 1024, 1),
+        }
+
+    def _open_for_cell(self, path, scale):
+        """Open a page, decoding JPEGs at reduced scale when the cell is shrunk"""
+        img = Image.open(path)
+        if scale < 1.0:
+            target = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+            img.draft('RGB', target)
+            with img:
+                img = img.convert('RGB').resize(target)
+        return img
+
     def stitch_images(self, image_files, output_filename="complete_flyer.jpg"):
         """Stitch multiple images into a grid layout (somewhat square)"""
         if not image_files:
             print("No images to stitch!")
             return None
-            
+
         try:
             print("Cleaning output directory...")
             self.clean_output_dir()
             print()
-            
+
             print(f"Stitching {len(image_files)} images into a grid...")
-            
+
             # Sort files to ensure consistent order
             image_files = sorted(image_files)
-            
-            # Open all images
-            images = [Image.open(img) for img in image_files]
-            
-            num_images = len(images)
-            
-            # Calculate grid dimensions (try to make it somewhat square)
-            # Find factors close to square root
-            import math
-            cols = math.ceil(math.sqrt(num_images))
-            rows = math.ceil(num_images / cols)
-            
-            print(f"Creating {rows}x{cols} grid for {num_images} images")
-            
-            # Get max dimensions for each cell
-            max_width = max(img.width for img in images)
-            max_height = max(img.height for img in images)
-            
-            # Calculate total canvas size
-            canvas_width = max_width * cols
-            canvas_height = max_height * rows
-            
-            print(f"Creating stitched image: {canvas_width}x{canvas_height}px")
-            
-            # Create a new image with white background
-            stitched_image = Image.new('RGB', (canvas_width, canvas_height), 'white')
-            
-            # Paste each image in grid
-            for idx, img in enumerate(images):
-                row = idx // cols
-                col = idx % cols
-                
-                x_pos = col * max_width
-                y_pos = row * max_height
-                
-                # Center the image in its cell if it's smaller
-                x_offset = (max_width - img.width) // 2
-                y_offset = (max_height - img.height) // 2
-                
-                print(f"Adding image {idx+1}/{num_images} at position ({row},{col}) -> ({x_pos + x_offset}, {y_pos + y_offset})")
-                stitched_image.paste(img, (x_pos + x_offset, y_pos + y_offset))
-            
-            # Save the result
+
+            plan = self.plan(self.read_sizes(image_files))
+            self.last_stats = dict(plan)
+            scaled = "" if plan["scale"] >= 1.0 else f", cells scaled to {plan['scale']:.0%}"
+            print(f"Creating {plan['rows']}x{plan['cols']} grid for {len(image_files)} images "
+                  f"({plan['mode']} mode, ~{plan['estimated_resident_mb']} MB resident{scaled})")
+
             output_path = os.path.join(self.output_dir, output_filename)
-            stitched_image.save(output_path, 'JPEG', quality=95)
+            if plan["mode"] == "strip":
+                self._stitch_strips(image_files, plan, output_path)
+            else:
+                self._stitch_in_memory(image_files, plan, output_path)
+
             print(f"Stitched image saved to: {output_path}")
-            print(f"Grid layout: {rows} rows × {cols} columns")
-            
-            # Close all images
-            for img in images:
-                img.close()
-                
+            print(f"Grid layout: {plan['rows']} rows × {plan['cols']} columns")
             return output_path
-            
+
+        except Exception as e:
+            print(f"Error stitching images: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+
+    def _stitch_in_memory(self, image_files, plan, output_path):
+        """Decode every page and paste it onto one in-memory canvas"""
+        rows, cols = plan["rows"], plan["cols"]
+        max_width, max_height = plan["cell_width"], plan["cell_height"]
+
+        # Open all images
+        images = [self._open_for_cell(img, plan["scale"]) for img in image_files]
+        num_images = len(images)
+
+        # Calculate total canvas size
+        canvas_width = max_width * cols
+        canvas_height = max_height * rows
+
+        print(f"Creating stitched image: {canvas_width}x{canvas_height}px")
+
+        # Create a new image with white background
+        stitched_image = Image.new('RGB', (canvas_width, canvas_height), 'white')
+
+        # Paste each image in grid
+        for idx, img in enumerate(images):
+            row = idx // cols
+            col = idx % cols
+
+            x_pos = col * max_width
+            y_pos = row * max_height
+
+            # Center the image in its cell if it's smaller
+            x_offset = (max_width - img.width) // 2
+            y_offset = (max_height - img.height) // 2
+
+            print(f"Adding image {idx+1}/{num_images} at position ({row},{col}) -> ({x_pos + x_offset}, {y_pos + y_offset})")
+            stitched_image.paste(img, (x_pos + x_offset, y_pos + y_offset))
+
+        # Save the result
+        stitched_image.save(output_path, 'JPEG', quality=95)
+
+        # Close all images
+        for img in images:
+            img.close()
+
+    def _stitch_strips(self, image_files, plan, output_path):
+        """Compose the grid one row at a time on a file-backed canvas and stream the JPEG out.
+
+        Only one row of pages is decoded at once. The canvas lives in a temporary file
+        mapped into memory, and its pages are released as soon as each row is written
+        and again while the encoder consumes them.
+        """
+        rows, cols = plan["rows"], plan["cols"]
+        cell_width, cell_height = plan["cell_width"], plan["cell_height"]
+        canvas_width = cell_width * cols
+        num_images = len(image_files)
+
+        print(f"Creating stitched image: {canvas_width}x{cell_height * rows}px (row strips)")
+
+        with _MappedCanvas(self.output_dir, canvas_width, cell_height * rows) as canvas:
+            for row in range(rows):
+                y_pos = row * cell_height
+                for col in range(cols):
+                    idx = row * cols + col
+                    if idx >= num_images:
+                        break
+                    with self._open_for_cell(image_files[idx], plan["scale"]) as img:
+                        x_pos = col * cell_width
+                        x_offset = (cell_width - img.width) // 2
+                        y_offset = (cell_height - img.height) // 2
+                        print(f"Adding image {idx+1}/{num_images} at position ({row},{col}) -> ({x_pos + x_offset}, {y_pos + y_offset})")
+                        canvas.image.paste(img, (x_pos + x_offset, y_pos + y_offset))
+                canvas.drop_pages()
+            canvas.save(output_path)
+
+    def begin_stream(self, num_pages, output_filename="complete_flyer.jpg", workers=None, on_placed=None):
+        """Start a stitch that places pages as they arrive; see StreamingStitch"""
+        print("Cleaning output directory...")
+        self.clean_output_dir()
+        return StreamingStitch(self, num_pages, os.path.join(self.output_dir, output_filename), workers, on_placed)
+
+
+class _MappedCanvas:
+    """White RGB canvas backed by a temporary file mapped into memory"""
+
+    def __init__(self, directory, width, height):
+        self.directory = directory
+        self.width = width
+        self.height = height
+
+    def __enter__(self):
+        spool_fd, self.spool_path = tempfile.mkstemp(prefix=".stitch-", suffix=".raw", dir=self.directory)
+        try:
+            with os.fdopen(spool_fd, 'r+b') as spool:
+                spool.truncate(self.width * self.height * 4)
+                self.map = mmap.mmap(spool.fileno(), 0)
+            self.image = Image.frombuffer('RGB', (self.width, self.height), self.map, 'raw', 'RGBX', 0, 1)
+            # The mapping is writable; let Pillow paste into it and encode it without copying
+            self.image.readonly = 0
+            self._fill_white()
+        except BaseException:
+            os.remove(self.spool_path)
+            raise
+        return self
+
+    def _fill_white(self, band_height=256):
+        """Paint the zero-filled mapping white, a band at a time so it never becomes resident at once"""
+        for y in range(0, self.height, band_height):
+            self.image.paste((255, 255, 255), (0, y, self.width, min(self.height, y + band_height)))
+            self.drop_pages()
+
+    def drop_pages(self):
+        _drop_mapped_pages(self.map)
+
+    def save(self, output_path):
+        with open(output_path, 'wb') as out:
+            self.image.save(_PageDroppingWriter(out, self.map), 'JPEG', quality=95)
+
+    def __exit__(self, *exc):
+        self.image = None
+        self.map.close()
+        os.remove(self.spool_path)
+        return False
+
+
+class StreamingStitch:
+    """Decode and place flyer pages on the canvas as their downloads complete.
+
+    Grid positions come from page indexes, so pages can arrive in any order. The cell size
+    is taken from the first page to arrive (Flipp pages share one size); larger pages are
+    shrunk to fit. Decoding runs in a worker pool, so by the time the last download lands
+    the other pages are already on the canvas and only the final encode remains.
+    """
+
+    def __init__(self, stitcher, num_pages, output_path, workers=None, on_placed=None):
+        self.stitcher = stitcher
+        # Called with (pages placed, total pages) from the decode workers
+        self.on_placed = on_placed or (lambda placed, total: None)
+        self.num_pages = num_pages
+        self.output_path = output_path
+        self.rows, self.cols = stitcher.grid_size(num_pages)
+        workers = workers or int(os.getenv('STITCH_DECODE_WORKERS', '4'))
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="stitch-decode")
+        self.lock = threading.Lock()
+        self.futures = []
+        self.canvas = None
+        self.plan = None
+        self.placed = 0
+        self.decode_seconds = 0.0
+        self.started = time.monotonic()
+
+    def _ensure_canvas(self, page_size):
+        """Create the canvas sized from the first page (call with the lock held)"""
+        if self.canvas is None:
+            self.plan = self.stitcher.plan([page_size] * self.num_pages)
+            self.plan["mode"] = "stream"
+            width = self.plan["cell_width"] * self.cols
+            height = self.plan["cell_height"] * self.rows
+            print(f"Creating stitched image: {width}x{height}px for {self.num_pages} pages (streaming)")
+            self.canvas = _MappedCanvas(self.stitcher.output_dir, width, height).__enter__()
+        return self.plan
+
+    def _place(self, index, path):
+        started = time.monotonic()
+        img = Image.open(path)
+        with self.lock:
+            plan = self._ensure_canvas(img.size)
+        cell = (plan["cell_width"], plan["cell_height"])
+        if img.width > cell[0] or img.height > cell[1]:
+            scale = min(cell[0] / img.width, cell[1] / img.height)
+            target = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+            img.draft('RGB', target)
+            with img:
+                img = img.convert('RGB').resize(target)
+        with img:
+            img.load()
+            decoded = time.monotonic()
+            row, col = index // self.cols, index % self.cols
+            x_pos = col * cell[0] + (cell[0] - img.width) // 2
+            y_pos = row * cell[1] + (cell[1] - img.height) // 2
+            with self.lock:
+                self.canvas.image.paste(img, (x_pos, y_pos))
+                self.placed += 1
+                self.decode_seconds += decoded - started
+                self.on_placed(self.placed, self.num_pages)
+        print(f"Placed page {index+1}/{self.num_pages} at position ({row},{col})")
+
+    def add_page(self, index, path):
+        """Queue a downloaded page for decoding; returns immediately"""
+        self.futures.append(self.executor.submit(self._place, index, path))
+
+    def finish(self):
+        """Wait for queued pages, encode the canvas and return the output path (None on failure)"""
+        try:
+            for future in self.futures:
+                future.result()
+            if self.canvas is None:
+                print("No images to stitch!")
+                return None
+            encode_started = time.monotonic()
+            with self.lock:
+                self.canvas.save(self.output_path)
+            self.stitcher.last_stats = dict(
+                self.plan,
+                pages_placed=self.placed,
+                decode_seconds=round(self.decode_seconds, 3),
+                encode_seconds=round(time.monotonic() - encode_started, 3),
+                pipeline_seconds=round(time.monotonic() - self.started, 3),
+            )
+            print(f"Stitched image saved to: {self.output_path}")
+            print(f"Grid layout: {self.rows} rows × {self.cols} columns")
+            return self.output_path
         except Exception as e:
             print(f"Error stitching images: {e}")
             import traceback
             traceback.print_exc()
             return None
+        finally:
+            self.executor.shutdown(wait=True)
+            if self.canvas is not None:
+                self.canvas.__exit__(None, None, None)
+                self.canvas = None
+
+
+def _benchmark_run(mode, count, pages_dir):
+    """Stitch `count` synthetic pages in one mode and print peak RSS (run in a fresh process)"""
+    import contextlib
+    import io
+    import resource
+
+    pages = sorted(os.path.join(pages_dir, name) for name in os.listdir(pages_dir))[:count]
+    with tempfile.TemporaryDirectory() as out_dir:
+        stitcher = ImageStitcher(output_dir=out_dir, mode=mode, max_memory_mb=1_000_000)
+        started = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+            stitcher.stitch_images(pages)
+        elapsed = time.monotonic() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode},{count},{peak_mb:.1f},{elapsed:.2f}")
+
+
+def benchmark(page_counts=(4, 9, 16, 25), page_size=(1600, 2600)):
+    """Compare peak RSS of in-memory and strip stitching against page count"""
+    import random
+    import subprocess
+    import sys
+
+    Image.MAX_IMAGE_PIXELS = None
+    with tempfile.TemporaryDirectory() as pages_dir:
+        print(f"Generating {max(page_counts)} synthetic {page_size[0]}x{page_size[1]} pages...")
+        for i in range(max(page_counts)):
+            page = Image.effect_noise(page_size, 64).convert('RGB')
+            page.paste((random.randrange(256), 120, 80), (100, 100, 800, 600))
+            page.save(os.path.join(pages_dir, f"flyer_page_{i+1:02d}.jpg"), 'JPEG', quality=85)
+
+        print(f"{'mode':<8}{'pages':>6}{'peak RSS MB':>14}{'seconds':>10}")
+        for count in page_counts:
+            for mode in ("memory", "strip"):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--benchmark-run", mode, str(count), pages_dir],
+                    capture_output=True, text=True, check=True,
+                ).stdout.strip().splitlines()[-1]
+                mode_name, pages, peak, seconds = output.split(",")
+                print(f"{mode_name:<8}{pages:>6}{peak:>14}{seconds:>10}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) == 5 and sys.argv[1] == "--benchmark-run":
+        Image.MAX_IMAGE_PIXELS = None
+        _benchmark_run(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+    else:
+        benchmark()
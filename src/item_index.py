@@ -0,0 +1,210 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from flyer_cache import normalize_postal_code
+
+# Query-time category groups on top of the categories the extraction prompt assigns
+CATEGORY_GROUPS = {
+    "protein": ("meat", "seafood"),
+    "proteins": ("meat", "seafood"),
+    "fresh": ("produce", "meat", "seafood", "dairy", "bakery"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS flyers (
+    flyer_id TEXT PRIMARY KEY,
+    valid_to TEXT NOT NULL,
+    indexed_at TEXT NOT NULL,
+    model TEXT,
+    store TEXT
+);
+CREATE TABLE IF NOT EXISTS flyer_regions (
+    flyer_id TEXT NOT NULL REFERENCES flyers(flyer_id) ON DELETE CASCADE,
+    postal_code TEXT NOT NULL,
+    fsa TEXT NOT NULL,
+    PRIMARY KEY (flyer_id, postal_code)
+);
+CREATE INDEX IF NOT EXISTS idx_regions_postal ON flyer_regions(postal_code);
+CREATE INDEX IF NOT EXISTS idx_regions_fsa ON flyer_regions(fsa);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    flyer_id TEXT NOT NULL REFERENCES flyers(flyer_id) ON DELETE CASCADE,
+    page INTEGER,
+    name TEXT NOT NULL,
+    price_text TEXT NOT NULL,
+    price REAL,
+    unit TEXT,
+    category TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_items_flyer_category ON items(flyer_id, category);
+CREATE INDEX IF NOT EXISTS idx_items_category_price ON items(category, price);
+"""
+
+
+def parse_price(price_text):
+    """Numeric unit price and unit from flyer price text: "$1.49/lb" -> (1.49, "lb"), "2 for $5" -> (2.5, "each")"""
+    text = (price_text or "").lower().replace(",", "")
+    multi = re.search(r'(\d+)\s*(?:for|/)\s*\$\s*(\d+(?:\.\d+)?)', text)
+    if multi and int(multi.group(1)) > 0:
+        return round(float(multi.group(2)) / int(multi.group(1)), 2), "each"
+
+    amount = re.search(r'\$\s*(\d+(?:\.\d+)?)', text)
+    if amount:
+        price = float(amount.group(1))
+    else:
+        cents = re.search(r'(\d+)\s*(?:¢|c\b)', text)
+        if not cents:
+            return None, None
+        price = int(cents.group(1)) / 100.0
+
+    unit = re.search(r'(?:/|per\s+)\s*(lb|kg|100\s*g|g|ea|each|pkg|dozen)\b', text)
+    if unit:
+        unit_name = unit.group(1).replace(" ", "")
+        return price, "each" if unit_name == "ea" else unit_name
+    return price, "each"
+
+
+class SaleItemIndex:
+    """Persistent SQLite index of sale items extracted from flyers, queryable by flyer, region and category"""
+
+    def __init__(self, path="data/sale_items.db", retention_days=28):
+        self.path = path
+        # Flyers whose week ended longer ago than this are deleted (checked at most daily, when indexing)
+        self.retention_days = retention_days
+        self.next_purge_at = datetime.now()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        # Indexes created before multi-store support have no store column
+        columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(flyers)")]
+        if "store" not in columns:
+            self.conn.execute("ALTER TABLE flyers ADD COLUMN store TEXT")
+        self.conn.commit()
+
+    def index_flyer(self, flyer_id, items, valid_to, postal_code=None, model=None, store=None):
+        """Replace the indexed items of a (store's) flyer with freshly extracted ones"""
+        rows = []
+        for item in items:
+            price, unit = parse_price(item.get("price"))
+            rows.append((
+                flyer_id,
+                item.get("page"),
+                item["name"],
+                item.get("price") or "",
+                price,
+                item.get("unit") or unit,
+                (item.get("category") or "other").lower(),
+            ))
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM items WHERE flyer_id = ?", (flyer_id,))
+            self.conn.execute(
+                "INSERT INTO flyers (flyer_id, valid_to, indexed_at, model, store) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(flyer_id) DO UPDATE SET valid_to = excluded.valid_to, "
+                "indexed_at = excluded.indexed_at, model = excluded.model, store = excluded.store",
+                (flyer_id, valid_to, datetime.now().isoformat(), model, store),
+            )
+            self.conn.executemany(
+                "INSERT INTO items (flyer_id, page, name, price_text, price, unit, category) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        print(f"Indexed {len(rows)} sale items for flyer {flyer_id}")
+        if postal_code:
+            self.link_region(flyer_id, postal_code)
+        if self.retention_days and datetime.now() >= self.next_purge_at:
+            self.next_purge_at = datetime.now() + timedelta(days=1)
+            purged = self.purge_before((datetime.now() - timedelta(days=self.retention_days)).isoformat())
+            if purged:
+                print(f"Purged {purged} flyer(s) older than {self.retention_days:g} days from the item index")
+
+    def link_region(self, flyer_id, postal_code):
+        """Record that a postal code is served by an indexed flyer"""
+        postal_code = normalize_postal_code(postal_code)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO flyer_regions (flyer_id, postal_code, fsa) "
+                "SELECT flyer_id, ?, ? FROM flyers WHERE flyer_id = ?",
+                (postal_code, postal_code[:3], flyer_id),
+            )
+
+    def items_for_flyer(self, flyer_id):
+        """All indexed items of a flyer in page order, in the shape the recommender expects"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT page, name, price_text, unit, category FROM items WHERE flyer_id = ? ORDER BY page, id",
+                (flyer_id,),
+            ).fetchall()
+        return [{"name": r["name"], "price": r["price_text"], "unit": r["unit"] or "",
+                 "category": r["category"], "page": r["page"]} for r in rows]
+
+    def search(self, postal_code=None, flyer_id=None, category=None, max_price=None, query=None,
+               current_only=True, limit=200, store=None):
+        """Find items with no model call, e.g. search("M5V 2T6", category="protein", max_price=5).
+
+        A full postal code also matches flyers indexed for its FSA (first three characters).
+        """
+        clauses = []
+        params = []
+        if flyer_id:
+            clauses.append("i.flyer_id = ?")
+            params.append(flyer_id)
+        if store:
+            clauses.append("f.store = ?")
+            params.append(store)
+        if postal_code:
+            postal_code = normalize_postal_code(postal_code)
+            clauses.append("i.flyer_id IN (SELECT flyer_id FROM flyer_regions WHERE postal_code = ? OR fsa = ?)")
+            params.extend([postal_code, postal_code[:3]])
+        if category:
+            categories = CATEGORY_GROUPS.get(category.lower(), (category.lower(),))
+            clauses.append(f"i.category IN ({', '.join('?' * len(categories))})")
+            params.extend(categories)
+        if max_price is not None:
+            clauses.append("i.price IS NOT NULL AND i.price <= ?")
+            params.append(float(max_price))
+        if query:
+            clauses.append("i.name LIKE ?")
+            params.append(f"%{query}%")
+        if current_only:
+            clauses.append("f.valid_to >= ?")
+            params.append(datetime.now().isoformat())
+
+        sql = ("SELECT i.flyer_id, f.store, f.valid_to, i.page, i.name, i.price_text, i.price, i.unit, i.category "
+               "FROM items i JOIN flyers f ON f.flyer_id = i.flyer_id")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY i.price IS NULL, i.price, i.name LIMIT ?"
+        params.append(int(limit))
+
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(sql, params).fetchall()]
+
+    def purge_before(self, cutoff):
+        """Delete flyers (and their items) whose week ended before `cutoff` (ISO timestamp)"""
+        with self.lock, self.conn:
+            return self.conn.execute("DELETE FROM flyers WHERE valid_to < ?", (cutoff,)).rowcount
+
+    def stats(self):
+        """Indexed flyer, region and item counts"""
+        with self.lock:
+            now = datetime.now().isoformat()
+            return {
+                "flyers": self.conn.execute("SELECT COUNT(*) FROM flyers").fetchone()[0],
+                "current_flyers": self.conn.execute("SELECT COUNT(*) FROM flyers WHERE valid_to >= ?", (now,)).fetchone()[0],
+                "postal_codes": self.conn.execute("SELECT COUNT(DISTINCT postal_code) FROM flyer_regions").fetchone()[0],
+                "items": self.conn.execute("SELECT COUNT(*) FROM items").fetchone()[0],
+                "categories": {row[0]: row[1] for row in self.conn.execute(
+                    "SELECT category, COUNT(*) FROM items GROUP BY category ORDER BY category")},
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import time
+
+
+class JobEvents:
+    """Per-job event log (one channel per job ID) with live asyncio subscribers, published to from worker threads.
+
+    Subscribers get the job's events so far followed by new ones as they happen,
+    so a client connecting mid-job (or reconnecting) misses nothing.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.history = {}
+        self.subscribers = {}
+
+    def publish(self, channel, event_type, record=True, **data):
+        """Record an event and hand it to every subscriber's event loop.
+
+        With record=False the event only goes to current subscribers (for channels with no replay).
+        """
+        with self.lock:
+            events = self.history.setdefault(channel, []) if record else []
+            event = dict(data, type=event_type, seq=len(events), time=time.time())
+            if record:
+                events.append(event)
+            for loop, queue in self.subscribers.get(channel, []):
+                try:
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+                except RuntimeError:
+                    # The subscriber's loop has shut down
+                    pass
+        return event
+
+    def subscribe(self, channel, loop):
+        """Return (queue, backlog): events so far, and a queue receiving later ones on `loop`"""
+        queue = asyncio.Queue()
+        with self.lock:
+            backlog = list(self.history.get(channel, []))
+            self.subscribers.setdefault(channel, []).append((loop, queue))
+        return queue, backlog
+
+    def unsubscribe(self, channel, queue):
+        with self.lock:
+            remaining = [(loop, q) for loop, q in self.subscribers.get(channel, []) if q is not queue]
+            if remaining:
+                self.subscribers[channel] = remaining
+            else:
+                self.subscribers.pop(channel, None)
+
+    def discard(self, channel):
+        """Forget a channel's events (when its job is evicted)"""
+        with self.lock:
+            self.history.pop(channel, None)
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(queues) for queues in self.subscribers.values())
@@ -0,0 +1,172 @@
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from job_events import JobEvents
+
+
+# Event channel carrying every job's lifecycle changes, for pages watching for new jobs
+ALL_JOBS = "*"
+
+
+class JobManager:
+    """Run recommendation jobs on a bounded worker pool, tracking state per job"""
+
+    def __init__(self, max_workers=2, max_retained_jobs=50, data_dir="data", output_dir="output"):
+        self.max_workers = max(1, int(max_workers))
+        self.max_retained_jobs = max(1, int(max_retained_jobs))
+        self.data_dir = data_dir
+        self.output_dir = output_dir
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job-worker")
+        self.jobs = OrderedDict()
+        self.events = JobEvents()
+        self.lock = threading.Lock()
+
+    def submit(self, task, request):
+        """Create a job for the request and queue `task(job, request)` on the worker pool"""
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "status_message": "Waiting for a free worker...",
+            "recommendations": None,
+            "flyer_image": None,
+            "timestamp": None,
+            "error": None,
+            "metrics": {},
+            "stage": "queued",
+            "progress": None,
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "data_dir": os.path.join(self.data_dir, "jobs", job_id),
+            "output_dir": os.path.join(self.output_dir, "jobs", job_id),
+        }
+
+        with self.lock:
+            self.jobs[job_id] = job
+            self._evict_finished_jobs()
+
+        self.publish_status(job)
+        self.executor.submit(self._run_job, task, job, request)
+        return job
+
+    def status_event(self, job):
+        """Stage and progress fields pushed to clients on every change"""
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "stage": job["stage"],
+            "status_message": job["status_message"],
+            "progress": job["progress"],
+            "queue_position": self.queue_position(job["id"]) if job["status"] == "queued" else 0,
+        }
+
+    def publish_status(self, job, broadcast=True):
+        """Push the job's current status to its subscribers (and, with broadcast, to pages watching all jobs)"""
+        event = self.status_event(job)
+        self.events.publish(job["id"], "status", **event)
+        # Internal jobs (flyer pre-warming) must not show up on pages watching for new jobs
+        if broadcast and not job.get("internal"):
+            self.events.publish(ALL_JOBS, "status", record=False, **event)
+
+    def update(self, job, stage, message, done=None, total=None):
+        """Move a running job to a new stage (or report progress within one) and push the change"""
+        # Pages watching all jobs only hear about stage transitions, not every progress tick
+        stage_changed = job["stage"] != stage
+        job["stage"] = stage
+        job["status_message"] = message
+        job["progress"] = {"done": done, "total": total} if total else None
+        self.publish_status(job, broadcast=stage_changed)
+
+    def _run_job(self, task, job, request):
+        """Worker entry point: run the task and make sure the job ends in a final state"""
+        job["status"] = "processing"
+        job["started_at"] = datetime.now().isoformat()
+        self.update(job, "starting", "Initializing...")
+        # Everyone still waiting moved up one place
+        with self.lock:
+            queued = [other for other in self.jobs.values() if other["status"] == "queued"]
+        for other in queued:
+            self.publish_status(other)
+        try:
+            os.makedirs(job["data_dir"], exist_ok=True)
+            os.makedirs(job["output_dir"], exist_ok=True)
+            task(job, request)
+        except Exception as e:
+            print(f"Job {job['id']} crashed: {e}")
+            job["status"] = "error"
+            job["status_message"] = f"Error: {str(e)}"
+            job["error"] = str(e)
+        finally:
+            if job["status"] == "processing":
+                job["status"] = "error"
+                job["status_message"] = "Job ended without a result"
+                job["error"] = job["status_message"]
+            job["finished_at"] = datetime.now().isoformat()
+            job["stage"] = job["status"]
+            job["progress"] = None
+            self.publish_status(job)
+            # Final event: streams for this job can close
+            self.events.publish(job["id"], "end", status=job["status"], error=job["error"])
+
+    def _evict_finished_jobs(self):
+        """Drop the oldest finished jobs (and their artifacts) beyond the retention limit"""
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] in ("completed", "error")]
+        excess = len(self.jobs) - self.max_retained_jobs
+        for job_id in finished[:max(0, excess)]:
+            job = self.jobs.pop(job_id)
+            self.events.discard(job_id)
+            for path in (job["data_dir"], job["output_dir"]):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def get(self, job_id):
+        """Return the job dict for an ID, or None if unknown"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def latest(self, status=None):
+        """Return the most recently created job, optionally restricted to one status"""
+        with self.lock:
+            for job in reversed(self.jobs.values()):
+                if status is None or job["status"] == status:
+                    return job
+        return None
+
+    def active_jobs(self):
+        """Jobs that are queued or running, oldest first"""
+        with self.lock:
+            return [job for job in self.jobs.values() if job["status"] in ("queued", "processing")]
+
+    def queue_position(self, job_id):
+        """Number of queued jobs submitted ahead of the given one"""
+        with self.lock:
+            position = 0
+            for other_id, job in self.jobs.items():
+                if other_id == job_id:
+                    return position
+                if job["status"] == "queued":
+                    position += 1
+        return None
+
+    def stats(self):
+        """Summary of job counts by status and worker configuration"""
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {
+            "max_workers": self.max_workers,
+            "running": counts.get("processing", 0),
+            "queued": counts.get("queued", 0),
+            "jobs_by_status": counts,
+            "event_subscribers": self.events.subscriber_count(),
+        }
+
+    def shutdown(self, wait=False):
+        """Stop accepting jobs and release the worker pool"""
+        self.executor.shutdown(wait=wait, cancel_futures=True)
@@ -3,6 +3,7 @@ import os
 import sys
 from dotenv import load_dotenv
 from store_selector import FlippStoreSelector
+from flipp_session import FlippSessionStore
 from flyer_downloader import FlyerDownloader
 from gemini_recommender import GeminiRecommender
 from discord_notifier import DiscordNotifier
@@ -37,7 +38,11 @@ def main():
     try:
         # Step 1: Setup browser and set postal code
         print("STEP 1: Setting up browser and setting postal code...")
-        selector = FlippStoreSelector(headless=HEADLESS)
+        session_store = FlippSessionStore(
+            directory=os.getenv('FLIPP_SESSION_DIR', os.path.join('data', 'flipp_sessions')),
+            max_age_seconds=float(os.getenv('FLIPP_SESSION_MAX_AGE_HOURS', '72')) * 3600,
+        )
+        selector = FlippStoreSelector(headless=HEADLESS, session_store=session_store)
         selector.setup_driver()
         
         if not selector.select_store(postal_code=POSTAL_CODE):
@@ -76,7 +81,8 @@ def main():
             flyer_image_path=stitched_image,
             num_people=NUM_PEOPLE,
             num_meals=NUM_MEALS,
-            cuisine_preference=CUISINE
+            cuisine_preference=CUISINE,
+            page_files=flyer_files
         )
         
         if not recommendations:
@@ -0,0 +1,212 @@
+import json
+import time
+
+# Installed into every new document: tracks when the DOM last changed
+MUTATION_TRACKER_JS = """
+(function () {
+    if (window.__flyerReadiness) return;
+    var state = window.__flyerReadiness = {lastMutation: Date.now(), mutations: 0};
+    var start = function () {
+        new MutationObserver(function () {
+            state.lastMutation = Date.now();
+            state.mutations++;
+        }).observe(document, {childList: true, subtree: true, attributes: true, attributeFilter: ['src', 'srcset']});
+    };
+    if (document) start();
+})();
+"""
+
+# Page-side snapshot polled by PageReadiness (installs the tracker if the page predates it)
+READINESS_PROBE_JS = MUTATION_TRACKER_JS + """
+var imgs = document.querySelectorAll('img');
+var present = 0, loaded = 0;
+for (var i = 0; i < imgs.length; i++) {
+    if (imgs[i].src && imgs[i].src.indexOf('extra_large') !== -1) {
+        present++;
+        if (imgs[i].complete && imgs[i].naturalWidth > 0) loaded++;
+    }
+}
+return {
+    ready_state: document.readyState,
+    images: present,
+    loaded_images: loaded,
+    dom_quiet_ms: Date.now() - window.__flyerReadiness.lastMutation
+};
+"""
+
+
+def enable_readiness_tracking(driver, response_buffer_mb=256):
+    """Have Chromium install the mutation tracker in every document before page scripts run,
+    and keep enough response bodies buffered for flyer pages to be read back over CDP"""
+    try:
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': MUTATION_TRACKER_JS})
+    except Exception as e:
+        # Not fatal: the probe installs the tracker on first use instead
+        print(f"Warning: could not register readiness tracker: {e}")
+    try:
+        driver.execute_cdp_cmd('Network.enable', {
+            'maxTotalBufferSize': response_buffer_mb * 1024 * 1024,
+            'maxResourceBufferSize': 32 * 1024 * 1024,
+        })
+    except Exception as e:
+        print(f"Warning: could not enlarge the network buffer: {e}")
+
+
+class NetworkMonitor:
+    """Follow a Chromium browser's requests through the CDP events in its performance log.
+
+    Needs the driver to be created with goog:loggingPrefs {"performance": "ALL"}; otherwise
+    `available` is False and readiness falls back to DOM and image checks only.
+    """
+
+    def __init__(self, driver, stale_after=10.0, keep_buffered=False):
+        self.driver = driver
+        self.stale_after = stale_after
+        self.inflight = {}
+        self.responses = {}
+        self.last_activity = time.monotonic()
+        self.available = True
+        self.requests = 0
+        self.bytes_received = 0
+        self.blocked = 0
+        # While set, only events of this document loader are taken (see keep_buffered)
+        self._loader_id = None
+        self._foreign_requests = set()
+        if keep_buffered:
+            # Keep the current page's buffered events (e.g. one a restored session opened), but not
+            # those of earlier pages or of a previous lease of this pooled browser
+            self._loader_id = self._current_loader_id()
+            if self._loader_id:
+                self.poll()
+            else:
+                self.reset()
+            self._loader_id = None
+        else:
+            self.reset()
+
+    def _current_loader_id(self):
+        """Loader ID of the main frame's current document, or None if CDP cannot tell"""
+        try:
+            return self.driver.execute_cdp_cmd('Page.getFrameTree', {})['frameTree']['frame']['loaderId']
+        except Exception:
+            return None
+
+    def reset(self):
+        """Drop events buffered so far (e.g. from the previous page) and forget their requests"""
+        self.poll()
+        self.inflight.clear()
+        self.responses.clear()
+        self.last_activity = time.monotonic()
+        self.requests = self.bytes_received = self.blocked = 0
+
+    def poll(self):
+        """Consume new performance-log events and update in-flight request state"""
+        if not self.available:
+            return
+        try:
+            entries = self.driver.get_log('performance')
+        except Exception:
+            self.available = False
+            return
+
+        now = time.monotonic()
+        for entry in entries:
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+            method = message.get('method', '')
+            params = message.get('params', {})
+            request_id = params.get('requestId')
+            if self._loader_id and params.get('loaderId') not in (None, self._loader_id):
+                self._foreign_requests.add(request_id)
+                continue
+            if request_id in self._foreign_requests:
+                continue
+            if method == 'Network.requestWillBeSent':
+                self.requests += 1
+                if params.get('type') not in ('WebSocket', 'EventSource'):
+                    self.inflight[request_id] = now
+            elif method == 'Network.responseReceived':
+                response = params.get('response', {})
+                self.responses[response.get('url', '')] = {
+                    "request_id": request_id,
+                    "status": response.get('status'),
+                    "mime_type": response.get('mimeType'),
+                    "finished": False,
+                }
+            elif method in ('Network.loadingFinished', 'Network.loadingFailed'):
+                self.inflight.pop(request_id, None)
+                self.bytes_received += int(params.get('encodedDataLength') or 0)
+                if params.get('blockedReason'):
+                    self.blocked += 1
+                for response in self.responses.values():
+                    if response["request_id"] == request_id:
+                        response["finished"] = method == 'Network.loadingFinished'
+            else:
+                continue
+            self.last_activity = now
+
+        # Long polls and beacons that never finish should not block readiness forever
+        for request_id, started in list(self.inflight.items()):
+            if now - started > self.stale_after:
+                del self.inflight[request_id]
+
+    def idle_for(self, max_inflight=0):
+        """Seconds the network has had at most `max_inflight` requests open (0.0 if busy now)"""
+        self.poll()
+        if len(self.inflight) > max_inflight:
+            return 0.0
+        return time.monotonic() - self.last_activity
+
+
+class PageReadiness:
+    """Wait for a page to settle: network idle, DOM quiet and enough extra_large flyer images present"""
+
+    def __init__(self, driver, monitor=None, poll_interval=0.1):
+        self.driver = driver
+        self.monitor = monitor
+        self.poll_interval = poll_interval
+
+    def probe(self):
+        return self.driver.execute_script(READINESS_PROBE_JS) or {}
+
+    def wait(self, deadline=15.0, min_images=1, expected_images=None, idle_seconds=0.5, max_inflight=2):
+        """Block until the page is ready or `deadline` seconds pass; returns stats with `ready` and `reason`.
+
+        Ready means at least `min_images` flyer images, the network idle (at most `max_inflight`
+        open requests) and no DOM mutations for `idle_seconds`. Once `expected_images` are
+        present and the network is idle the DOM check is skipped.
+        """
+        started = time.monotonic()
+        state = {}
+        network_idle = None
+        while True:
+            try:
+                state = self.probe()
+            except Exception as e:
+                state = {"error": str(e)}
+            network_idle = self.monitor.idle_for(max_inflight) if self.monitor and self.monitor.available else None
+            network_ok = network_idle is None or network_idle >= idle_seconds
+            images = state.get("images", 0)
+            dom_quiet = state.get("dom_quiet_ms", 0) / 1000.0
+
+            reason = None
+            if state.get("ready_state") == "complete" and network_ok:
+                if expected_images and images >= expected_images:
+                    reason = "expected images present"
+                elif images >= min_images and dom_quiet >= idle_seconds:
+                    reason = "network idle and DOM quiet"
+            elapsed = time.monotonic() - started
+            if reason is None and elapsed >= deadline:
+                reason = "deadline"
+            if reason:
+                return {
+                    "ready": reason != "deadline",
+                    "reason": reason,
+                    "seconds": round(elapsed, 3),
+                    "images": images,
+                    "loaded_images": state.get("loaded_images", 0),
+                    "inflight_requests": len(self.monitor.inflight) if self.monitor else None,
+                }
+            time.sleep(self.poll_interval)
@@ -0,0 +1,188 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flyer_cache import normalize_postal_code
+from store_registry import DEFAULT_STORE, normalize_store_key
+
+
+class PrewarmScheduler:
+    """Refresh flyer snapshots for configured postal codes and stores when a new flyer week starts.
+
+    Each (postal code, store) entry is refreshed at the week rollover plus a random jitter, on a
+    small worker pool. Failures are retried with exponential backoff; so is a refresh that still
+    returns last week's flyer (Flipp had not rolled over yet). After `max_retries` the entry
+    waits for the next rollover.
+
+    `refresh(postal_code, force, store=)` fetches and caches the store's flyer (force skips the
+    cache) and returns its snapshot; `lookup(postal_code, store=)` returns the cached snapshot or None;
+    `next_rollover(now)` returns when the next flyer week starts.
+    """
+
+    def __init__(self, postal_codes, refresh, lookup, next_rollover, stores=(DEFAULT_STORE,), concurrency=1,
+                 jitter_seconds=1800, max_retries=5, retry_base_seconds=300, retry_max_seconds=7200):
+        self.refresh = refresh
+        self.lookup = lookup
+        self.next_rollover = next_rollover
+        self.concurrency = max(1, int(concurrency))
+        self.jitter_seconds = jitter_seconds
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.cond = threading.Condition()
+        self.executor = None
+        self.thread = None
+        self.stopping = False
+        self.entries = {}
+        stores = [normalize_store_key(store) for store in stores] or [DEFAULT_STORE]
+        for postal_code in postal_codes:
+            postal_code = normalize_postal_code(postal_code)
+            for store in stores:
+                if not postal_code or (postal_code, store) in self.entries:
+                    continue
+                self.entries[(postal_code, store)] = {
+                    "postal_code": postal_code,
+                    "store": store,
+                    "next_run_at": None,
+                    "running": False,
+                    "attempts": 0,
+                    "last_refreshed_at": None,
+                    "last_result": None,
+                    "last_error": None,
+                    "last_seconds": None,
+                    "flyer_id": None,
+                    "valid_to": None,
+                    # Expired flyer this run must replace; Flipp may keep serving it for a while after rollover
+                    "previous_flyer_id": None,
+                }
+
+    def _jitter(self, seconds):
+        return timedelta(seconds=random.uniform(0, seconds))
+
+    def _schedule_next_week(self, entry, now):
+        entry["attempts"] = 0
+        entry["next_run_at"] = self.next_rollover(now) + self._jitter(self.jitter_seconds)
+
+    def _schedule_retry(self, entry, now):
+        """Back off exponentially; after max_retries give up until the next rollover"""
+        entry["attempts"] += 1
+        if entry["attempts"] > self.max_retries:
+            print(f"Pre-warm of {entry['store']} for {entry['postal_code']} gave up after {self.max_retries} retries")
+            self._schedule_next_week(entry, now)
+            return
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * (2 ** (entry["attempts"] - 1)))
+        entry["next_run_at"] = now + timedelta(seconds=random.uniform(0.5, 1.0) * delay)
+
+    def _run(self, entry):
+        postal_code, store = entry["postal_code"], entry["store"]
+        # A retry that got last week's flyer must bypass the cache to see the new one
+        force = entry["last_result"] == "unchanged"
+        started = time.monotonic()
+        try:
+            print(f"Pre-warming {store} flyer for {postal_code}...")
+            snapshot = self.refresh(postal_code, force, store=store)
+            error = None if snapshot else "no flyer found"
+        except Exception as e:
+            snapshot, error = None, str(e)
+
+        now = datetime.now()
+        with self.cond:
+            entry["running"] = False
+            entry["last_seconds"] = round(time.monotonic() - started, 3)
+            entry["last_error"] = error
+            if error:
+                print(f"Pre-warm of {store} for {postal_code} failed: {error}")
+                entry["last_result"] = "error"
+                self._schedule_retry(entry, now)
+            elif snapshot["flyer_id"] == entry["previous_flyer_id"]:
+                print(f"{store} flyer for {postal_code} has not rolled over yet; retrying later")
+                entry["last_result"] = "unchanged"
+                self._schedule_retry(entry, now)
+            else:
+                print(f"✓ Pre-warmed {store} flyer {snapshot['flyer_id']} for {postal_code} in {entry['last_seconds']:.1f}s")
+                entry.update(last_result="refreshed", last_refreshed_at=now.isoformat(),
+                             flyer_id=snapshot["flyer_id"], valid_to=snapshot["valid_to"])
+                self._schedule_next_week(entry, now)
+            self.cond.notify_all()
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                if self.stopping:
+                    return
+                now = datetime.now()
+                due = [e for e in self.entries.values() if not e["running"] and e["next_run_at"] <= now]
+                for entry in due:
+                    entry["running"] = True
+                    expired = entry["valid_to"] and datetime.fromisoformat(entry["valid_to"]) < now
+                    entry["previous_flyer_id"] = entry["flyer_id"] if expired else None
+                    self.executor.submit(self._run, entry)
+                if not due:
+                    upcoming = [e["next_run_at"] for e in self.entries.values() if not e["running"]]
+                    timeout = (min(upcoming) - now).total_seconds() if upcoming else None
+                    # Wake at least hourly so clock changes and suspends are noticed
+                    self.cond.wait(timeout=min(max(timeout, 0.1), 3600) if timeout is not None else 3600)
+
+    def start(self, startup_jitter_seconds=60):
+        """Refresh postal codes without a valid snapshot soon, the rest at the next rollover"""
+        if not self.entries or self.thread:
+            return
+        now = datetime.now()
+        for entry in self.entries.values():
+            snapshot = self.lookup(entry["postal_code"], store=entry["store"])
+            if snapshot:
+                entry.update(flyer_id=snapshot["flyer_id"], valid_to=snapshot["valid_to"],
+                             last_refreshed_at=snapshot["created_at"], last_result="cached")
+                self._schedule_next_week(entry, now)
+            else:
+                entry["next_run_at"] = now + self._jitter(startup_jitter_seconds)
+        self.stopping = False
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="prewarm")
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="prewarm-scheduler")
+        self.thread.start()
+        print(f"Pre-warm scheduler started for {len(self.entries)} postal code/store pair(s)")
+
+    def trigger(self, postal_code=None, store=None):
+        """Refresh configured entries now, optionally only one postal code and/or store.
+
+        Returns the entries queued as {"postal_code", "store"} dicts.
+        """
+        now = datetime.now()
+        postal_code = normalize_postal_code(postal_code) if postal_code else None
+        store = normalize_store_key(store) if store else None
+        with self.cond:
+            queued = []
+            for (code, entry_store), entry in self.entries.items():
+                if postal_code and code != postal_code or store and entry_store != store:
+                    continue
+                if not entry["running"]:
+                    entry["next_run_at"] = now
+                    queued.append({"postal_code": code, "store": entry_store})
+            self.cond.notify_all()
+        return queued
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        self.thread = None
+
+    def schedule(self):
+        """Every pre-warm entry with its next run and last refresh"""
+        with self.cond:
+            entries = []
+            for entry in self.entries.values():
+                view = {k: v for k, v in entry.items() if k != "previous_flyer_id"}
+                view["next_run_at"] = entry["next_run_at"].isoformat() if entry["next_run_at"] else None
+                entries.append(view)
+        return {
+            "enabled": bool(self.entries),
+            "concurrency": self.concurrency,
+            "jitter_seconds": self.jitter_seconds,
+            "next_rollover": self.next_rollover(datetime.now()).isoformat(),
+            "entries": entries,
+        }
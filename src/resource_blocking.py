@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+from fnmatch import fnmatch
+
+
+def _extension_patterns(*extensions):
+    """Chromium wildcards for URLs ending in an extension, with or without a query string"""
+    return [pattern for ext in extensions for pattern in (f"*.{ext}", f"*.{ext}?*")]
+
+
+# File-extension URL patterns (Chromium wildcards). Network.setBlockedURLs only matches URLs, so
+# these are not resource types: extensionless CDN URLs are not caught. Flyer pages are .jpg and
+# are never in these groups.
+URL_EXTENSION_GROUPS = {
+    "font_files": _extension_patterns("woff", "woff2", "ttf", "otf") + ["*fonts.googleapis.com*", "*fonts.gstatic.com*"],
+    "media_files": _extension_patterns("mp4", "webm", "m3u8", "mp3", "ogg"),
+    "image_files": _extension_patterns("png", "gif", "svg", "webp", "ico"),
+}
+
+# Ads, analytics and third-party trackers seen on flipp.com
+TRACKER_PATTERNS = [
+    "*google-analytics.com*", "*googletagmanager.com*", "*googlesyndication.com*", "*doubleclick.net*",
+    "*adservice.google.*", "*amazon-adsystem.com*", "*facebook.net*", "*facebook.com/tr*",
+    "*hotjar.com*", "*segment.io*", "*segment.com*", "*nr-data.net*", "*newrelic.com*",
+    "*scorecardresearch.com*", "*criteo.*", "*taboola.com*", "*outbrain.com*", "*bing.com/bat*",
+    "*tiktok.com/i18n/pixel*", "*snapchat.com*", "*pinimg.com/ct*", "*branch.io*", "*braze.com*",
+]
+
+BLOCKING_PROFILES = {
+    "off": {"url_groups": [], "trackers": False},
+    "trackers": {"url_groups": [], "trackers": True},
+    "lean": {"url_groups": ["font_files", "media_files", "image_files"], "trackers": True},
+}
+
+# Requests the scraper depends on; a deny pattern matching any of these is never applied
+REQUIRED_URLS = [
+    "https://flipp.com/",
+    "https://flipp.com/search/No%20Frills",
+    "https://f.wishabi.net/page_items/123456/1/extra_large.jpg",
+]
+
+
+def _split_patterns(value):
+    return [pattern.strip() for pattern in (value or "").split(",") if pattern.strip()]
+
+
+def blocked_url_patterns(profile="off", deny=(), allow=()):
+    """Deny patterns for a profile plus extra `deny` patterns, minus any an `allow` pattern covers"""
+    if profile not in BLOCKING_PROFILES:
+        print(f"Warning: unknown blocking profile {profile!r}; using 'off'")
+        profile = "off"
+    settings = BLOCKING_PROFILES[profile]
+    patterns = [p for group in settings["url_groups"] for p in URL_EXTENSION_GROUPS[group]]
+    if settings["trackers"]:
+        patterns += TRACKER_PATTERNS
+    patterns += list(deny)
+
+    kept = []
+    for pattern in patterns:
+        if pattern in kept or any(fnmatch(pattern, a) for a in allow):
+            continue
+        if any(fnmatch(url, pattern) for url in REQUIRED_URLS):
+            print(f"Warning: not blocking {pattern!r}; it would block pages the scraper needs")
+            continue
+        kept.append(pattern)
+    return kept
+
+
+def blocking_patterns_from_env(profile=None):
+    """Blocked URL patterns configured by BROWSER_BLOCK_PROFILE, BROWSER_BLOCK_DENY and BROWSER_BLOCK_ALLOW"""
+    return blocked_url_patterns(
+        profile or os.getenv('BROWSER_BLOCK_PROFILE', 'off').lower(),
+        deny=_split_patterns(os.getenv('BROWSER_BLOCK_DENY')),
+        allow=_split_patterns(os.getenv('BROWSER_BLOCK_ALLOW')),
+    )
+
+
+def apply_blocking(driver, patterns):
+    """Make Chromium fail requests matching the patterns before they are sent.
+
+    Expects the Network domain to be enabled already (enable_readiness_tracking does so with its
+    buffer sizes); enabling it again here would reset those sizes to Chromium's defaults.
+    """
+    try:
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(patterns)})
+        return True
+    except Exception as e:
+        print(f"Warning: could not apply request blocking: {e}")
+        return False
+
+
+def benchmark(runs=3, profiles=("off", "trackers", "lean"), headless=True):
+    """Load Flipp's start and flyer pages in fresh browsers with each blocking profile and compare
+    load time, bytes transferred and renderer RSS (`None` means the configured profile)"""
+    from browser_memory import chromium_memory
+    from page_readiness import NetworkMonitor, PageReadiness
+    from store_selector import FLIPP_HOME_URL, FLYER_SEARCH_URL, FlippStoreSelector
+
+    results = {}
+    for profile in profiles:
+        profile = profile or os.getenv('BROWSER_BLOCK_PROFILE', 'off').lower()
+        samples = []
+        for run in range(runs):
+            selector = FlippStoreSelector(headless=headless, blocking_profile=profile)
+            try:
+                selector.setup_driver()
+                monitor = NetworkMonitor(selector.driver)
+                readiness = PageReadiness(selector.driver, monitor)
+                started = time.monotonic()
+                selector.driver.get(FLIPP_HOME_URL)
+                readiness.wait(deadline=20, min_images=0)
+                selector.driver.get(FLYER_SEARCH_URL)
+                readiness.wait(deadline=20)
+                monitor.poll()
+                memory = chromium_memory(selector.driver) or {}
+                samples.append({
+                    "seconds": time.monotonic() - started,
+                    "mb": monitor.bytes_received / 1024 / 1024,
+                    "requests": monitor.requests,
+                    "blocked": monitor.blocked,
+                    "renderer_rss_mb": memory.get("renderer_rss_mb", 0.0),
+                })
+            finally:
+                selector.close()
+        samples.sort(key=lambda sample: sample["seconds"])
+        median = samples[len(samples) // 2]
+        results[profile] = median
+        print(f"{profile:>8}: {median['seconds']:.2f}s, {median['mb']:.1f} MB over {median['requests']} requests "
+              f"({median['blocked']} blocked), renderer RSS {median['renderer_rss_mb']:.0f} MB (median of {runs})")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark(runs=int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_text(value):
+    """Case- and whitespace-insensitive form of a free-text request parameter"""
+    return " ".join(str(value or "").split()).casefold()
+
+
+class ResultCache:
+    """Size-bounded LRU cache of model results with a TTL, persisted to a JSON file"""
+
+    def __init__(self, path, max_entries=200, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    @staticmethod
+    def make_key(*parts):
+        """Hash the given key parts (digests, normalized parameters) into one cache key"""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Warning: cache file {self.path} unreadable, starting empty: {e}")
+            return
+
+        now = time.time()
+        for key, entry in stored.get("entries", []):
+            if now - entry["created_at"] <= self.ttl_seconds:
+                self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _save(self):
+        """Write entries in LRU order, atomically (call with the lock held)"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"entries": list(self.entries.items())}, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        """Return the cached value for key, or None when missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry["created_at"] > self.ttl_seconds:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key, value):
+        """Store a JSON-serializable value, evicting the least recently used entries beyond the limit"""
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        """Store several (key, value) pairs with a single write of the cache file"""
+        if not items:
+            return
+        with self.lock:
+            now = time.time()
+            for key, value in items:
+                self.entries[key] = {"value": value, "created_at": now}
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            try:
+                self._save()
+            except Exception as e:
+                print(f"Warning: failed to persist cache {self.path}: {e}")
+
+    def stats(self):
+        """Entry count and hit/miss counters"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
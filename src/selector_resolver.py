@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
+
+
+def locator_key(locator):
+    by, value = locator
+    return f"{by}:{value}"
+
+
+class SelectorResolver:
+    """Find an element from several candidate locators in one wait, racing them all at once.
+
+    The locator that matched last time is checked first and persisted across restarts, and
+    match times (and timeouts) are kept per locator so selector drift shows up in the stats
+    before every candidate stops matching.
+    """
+
+    def __init__(self, path="data/selector_preferences.json", poll_interval=0.1):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.preferred = {}
+        self.timings = {}
+        self.timeouts = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.preferred = json.load(f).get("preferred", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: selector preferences {self.path} unreadable: {e}")
+
+    def _save(self):
+        """Write preferences atomically (call with the lock held)"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"preferred": self.preferred}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _ordered(self, group, candidates, fallbacks):
+        """Last winner first, except that a generic fallback never goes ahead of a specific selector"""
+        preferred = self.preferred.get(group)
+        return sorted(candidates, key=lambda locator: (locator_key(locator) in fallbacks,
+                                                       locator_key(locator) != preferred))
+
+    @staticmethod
+    def _match(driver, locator, clickable):
+        for element in driver.find_elements(*locator):
+            try:
+                if not clickable or (element.is_displayed() and element.is_enabled()):
+                    return element
+            except StaleElementReferenceException:
+                continue
+        return None
+
+    def resolve(self, driver, group, candidates, timeout=10, clickable=False, fallbacks=(), fallback_after=1.0):
+        """Return (element, locator) for the first candidate that matches, polling all of them until `timeout`.
+
+        `candidates` are (By, value) pairs in priority order; `group` names what is being looked
+        for (e.g. "postal_input"). Generic `fallbacks` only count after `fallback_after` seconds
+        (unless one of them won last time), so they cannot beat a specific selector that is
+        still rendering. Raises TimeoutException when none matches in time.
+        """
+        fallback_keys = {locator_key(locator) for locator in fallbacks}
+        candidates = self._ordered(group, candidates, fallback_keys)
+        # A fallback that won last time does not have to wait
+        fallback_keys.discard(self.preferred.get(group))
+        # An implicit wait would stall every find_elements miss; restore it afterwards
+        implicit_wait = driver.timeouts.implicit_wait
+        driver.implicitly_wait(0)
+        started = time.monotonic()
+        try:
+            while True:
+                elapsed = time.monotonic() - started
+                for locator in candidates:
+                    if elapsed < fallback_after and locator_key(locator) in fallback_keys:
+                        continue
+                    try:
+                        element = self._match(driver, locator, clickable)
+                    except WebDriverException:
+                        element = None
+                    if element is not None:
+                        self._record(group, locator, time.monotonic() - started)
+                        return element, locator
+                if time.monotonic() - started >= timeout:
+                    with self.lock:
+                        self.timeouts[group] = self.timeouts.get(group, 0) + 1
+                    raise TimeoutException(f"No {group} element matched any of {len(candidates)} selectors in {timeout}s")
+                time.sleep(self.poll_interval)
+        finally:
+            driver.implicitly_wait(implicit_wait)
+
+    def _record(self, group, locator, seconds):
+        key = locator_key(locator)
+        with self.lock:
+            self.timings.setdefault(group, {}).setdefault(key, deque(maxlen=200)).append(seconds)
+            if self.preferred.get(group) != key:
+                if group in self.preferred:
+                    print(f"Selector for {group} changed: {self.preferred[group]} -> {key}")
+                self.preferred[group] = key
+                try:
+                    self._save()
+                except OSError as e:
+                    print(f"Warning: failed to save selector preferences: {e}")
+
+    def stats(self):
+        """Preferred locator, timeouts and per-locator match counts and times for each group"""
+        with self.lock:
+            groups = {}
+            for group in set(self.timings) | set(self.timeouts) | set(self.preferred):
+                selectors = {}
+                for key, values in self.timings.get(group, {}).items():
+                    ordered = sorted(values)
+                    selectors[key] = {
+                        "matches": len(ordered),
+                        "median_seconds": round(ordered[len(ordered) // 2], 3),
+                        "max_seconds": round(ordered[-1], 3),
+                    }
+                groups[group] = {
+                    "preferred": self.preferred.get(group),
+                    "timeouts": self.timeouts.get(group, 0),
+                    "selectors": selectors,
+                }
+            return groups
+
+
+_shared_resolver = None
+_shared_lock = threading.Lock()
+
+
+def shared_resolver():
+    """Process-wide resolver whose learned preferences persist at SELECTOR_PREFERENCES_PATH"""
+    global _shared_resolver
+    with _shared_lock:
+        if _shared_resolver is None:
+            _shared_resolver = SelectorResolver(
+                path=os.getenv('SELECTOR_PREFERENCES_PATH', os.path.join('data', 'selector_preferences.json')),
+            )
+        return _shared_resolver
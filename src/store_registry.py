@@ -0,0 +1,63 @@
+import os
+from urllib.parse import quote
+
+FLIPP_HOME_URL = "https://flipp.com/"
+
+# Grocers whose flyers are on Flipp, keyed by the short name used in requests and env vars.
+# "search" is the merchant name Flipp's search page is opened with.
+STORES = {
+    "nofrills": {"name": "No Frills", "search": "No Frills"},
+    "freshco": {"name": "FreshCo", "search": "FreshCo"},
+    "foodbasics": {"name": "Food Basics", "search": "Food Basics"},
+    "walmart": {"name": "Walmart", "search": "Walmart"},
+    "superstore": {"name": "Real Canadian Superstore", "search": "Real Canadian Superstore"},
+    "metro": {"name": "Metro", "search": "Metro"},
+    "loblaws": {"name": "Loblaws", "search": "Loblaws"},
+    "sobeys": {"name": "Sobeys", "search": "Sobeys"},
+    "giant_tiger": {"name": "Giant Tiger", "search": "Giant Tiger"},
+    "tnt": {"name": "T&T Supermarket", "search": "T&T Supermarket"},
+}
+
+DEFAULT_STORE = "nofrills"
+
+
+def normalize_store_key(store):
+    """Registry key for a key or display name: "Food Basics" -> "foodbasics"; raises ValueError if unknown"""
+    value = (store or "").strip().lower()
+    if value in STORES:
+        return value
+    for key, info in STORES.items():
+        if value.replace(" ", "") in (info["name"].lower().replace(" ", ""), key.replace("_", "")):
+            return key
+    raise ValueError(f"Unknown store {store!r}; known stores: {', '.join(STORES)}")
+
+
+def store_name(store):
+    return STORES[normalize_store_key(store)]["name"]
+
+
+def store_search_path(store):
+    """Flipp search path listing a store's flyers, e.g. /search/No%20Frills"""
+    return "/search/" + quote(STORES[normalize_store_key(store)]["search"])
+
+
+def store_search_url(store, base_url=FLIPP_HOME_URL):
+    return base_url.rstrip('/') + store_search_path(store)
+
+
+def parse_stores(value):
+    """Registry keys from a list or comma-separated string, in order without duplicates"""
+    if isinstance(value, str):
+        value = value.split(",")
+    keys = []
+    for store in value or []:
+        if str(store).strip():
+            key = normalize_store_key(store)
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+
+def stores_from_env():
+    """Stores compared when a request names none (FLYER_STORES, default No Frills only)"""
+    return parse_stores(os.getenv('FLYER_STORES', DEFAULT_STORE)) or [DEFAULT_STORE]
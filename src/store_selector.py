@@ -9,10 +9,39 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 import time
 
+from flyer_cache import normalize_postal_code
+from page_readiness import enable_readiness_tracking
+from resource_blocking import apply_blocking, blocking_patterns_from_env
+from selector_resolver import shared_resolver
+from store_registry import DEFAULT_STORE, FLIPP_HOME_URL, store_search_url
+
+FLYER_SEARCH_URL = store_search_url(DEFAULT_STORE)
+
+# Candidate locators in priority order; generic ones only count after the specific ones had a moment
+POSTAL_INPUT_LOCATORS = [
+    (By.CSS_SELECTOR, 'input[data-cy="postalCodeInput"]'),
+    (By.CSS_SELECTOR, 'input[placeholder*="postal" i]'),
+    (By.CSS_SELECTOR, 'input[type="text"]'),
+]
+POSTAL_INPUT_FALLBACKS = POSTAL_INPUT_LOCATORS[2:]
+START_BUTTON_LOCATORS = [
+    (By.CSS_SELECTOR, 'a[data-cy="startSaving"]'),
+    (By.CSS_SELECTOR, 'button[data-cy="startSaving"]'),
+    (By.CSS_SELECTOR, 'a[href*="/flyers"]'),
+    (By.XPATH, "//a[contains(text(), 'Start')] | //button[contains(text(), 'Start')]"),
+]
+START_BUTTON_FALLBACKS = START_BUTTON_LOCATORS[2:]
+
 class FlippStoreSelector:
-    def __init__(self, headless=True):
+    def __init__(self, headless=True, session_store=None, blocking_profile=None, resolver=None):
         self.headless = headless
         self.driver = None
+        self.resolver = resolver or shared_resolver()
+        # URL blocking profile (BROWSER_BLOCK_PROFILE when not given): off, trackers or lean
+        self.blocking_profile = blocking_profile
+        # Optional FlippSessionStore; restored sessions skip consent and postal entry
+        self.session_store = session_store
+        self.last_select_stats = None
         
     def setup_driver(self):
         """Initialize Chromium driver with options"""
@@ -26,13 +55,85 @@ class FlippStoreSelector:
         chrome_options.add_argument('--window-size=1920,1080')
         chrome_options.add_argument('--disable-blink-features=AutomationControlled')
         chrome_options.add_argument('--user-agent=Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+        # CDP network events in the performance log drive page readiness checks
+        chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
         
         service = Service('/usr/bin/chromedriver')
         self.driver = webdriver.Chrome(service=service, options=chrome_options)
         self.driver.implicitly_wait(10)
+        enable_readiness_tracking(self.driver)
+        # Skip ads, trackers, fonts and media; only the postal form and flyer images matter
+        apply_blocking(self.driver, blocking_patterns_from_env(self.blocking_profile))
         
-    def select_store(self, postal_code="L6E1T8"):
-        """Navigate to Flipp and set postal code"""
+    def _page_postal_code(self, timeout):
+        """Postal code Flipp shows the page for (the <html postalcode> attribute), or None"""
+        try:
+            value = WebDriverWait(self.driver, timeout, poll_frequency=0.1).until(
+                lambda d: d.execute_script("return document.documentElement.getAttribute('postalcode')")
+            )
+            return normalize_postal_code(value)
+        except TimeoutException:
+            return None
+
+    def _on_flipp(self):
+        try:
+            return self.driver.current_url.startswith(FLIPP_HOME_URL)
+        except Exception:
+            return False
+
+    def _clear_session(self):
+        """Forget the location (and consent) left behind by the previous postal code"""
+        self.driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        if self._on_flipp():
+            self.driver.execute_script("window.localStorage.clear();")
+
+    def _save_session(self, postal_code):
+        """Store this browser's Flipp cookies and localStorage for the postal code"""
+        try:
+            if self._page_postal_code(timeout=3) != normalize_postal_code(postal_code):
+                print("Flipp has not confirmed the postal code yet; not saving the session")
+                return
+            cookies = self.driver.execute_cdp_cmd('Network.getCookies', {'urls': [FLIPP_HOME_URL]})['cookies']
+            local_storage = self.driver.execute_script("return Object.assign({}, window.localStorage);")
+            self.session_store.save(postal_code, cookies, local_storage)
+        except Exception as e:
+            print(f"Warning: failed to save Flipp session: {e}")
+
+    def _restore_session(self, postal_code, store=DEFAULT_STORE):
+        """Load the saved session for a postal code and open the store's flyers.
+
+        Returns "warm" if Flipp shows that location, "miss" if it does not, None without a saved session.
+        """
+        session = self.session_store.load(postal_code)
+        if not session:
+            return None
+        try:
+            self._clear_session()
+            if session["cookies"]:
+                self.driver.execute_cdp_cmd('Network.setCookies', {'cookies': session["cookies"]})
+            if session["local_storage"]:
+                # localStorage can only be written from the flipp.com origin
+                if not self._on_flipp():
+                    self.driver.get(FLIPP_HOME_URL)
+                self.driver.execute_script(
+                    "for (const [key, value] of Object.entries(arguments[0])) window.localStorage.setItem(key, value);",
+                    session["local_storage"],
+                )
+            self.driver.get(store_search_url(store))
+            location = self._page_postal_code(timeout=5)
+        except Exception as e:
+            print(f"Warning: failed to restore Flipp session: {e}")
+            location = None
+        if location == normalize_postal_code(postal_code):
+            return "warm"
+        print(f"Restored Flipp session shows postal code {location}, not {postal_code}; entering it again")
+        self.session_store.discard(postal_code)
+        return "miss"
+
+    def select_store(self, postal_code="L6E1T8", store=DEFAULT_STORE):
+        """Navigate to Flipp and set postal code (a restored session opens `store`'s flyers directly)"""
+        started = time.monotonic()
+        path = "cold"
         try:
             # Ensure the driver is initialized. If not, initialize now.
             if not self.driver:
@@ -42,25 +143,41 @@ class FlippStoreSelector:
                 except Exception as e:
                     print(f"Failed to initialize driver in select_store: {e}")
                     raise
+
+            restored = self._restore_session(postal_code, store) if self.session_store else None
+            if restored == "warm":
+                seconds = time.monotonic() - started
+                self.session_store.record("warm", seconds)
+                self.last_select_stats = {"path": "warm", "seconds": round(seconds, 3)}
+                print(f"Postal code set from saved session in {seconds:.2f}s (skipped consent and postal entry)")
+                return True
+            if restored == "miss":
+                path = "miss"
+
             # Only navigate if we're not already on Flipp to save time
             try:
                 current = self.driver.current_url if self.driver else ""
             except Exception:
                 current = ""
 
-            if not current or "flipp.com" not in current:
+            if not current or "flipp.com" not in current or restored == "miss":
                 print(f"Navigating to Flipp.com...")
-                self.driver.get("https://flipp.com/")
-                time.sleep(0.5)
+                self.driver.get(FLIPP_HOME_URL)
             
-            # Quick consent handling - just check the most common button
+            # Quick consent handling: wait for the banner or the postal input, whichever shows up first
             try:
-                consent_btn = WebDriverWait(self.driver, 3).until(
-                    EC.element_to_be_clickable((By.CSS_SELECTOR, 'button.cky-btn-accept'))
+                WebDriverWait(self.driver, 3, poll_frequency=0.1).until(
+                    lambda d: d.execute_script(
+                        "return !!document.querySelector('button.cky-btn-accept, input[data-cy=\"postalCodeInput\"]');"
+                    )
+                )
+                consent_buttons = self.driver.execute_script(
+                    "return Array.from(document.querySelectorAll('button.cky-btn-accept')).filter(b => b.offsetParent);"
                 )
-                print("Clicking consent button")
-                consent_btn.click()
-                time.sleep(0.3)
+                if consent_buttons:
+                    print("Clicking consent button")
+                    consent_buttons[0].click()
+                    WebDriverWait(self.driver, 2, poll_frequency=0.1).until(EC.invisibility_of_element(consent_buttons[0]))
             except TimeoutException:
                 # No consent banner found, continue
                 pass
@@ -68,29 +185,17 @@ class FlippStoreSelector:
                 # Consent handling failed, but continue anyway
                 pass
 
-            # Find the postal code input field with multiple fallback selectors
+            # Find the postal code input field, racing all candidate selectors in one wait
             print(f"Entering postal code: {postal_code}")
-            postal_input = None
-            selectors = [
-                'input[data-cy="postalCodeInput"]',
-                'input[placeholder*="postal" i]',
-                'input[type="text"]'
-            ]
-            
-            for i, selector in enumerate(selectors):
-                try:
-                    # Use shorter timeout for fallbacks (2s instead of 5s)
-                    timeout = 6 if i == 0 else 2
-                    postal_input = WebDriverWait(self.driver, timeout).until(
-                        EC.presence_of_element_located((By.CSS_SELECTOR, selector))
-                    )
-                    print(f"Found postal input with selector: {selector}")
-                    break
-                except TimeoutException:
-                    continue
-            
-            if not postal_input:
+            resolve_started = time.monotonic()
+            try:
+                postal_input, locator = self.resolver.resolve(
+                    self.driver, "postal_input", POSTAL_INPUT_LOCATORS, timeout=8, fallbacks=POSTAL_INPUT_FALLBACKS
+                )
+            except TimeoutException:
                 raise Exception("Could not find postal code input field with any selector")
+            selectors = {"postal_input": {"selector": locator[1], "seconds": round(time.monotonic() - resolve_started, 3)}}
+            print(f"Found postal input with selector: {locator[1]}")
 
             # Set input value using JavaScript (fastest method)
             self.driver.execute_script(
@@ -98,7 +203,6 @@ class FlippStoreSelector:
                 postal_input,
                 postal_code,
             )
-            time.sleep(0.2)
             
             # Verify and fallback to send_keys only if needed
             current_value = postal_input.get_attribute('value')
@@ -106,51 +210,36 @@ class FlippStoreSelector:
                 print("JS method didn't work, trying send_keys...")
                 postal_input.clear()
                 postal_input.send_keys(postal_code)
-                time.sleep(0.2)
 
-            # Click the start button with multiple fallback selectors
+            # Click the start button, racing all candidate selectors in one wait
             print("Clicking Start Saving button...")
-            start_button = None
-            button_selectors = [
-                'a[data-cy="startSaving"]',
-                'button[data-cy="startSaving"]',
-                'a[href*="/flyers"]'
-            ]
-            
-            for i, selector in enumerate(button_selectors):
-                try:
-                    # Use shorter timeout for fallbacks (2s instead of 5s)
-                    timeout = 6 if i == 0 else 2
-                    start_button = WebDriverWait(self.driver, timeout).until(
-                        EC.element_to_be_clickable((By.CSS_SELECTOR, selector))
-                    )
-                    print(f"Found start button with selector: {selector}")
-                    break
-                except TimeoutException:
-                    continue
-            
-            if not start_button:
-                # Try XPath for text-based search as last resort
-                try:
-                    start_button = WebDriverWait(self.driver, 3).until(
-                        EC.element_to_be_clickable((By.XPATH, "//a[contains(text(), 'Start')] | //button[contains(text(), 'Start')]"))
-                    )
-                    print("Found start button with XPath")
-                except TimeoutException:
-                    raise Exception("Could not find Start Saving button with any selector")
+            resolve_started = time.monotonic()
+            try:
+                start_button, locator = self.resolver.resolve(
+                    self.driver, "start_button", START_BUTTON_LOCATORS, timeout=8, clickable=True,
+                    fallbacks=START_BUTTON_FALLBACKS,
+                )
+            except TimeoutException:
+                raise Exception("Could not find Start Saving button with any selector")
+            selectors["start_button"] = {"selector": locator[1], "seconds": round(time.monotonic() - resolve_started, 3)}
+            print(f"Found start button with selector: {locator[1]}")
             
             start_button.click()
-            time.sleep(1)  # Wait for navigation
 
             # Quick verification that navigation started
             try:
-                WebDriverWait(self.driver, 5).until(
+                WebDriverWait(self.driver, 5, poll_frequency=0.1).until(
                     lambda d: "flyers" in d.current_url.lower()
                 )
             except TimeoutException:
                 pass  # Continue anyway, flyer_downloader will handle if page isn't ready
 
-            print("Postal code set successfully!")
+            seconds = time.monotonic() - started
+            self.last_select_stats = {"path": path, "seconds": round(seconds, 3), "selectors": selectors}
+            if self.session_store:
+                self.session_store.record(path, seconds)
+                self._save_session(postal_code)
+            print(f"Postal code set successfully in {seconds:.2f}s!")
             return True
             
         except Exception as e:
@@ -2,7 +2,7 @@
 document.addEventListener('DOMContentLoaded', async () => {
     await loadDefaultConfig();
     checkForExistingResults();
-    startStatusPolling();
+    watchJobs();
 });
 
 // Load default config from backend
@@ -15,6 +15,7 @@ async function loadDefaultConfig() {
         document.getElementById('numPeople').value = config.num_people;
         document.getElementById('numMeals').value = config.num_meals;
         document.getElementById('cuisine').value = config.cuisine;
+        await loadStores(config.stores || []);
 
         // Pre-fill Discord webhook if available
         if (config.discord_webhook_url) {
@@ -25,6 +26,60 @@ async function loadDefaultConfig() {
     }
 }
 
+// Render a checkbox per registered store, checking the configured defaults
+async function loadStores(defaultStores) {
+    const container = document.getElementById('storeOptions');
+    if (!container) return;
+    try {
+        const response = await fetch('/api/stores');
+        const registry = await response.json();
+        container.innerHTML = '';
+        registry.stores.forEach(store => {
+            const label = document.createElement('label');
+            const checkbox = document.createElement('input');
+            checkbox.type = 'checkbox';
+            checkbox.name = 'stores';
+            checkbox.value = store.key;
+            checkbox.checked = defaultStores.includes(store.key);
+            label.appendChild(checkbox);
+            label.appendChild(document.createTextNode(store.name));
+            container.appendChild(label);
+        });
+    } catch (error) {
+        console.error('Error loading stores:', error);
+    }
+}
+
+// Registry keys of the checked stores (empty means the server default)
+function selectedStores() {
+    return Array.from(document.querySelectorAll('#storeOptions input[name="stores"]:checked'))
+        .map(checkbox => checkbox.value);
+}
+
+// ID of the job this tab is following (null means "latest completed job")
+let currentJobId = null;
+
+// Jobs started in this tab, kept across reloads so a refreshed page picks its own job back up.
+// Other people's jobs also appear on /api/events and must never be shown here.
+const OWN_JOBS_KEY = 'ownJobIds';
+
+function ownJobIds() {
+    try {
+        return JSON.parse(sessionStorage.getItem(OWN_JOBS_KEY)) || [];
+    } catch (error) {
+        return [];
+    }
+}
+
+function rememberOwnJob(jobId) {
+    const ids = ownJobIds().filter((id) => id !== jobId).concat(jobId).slice(-20);
+    try {
+        sessionStorage.setItem(OWN_JOBS_KEY, JSON.stringify(ids));
+    } catch (error) {
+        console.error('Could not remember job:', error);
+    }
+}
+
 // Check if there are existing results
 async function checkForExistingResults() {
     try {
@@ -86,6 +141,7 @@ if (generateBtn) {
             num_meals: parseInt(numMeals.value),
             cuisine: cuisine.value.trim(),
             special_notes: specialNotes ? specialNotes.value.trim() : '',
+            stores: selectedStores(),
             headless: true,
             auto_send_discord: true
         };
@@ -111,11 +167,15 @@ if (generateBtn) {
                 throw new Error(error.detail || 'Failed to start generation');
             }
 
+            const job = await response.json();
+            currentJobId = job.job_id;
+            rememberOwnJob(currentJobId);
+
             // Mark that we want to auto-send to Discord when generation completes
             window.__autoSendToDiscord = true;
 
-            // Start polling for status
-            pollStatus();
+            // Follow pushed progress and meal plan text (polling if streaming is unavailable)
+            if (!followJobStream(currentJobId)) pollStatus();
 
         } catch (error) {
             showError(error.message);
@@ -126,32 +186,67 @@ if (generateBtn) {
     });
 }
 
-// Poll for status updates
+// Show a job's stage, queue position and progress
+function renderStatus(status) {
+    const statusText = document.getElementById('statusText');
+    if (statusText) {
+        let message = status.status_message || 'Processing...';
+        if (status.status === 'queued' && status.queue_position) {
+            message += ` (${status.queue_position} ahead in queue)`;
+        }
+        statusText.textContent = message;
+    }
+
+    const progressBar = document.getElementById('statusProgress');
+    if (progressBar) {
+        const progress = status.progress;
+        if (progress && progress.total) {
+            progressBar.max = progress.total;
+            progressBar.value = progress.done || 0;
+            progressBar.style.display = 'block';
+        } else {
+            progressBar.style.display = 'none';
+        }
+    }
+}
+
+async function handleJobCompleted() {
+    const statusSection = document.getElementById('statusSection');
+    if (statusSection) statusSection.style.display = 'none';
+    safeSetDisabled(generateBtn, false);
+    await displayRecommendations();
+    showSuccess('Recommendations generated successfully!');
+    // Auto-send is handled by backend, no need to send again from frontend
+}
+
+function handleJobFailed(message) {
+    const statusSection = document.getElementById('statusSection');
+    if (statusSection) statusSection.style.display = 'none';
+    safeSetDisabled(generateBtn, false);
+    showError(message);
+}
+
+// Poll for status updates (fallback when the server push stream is unavailable)
 let statusPollingInterval = null;
 
 function pollStatus() {
+    if (statusPollingInterval !== null) clearInterval(statusPollingInterval);
     statusPollingInterval = setInterval(async () => {
         try {
-            const response = await fetch('/api/status');
+            const statusUrl = currentJobId ? `/api/jobs/${currentJobId}` : '/api/status';
+            const response = await fetch(statusUrl);
             const status = await response.json();
 
-            if (status.status === 'processing') {
-                const statusText = document.getElementById('statusText');
-                if (statusText) statusText.textContent = status.status_message || 'Processing...';
+            if (status.status === 'processing' || status.status === 'queued') {
+                renderStatus(status);
             } else if (status.status === 'completed') {
                 clearInterval(statusPollingInterval);
-                const statusSection = document.getElementById('statusSection');
-                if (statusSection) statusSection.style.display = 'none';
-                safeSetDisabled(generateBtn, false);
-                await displayRecommendations();
-                showSuccess('Recommendations generated successfully!');
-                // Auto-send is handled by backend, no need to send again from frontend
+                statusPollingInterval = null;
+                await handleJobCompleted();
             } else if (status.status === 'error') {
                 clearInterval(statusPollingInterval);
-                const statusSection = document.getElementById('statusSection');
-                if (statusSection) statusSection.style.display = 'none';
-                if (generateBtn) generateBtn.disabled = false;
-                showError(status.status_message || `Error: ${status.error}`);
+                statusPollingInterval = null;
+                handleJobFailed(status.status_message || `Error: ${status.error}`);
             }
         } catch (error) {
             console.error('Error polling status:', error);
@@ -159,21 +254,114 @@ function pollStatus() {
     }, 1000);
 }
 
-// Background status polling for page refresh scenarios
+// Job progress and live meal plan text pushed by the server (Server-Sent Events).
+// Returns false when the browser cannot stream, so the caller falls back to polling.
+let jobEventSource = null;
+
+function followJobStream(jobId) {
+    if (!window.EventSource || !jobId) return false;
+    if (jobEventSource) jobEventSource.close();
+    const source = new EventSource(`/api/jobs/${jobId}/events`);
+    jobEventSource = source;
+    let started = false;
+    let finished = false;
+
+    const close = () => {
+        finished = true;
+        source.close();
+        if (jobEventSource === source) jobEventSource = null;
+    };
+
+    source.addEventListener('status', async (e) => {
+        const status = JSON.parse(e.data);
+        if (status.status === 'completed') {
+            close();
+            await handleJobCompleted();
+        } else if (status.status === 'error') {
+            close();
+            handleJobFailed(status.status_message || 'Generation failed');
+        } else {
+            renderStatus(status);
+        }
+    });
+
+    source.addEventListener('token', (e) => {
+        const event = JSON.parse(e.data);
+        const recommendations = document.getElementById('recommendations');
+        if (!started) {
+            started = true;
+            const resultsPanel = document.getElementById('resultsPanel');
+            const flyerSection = document.getElementById('flyerSection');
+            if (recommendations) recommendations.textContent = '';
+            if (flyerSection) flyerSection.style.display = 'none';
+            if (resultsPanel) resultsPanel.style.display = 'block';
+        }
+        if (recommendations) recommendations.textContent += event.text;
+    });
+
+    source.addEventListener('end', close);
+
+    // EventSource reconnects by itself after network blips; if it gives up, poll instead
+    source.onerror = () => {
+        if (!finished && source.readyState === EventSource.CLOSED) {
+            close();
+            pollStatus();
+        }
+    };
+    return true;
+}
+
+// Pick a job this tab started back up after a page refresh (jobs of other tabs and users are ignored)
+function adoptJob(status) {
+    if (jobEventSource !== null || statusPollingInterval !== null) return;
+    if (!ownJobIds().includes(status.job_id)) return;
+    currentJobId = status.job_id;
+    safeSetDisabled(generateBtn, true);
+    const statusSection = document.getElementById('statusSection');
+    if (statusSection) statusSection.style.display = 'block';
+    renderStatus(status);
+    if (!followJobStream(currentJobId)) pollStatus();
+}
+
+// Resume this tab's most recent job if it is still running (it may no longer be the latest job overall)
+async function resumeOwnJob() {
+    const ids = ownJobIds();
+    if (!ids.length) return;
+    try {
+        const response = await fetch(`/api/jobs/${ids[ids.length - 1]}`);
+        if (!response.ok) return;
+        const status = await response.json();
+        if (status.status === 'processing' || status.status === 'queued') adoptJob(status);
+    } catch (error) {
+        console.error('Error resuming job:', error);
+    }
+}
+
+// Watch job status pushes for this tab's own jobs: one stream per tab instead of periodic polling
+function watchJobs() {
+    resumeOwnJob();
+    if (!window.EventSource) {
+        startStatusPolling();
+        return;
+    }
+    const source = new EventSource('/api/events');
+    source.addEventListener('status', (e) => {
+        const status = JSON.parse(e.data);
+        if (status.status === 'processing' || status.status === 'queued') adoptJob(status);
+    });
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) startStatusPolling();
+    };
+}
+
+// Background status polling for page refresh scenarios (fallback for watchJobs)
 function startStatusPolling() {
     setInterval(async () => {
         try {
             const response = await fetch('/api/status');
             const status = await response.json();
 
-            if (status.status === 'processing' && statusPollingInterval === null) {
-                safeSetDisabled(generateBtn, true);
-                const statusSection = document.getElementById('statusSection');
-                const statusText = document.getElementById('statusText');
-                if (statusSection) statusSection.style.display = 'block';
-                if (statusText) statusText.textContent = status.status_message || 'Processing...';
-                pollStatus();
-            }
+            if (status.status === 'processing' || status.status === 'queued') adoptJob(status);
         } catch (error) {
             console.error('Error in background polling:', error);
         }
@@ -183,7 +371,8 @@ function startStatusPolling() {
 // Display recommendations
 async function displayRecommendations() {
     try {
-        const response = await fetch('/api/recommendations');
+        const recommendationsUrl = currentJobId ? `/api/jobs/${currentJobId}/recommendations` : '/api/recommendations';
+        const response = await fetch(recommendationsUrl);
         const data = await response.json();
 
         const recommendations = document.getElementById('recommendations');
@@ -195,7 +384,7 @@ async function displayRecommendations() {
         if (data.flyer_image) {
             const flyerImage = document.getElementById('flyerImage');
             const flyerSection = document.getElementById('flyerSection');
-            if (flyerImage) flyerImage.src = `/api/flyer-image?t=${Date.now()}`;
+            if (flyerImage) flyerImage.src = `/api/jobs/${data.job_id}/flyer-image?t=${Date.now()}`;
             if (flyerSection) flyerSection.style.display = 'block';
         }
 
@@ -254,7 +443,7 @@ async function sendToDiscord(webhookUrl) {
     const response = await fetch('/api/send-discord', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ webhook_url: webhookUrl })
+        body: JSON.stringify({ webhook_url: webhookUrl, job_id: currentJobId })
     });
 
     if (!response.ok) {